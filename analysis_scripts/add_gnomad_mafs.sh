@@ -1,12 +1,19 @@
 #!/bin/bash
 
 ### This script assumes bcftools and python 3.10 are in PATH
+### For large cohorts use the batch mode instead, which gives the same output in one pass:
+### python $SCRIPT --cohort_tsv $DIAG_TSV --gnomad_vcf $GNOMAD --output $OUTPUT
 
 DIAG_TSV=## Put filepath here
 UNDIAG_TSV= ## Put filepath here
 SCRIPT=## Put filepath here
 GNOMAD=## Put filepath here
 OUTPUT=## Put filepath here
+## Optional: to use a running annotation_server.py, set CLIENT to the path of annotation_client.py
+## and SOCKET to the server socket: one client process then sends every variant over a single connection.
+## Leave SOCKET empty to run $SCRIPT per variant.
+CLIENT=
+SOCKET=
 
 # Read through the file line by line, skipping the first line (header)
 {
@@ -18,6 +25,11 @@ OUTPUT=## Put filepath here
     while IFS=$'\t' read -r gnomad_id rest; do
         IFS="-" read -r CHR POS REF ALT <<< "$gnomad_id"
         gnomad_query=$(bcftools query -r "chr$CHR:$POS" -i "REF=\"$REF\" && ALT=\"$ALT\"" -f '%INFO\n' $GNOMAD)
-        python $SCRIPT "$gnomad_id" "$rest" "$gnomad_query" >> $OUTPUT
-    done
+        if [[ -n "$SOCKET" ]]; then
+            # One request record for the batch client below
+            printf '%s\0' gnomad "$gnomad_id" "$rest" "$gnomad_query"
+        else
+            python $SCRIPT "$gnomad_id" "$rest" "$gnomad_query"
+        fi
+    done | if [[ -n "$SOCKET" ]]; then python $CLIENT --socket $SOCKET --batch; else cat; fi >> $OUTPUT
 } < "$DIAG_TSV"
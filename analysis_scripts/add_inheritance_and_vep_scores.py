@@ -1,144 +1,114 @@
 import argparse
+from multiprocessing import Pool
 import pandas as pd
 import numpy as np
-from queue import Queue
-
-def get_inheritance(omim_tsv, uniprot_id):
-    # Gets inheritance modes from OMIM TSV file
-    try:
-        inheritance = omim_tsv.loc[omim_tsv['uniprot_id'] == uniprot_id]['inheritance'].values
-    except IndexError:
-        inheritance = None
-    return inheritance
-
-def get_vep_scores(vep_scores, substitution):
-    # Gets VEP scores from VEP directory
+from vep_percentiles import PercentileTable, add_percentile_columns
+from vep_store import VepStore, is_vep_store
+
+VEP_COLUMNS = ['ESM-1v', 'AlphaMissense', 'CPT', 'GEMME', 'popEVE']
+# Shards per worker process, several so that proteins with many variants do not leave the other workers idle
+SHARDS_PER_WORKER = 4
+
+def load_vep_frame(vep_dir, uniprot_id):
+    '''
+    Read the VEP CSV of one protein into a frame of variant and the five predictor columns, with "." for predictors
+    missing from the CSV and the first row kept for duplicated substitutions. Returns None if the CSV is missing,
+    empty or unreadable.
+    '''
     try:
-        correct_row = vep_scores.loc[vep_scores['variant'] == substitution]
-        if "ESM-1v" in correct_row.columns:
-            esm_1v = correct_row['ESM-1v'].values[0]
-        else:
-            esm_1v = None
-        if "AlphaMissense" in correct_row.columns:
-            alphamissense = correct_row['AlphaMissense'].values[0]
-        else:
-            alphamissense = None
-        if "CPT" in correct_row.columns:
-            cpt = correct_row['CPT'].values[0]
-        else:
-            cpt = None
-        if "GEMME" in correct_row.columns:
-            gemme = correct_row['GEMME'].values[0]
-        else:
-            gemme = None
-        if "popEVE" in correct_row.columns:
-            popeve = correct_row['popEVE'].values[0]
-        else:
-            popeve = None
-
+        vep_scores = pd.read_csv(f"{vep_dir}/{uniprot_id}.csv")
+    except FileNotFoundError:
+        print(f"File not found: {vep_dir}/{uniprot_id}.csv")
+        return None
+    except pd.errors.EmptyDataError:
+        print(f"Empty data: {vep_dir}/{uniprot_id}.csv")
+        return None
     except Exception as e:
         print(e)
-        esm_1v, alphamissense, cpt, gemme, popeve = None, None, None, None, None
-    
-    return(esm_1v, alphamissense, cpt, gemme, popeve)
-
-
-def worker(queue, modified_rows, omim_tsv, vep_dir):
-    while not queue.empty():
-        index, row = queue.get()
-        try:
-            uniprot_id = row['uniprot_id']
-            wild_type = row['wild_type']
-            mutant = row['mutant']
-            uniprot_start = row['uniprot_start']
-            substitution = str(wild_type) + str(uniprot_start) + str(mutant)
-            consequence = row['consequence']
-
-            # Get inheritance information from the OMIM data
-            inheritance = get_inheritance(omim_tsv, uniprot_id)
-
-            # Initialize variables for VEP scores
-            esm_1v, alphamissense, cpt, gemme, popeve = None, None, None, None, None
-            
-            # If the consequence is missense_variant, get VEP scores
-            if consequence == "missense_variant":
-                try:
-                    vep_scores = pd.read_csv(f"{vep_dir}/{uniprot_id}.csv")
-                    esm_1v, alphamissense, cpt, gemme, popeve = get_vep_scores(vep_scores, substitution)
-                    print(esm_1v, alphamissense, cpt, gemme, popeve)
-                except Exception as e: ### This line used to be filenotfounderror but I expanded it to all exceptions since I think theres some CSVs that are empty but exist
-                    print(e)
-                    pass  # Keep None values as initialized
-
-            # Append the modified row with new columns
-            modified_row = row.tolist() + [inheritance.tolist(), esm_1v, alphamissense, cpt, gemme, popeve]
-            modified_rows.append(modified_row)
-
-        finally:
-            queue.task_done()
-
-def main(probands, omim, vep_dir):
+        return None
+    if 'variant' not in vep_scores.columns:
+        print(f"No variant column: {vep_dir}/{uniprot_id}.csv")
+        return None
+    vep_scores = vep_scores.drop_duplicates(subset='variant', keep='first')
+    # Object columns keep each CSV's own number formatting when the proteins are concatenated
+    return pd.DataFrame({'variant': vep_scores['variant'].values,
+                         **{column: vep_scores[column].astype(object).values if column in vep_scores.columns else "." for column in VEP_COLUMNS}})
+
+
+def lookup_vep_scores(vep_dir, missense):
+    '''
+    Return the five VEP scores of each (uniprot_id, variant) row of missense as an object matrix, "." for missing
+    proteins, substitutions and predictors, together with the number of proteins looked up.
+    The rows are grouped by protein, so each protein's CSV is read once.
+    '''
+    values = np.full((len(missense), len(VEP_COLUMNS)), ".", dtype=object)
+    proteins = missense['uniprot_id'].dropna().unique()
+    frames = []
+    for uniprot_id in proteins:
+        vep_frame = load_vep_frame(vep_dir, uniprot_id)
+        if vep_frame is not None:
+            frames.append(vep_frame.assign(uniprot_id=uniprot_id))
+    if frames:
+        vep_frame = pd.concat(frames, ignore_index=True)
+        # Left hash join on (uniprot_id, variant), the VEP keys are unique so the missense rows keep their order
+        merged = missense.merge(vep_frame, on=['uniprot_id', 'variant'], how='left', indicator=True)
+        found = (merged['_merge'] == 'both').values
+        # NaN scores are kept and written as empty fields
+        values[found] = merged.loc[found, VEP_COLUMNS].values
+    return values, len(proteins)
+
+def worker(task):
+    # Looks up the VEP scores of one shard of proteins in a worker process, the shard owns all rows of its proteins
+    vep_dir, rows, missense = task
+    values, n_proteins = lookup_vep_scores(vep_dir, missense)
+    return rows, values, n_proteins
+
+def main(probands, omim, vep_dir, workers=1):
     # Read the input files
     proband_tsv = pd.read_csv(probands, sep='\t')
     omim_tsv = pd.read_csv(omim, sep='\t')
-    
-    # Define the header for the output DataFrame
-    header = proband_tsv.columns.tolist() + ['inheritance', 'ESM-1v', 'AlphaMissense', 'CPT', 'GEMME', 'popEVE']
-    
-    # Create a list to store modified rows
-    modified_rows = []
-    
-    # Iterate over each row in the probands DataFrame
-    for index, row in proband_tsv.iterrows():
-        uniprot_id = row['uniprot_id']
-        wild_type = row['wild_type']
-        mutant = row['mutant']
-        uniprot_start = row['uniprot_start']
-        substitution = str(wild_type) + str(uniprot_start) + str(mutant)
-        consequence = row['consequence']
-        
-        # Get inheritance information from the OMIM data
-        inheritance = get_inheritance(omim_tsv, uniprot_id)
-        
-        # Initialize variables for VEP scores
-        esm_1v, alphamissense, cpt, gemme, popeve = None, None, None, None, None
-        
-        # If the consequence is missense_variant, get VEP scores
-        if consequence == "missense_variant":
-            try:
-                vep_scores = pd.read_csv(f"{vep_dir}/{uniprot_id}.csv")
-                esm_1v, alphamissense, cpt, gemme, popeve = get_vep_scores(vep_scores, substitution)
-                print(esm_1v, alphamissense, cpt, gemme, popeve)
-            except FileNotFoundError:
-                print(f"File not found: {vep_dir}/{uniprot_id}.csv")
-                # Keep None values as initialized
-            except pd.errors.EmptyDataError:
-                print(f"Empty data: {vep_dir}/{uniprot_id}.csv")
-                # Keep None values as initialized
-            except Exception as e:
-                print(e)
-                # Keep None values as initialized
-
-        previous_uniprot_id = uniprot_id
-
-        if esm_1v is None or esm_1v == np.nan:
-            esm_1v = "."
-        if alphamissense is None or alphamissense == np.nan:
-            alphamissense = "."
-        if cpt is None or cpt == np.nan:
-            cpt = "."
-        if gemme is None or gemme == np.nan:
-            gemme = "."
-        if popeve is None or popeve == np.nan:
-            popeve = "."
-
-        # Append the modified row with new columns
-        modified_row = row.tolist() + [inheritance.tolist(), esm_1v, alphamissense, cpt, gemme, popeve]
-        modified_rows.append(modified_row)
-    
-    # Create a new DataFrame with the modified rows and the updated header
-    modified_df = pd.DataFrame(modified_rows, columns=header)
-    
+    modified_df = proband_tsv.copy()
+
+    # Inheritance modes of each protein as one list in OMIM order, attached with a hash lookup per row
+    inheritance = omim_tsv.groupby('uniprot_id', sort=False)['inheritance'].agg(list)
+    modified_df['inheritance'] = [value if isinstance(value, list) else [] for value in proband_tsv['uniprot_id'].map(inheritance)]
+
+    # Substitution keys of the missense rows, e.g. A123T
+    is_missense = (proband_tsv['consequence'] == "missense_variant").values
+    missense = pd.DataFrame({
+        'uniprot_id': proband_tsv['uniprot_id'].values[is_missense],
+        'variant': (proband_tsv['wild_type'].astype(str) + proband_tsv['uniprot_start'].astype(str) + proband_tsv['mutant'].astype(str)).values[is_missense],
+    })
+
+    vep_values = np.full((len(proband_tsv), len(VEP_COLUMNS)), ".", dtype=object)
+    if is_vep_store(vep_dir):
+        # A store built with vep_store.py replaces the directory of CSVs, its lookups are vectorized so run serially
+        vep_values[is_missense] = VepStore(vep_dir).vep_score_matrix(missense['uniprot_id'].values, missense['variant'].values)
+        print(f"{len(missense)} VEP lookups in the VEP store {vep_dir}")
+    elif workers > 1:
+        # Shard the proteins round-robin, every VEP CSV is read by the one worker that owns the protein
+        proteins = missense['uniprot_id'].dropna().unique()
+        n_shards = min(workers * SHARDS_PER_WORKER, len(proteins))
+        protein_shards = pd.Series(np.arange(len(proteins)) % max(n_shards, 1), index=proteins)
+        shards = missense['uniprot_id'].map(protein_shards).values
+        tasks = [(vep_dir, rows, missense.iloc[rows]) for rows in (np.flatnonzero(shards == shard) for shard in range(n_shards))]
+        missense_values = np.full((len(missense), len(VEP_COLUMNS)), ".", dtype=object)
+        n_proteins = 0
+        with Pool(workers) as pool:
+            # Results are put back by row position, so the output does not depend on which shard finishes first
+            for rows, values, shard_proteins in pool.imap_unordered(worker, tasks):
+                missense_values[rows] = values
+                n_proteins += shard_proteins
+        vep_values[is_missense] = missense_values
+        print(f"{len(missense)} VEP lookups in {n_shards} shards on {workers} workers, {n_proteins} proteins")
+    else:
+        missense_values, n_proteins = lookup_vep_scores(vep_dir, missense)
+        vep_values[is_missense] = missense_values
+        print(f"{len(missense)} VEP lookups, {n_proteins} proteins")
+
+    for column_index, column in enumerate(VEP_COLUMNS):
+        modified_df[column] = vep_values[:, column_index]
+
     # Output the DataFrame
     return modified_df 
 
@@ -147,11 +117,17 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Prints the contents of a TSV file line by line.")
     parser.add_argument('proband_tsv', type=str, help="Path to the TSV file to be read")
     parser.add_argument('omim_tsv', type=str, help="Path to the TSV file to be read")
-    parser.add_argument('vep_dir', type=str, help="Path to the directory of VEP scores")
+    parser.add_argument('vep_dir', type=str, help="Path to the directory of VEP scores, or a store of them built with vep_store.py")
     parser.add_argument('output', type=str, help="Path to the output file")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes reading the VEP CSVs, each owning a shard of the proteins (default: 1)")
+
+    parser.add_argument('--percentiles', type=str, help="Percentile table from vep_percentiles.py build, adds proteome-wide {VEP}_percentile columns")
 
     args = parser.parse_args()
-    main(args.proband_tsv, args.omim_tsv, args.vep_dir).to_csv(args.output, sep='\t', index=False)
+    modified_df = main(args.proband_tsv, args.omim_tsv, args.vep_dir, args.workers)
+    if args.percentiles:
+        add_percentile_columns(modified_df, PercentileTable(args.percentiles))
+    modified_df.to_csv(args.output, sep='\t', index=False)
 
 
 
@@ -7,6 +7,11 @@ DIAG_VCF=## Put filepath here
 UNDIAG_VCF=## Put filepath here
 OUTPUT=## Put filepath here
 PED=## Put filepath here
+## Optional: to use a running annotation_server.py started with --ped $PED, set CLIENT to the path of annotation_client.py
+## and SOCKET to the server socket: one client process then sends every variant over a single connection.
+## Leave SOCKET empty to run $SCRIPT per variant.
+CLIENT=
+SOCKET=
 
 
 # Read through the file line by line, skipping the first line (header)
@@ -19,6 +24,11 @@ PED=## Put filepath here
     while IFS=$'\t' read -r gnomad_id rest; do
         IFS="-" read -r CHR POS REF ALT <<< "$gnomad_id"
         probands=$(bcftools query -r "chr$CHR:$POS" -i "REF=\"$REF\" & ALT=\"$ALT\"" $UNDIAG_VCF -f '[%SAMPLE:%GT\n]')
-        python $SCRIPT "$gnomad_id" "$rest" "$probands" --ped $PED >> $OUTPUT
-    done
+        if [[ -n "$SOCKET" ]]; then
+            # One request record for the batch client below
+            printf '%s\0' inheritance "$gnomad_id" "$rest" "$probands"
+        else
+            python $SCRIPT "$gnomad_id" "$rest" "$probands" --ped $PED
+        fi
+    done | if [[ -n "$SOCKET" ]]; then python $CLIENT --socket $SOCKET --batch; else cat; fi >> $OUTPUT
 } < "$UNDIAG_TSV"
@@ -0,0 +1,107 @@
+import argparse
+import json
+import socket
+import sys
+
+'''
+Thin client for annotation_server.py, called from the bash loops in place of format_gnomad_info.py / format_inheritance_info.py.
+It only imports the standard library so that starting it is cheap, and prints exactly what the original script would.
+
+With --batch, one client process reads every request of a loop from stdin and sends them over a single connection,
+so the loop pays the interpreter start-up once instead of once per variant. Requests are NUL-terminated fields,
+the command followed by its arguments, as written by printf '%s\0' (fields may span several lines):
+    printf '%s\0' gnomad "$gnomad_id" "$rest" "$gnomad_query"
+The outputs are printed in request order, one per request.
+
+Usage:
+    python annotation_client.py --socket /tmp/mpd_annotation.sock gnomad "$gnomad_id" "$rest" "$gnomad_query"
+    python annotation_client.py --socket /tmp/mpd_annotation.sock inheritance "$gnomad_id" "$rest" "$probands"
+    <loop printing requests> | python annotation_client.py --socket /tmp/mpd_annotation.sock --batch
+'''
+
+# Number of arguments of each command, to split the --batch fields into requests
+COMMAND_ARGS = {"gnomad": 3, "inheritance": 3, "ping": 0}
+
+
+def exchange(stream, command, args):
+    '''Send one request on an open connection and return its output, raising RuntimeError if the server reports an error.'''
+    stream.write((json.dumps({"command": command, "args": args}) + "\n").encode())
+    stream.flush()
+    line = stream.readline()
+    if not line:
+        raise ConnectionError("the server closed the connection")
+    response = json.loads(line)
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return response["output"]
+
+
+def request(socket_path, command, args):
+    '''Send one request to the server and return its output, raising RuntimeError if the server reports an error.'''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile('rwb') as stream:
+            return exchange(stream, command, args)
+
+
+def read_batch_requests(stream):
+    '''Yield (command, args) from NUL-terminated fields, each command followed by its COMMAND_ARGS arguments.'''
+    fields, buffer = [], b""
+    for block in iter(lambda: stream.read1(65536), b""):
+        buffer += block
+        *complete, buffer = buffer.split(b"\0")
+        for field in complete:
+            fields.append(field.decode())
+            command = fields[0]
+            if command not in COMMAND_ARGS:
+                raise RuntimeError(f"unknown command {command!r} in batch input")
+            if len(fields) == COMMAND_ARGS[command] + 1:
+                yield command, fields[1:]
+                fields = []
+    if fields or buffer:
+        raise RuntimeError("batch input ends in the middle of a request")
+
+
+def batch(socket_path, requests, out):
+    '''
+    Send every request over one connection and write each output on its own line.
+    Failed requests are reported on stderr and skipped, as a failing per-variant call would be.
+
+    :return: the number of failed requests
+    '''
+    n_failed = 0
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path)
+        with connection.makefile('rwb') as stream:
+            for command, args in requests:
+                try:
+                    out.write(exchange(stream, command, args) + "\n")
+                except RuntimeError as e:
+                    n_failed += 1
+                    sys.stderr.write(f"Annotation request failed for {args[0] if args else command}: {e}\n")
+    return n_failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send per-variant annotation requests to annotation_server.py.")
+    parser.add_argument("--socket", type=str, required=True, help="Path of the server's Unix socket.")
+    parser.add_argument("--batch", action="store_true", help="Read NUL-terminated requests from stdin and send them over one connection.")
+    parser.add_argument("command", type=str, nargs="?", choices=list(COMMAND_ARGS), help="The request type.")
+    parser.add_argument("args", type=str, nargs="*", help="The same positional arguments as the original script.")
+    args = parser.parse_args()
+    if args.batch == (args.command is not None):
+        parser.error("give either a command or --batch")
+
+    try:
+        if args.batch:
+            if batch(args.socket, read_batch_requests(sys.stdin.buffer), sys.stdout):
+                sys.exit(1)
+        else:
+            print(request(args.socket, args.command, args.args))
+    except (OSError, RuntimeError) as e:
+        sys.stderr.write(f"Annotation request failed: {e}\n")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
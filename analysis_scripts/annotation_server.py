@@ -0,0 +1,94 @@
+import argparse
+import json
+import os
+import signal
+import socketserver
+import sys
+from format_gnomad_info import format_gnomad_line
+from format_inheritance_info import format_inheritance_line, load_ped
+
+'''
+Long-lived annotation worker for the per-variant bash loops (add_gnomad_mafs.sh, add_inheritance_info.sh).
+
+Starting python for every variant costs hundreds of milliseconds, and format_inheritance_info.py re-reads the PED file
+each time. This server loads everything once, listens on a local Unix socket and answers the same per-variant requests,
+so each call only pays for the formatting itself. Use annotation_client.py to call it, with --batch to send every
+request of a loop over one connection from a single client process.
+
+Protocol: one JSON object per line, {"command": ..., "args": [...]}, answered by one JSON line,
+{"output": "..."} on success or {"error": "..."} on failure. Commands:
+    gnomad       [gnomad_id, rest, gnomad_query]   same output as format_gnomad_info.py
+    inheritance  [gnomad_id, rest, probands]       same output as format_inheritance_info.py (needs --ped)
+    ping         []                                returns "pong"
+
+Usage:
+    python annotation_server.py --socket /tmp/mpd_annotation.sock --ped cohort.ped &
+'''
+
+
+class AnnotationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, ped_file=None):
+        # Resources are loaded once and only read by the handlers
+        self.pedigree = load_ped(ped_file) if ped_file else None
+        self.commands = {
+            "gnomad": format_gnomad_line,
+            "inheritance": self.inheritance,
+            "ping": lambda: "pong",
+        }
+        super().__init__(socket_path, AnnotationRequestHandler)
+
+    def inheritance(self, gnomad_id, rest, probands):
+        if self.pedigree is None:
+            raise ValueError("the server was started without --ped")
+        return format_inheritance_line(gnomad_id, rest, probands, self.pedigree)
+
+
+class AnnotationRequestHandler(socketserver.StreamRequestHandler):
+    '''Answer requests on one connection until the client closes it, so a client can reuse its connection.'''
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = {"output": self.dispatch(line)}
+            except Exception as e:
+                response = {"error": f"{type(e).__name__}: {e}"}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+
+    def dispatch(self, line):
+        '''Run the command of one request line and return its output.'''
+        request = json.loads(line)
+        # Only the lookup of the command is a protocol error, a KeyError raised by the command itself is reported as such
+        try:
+            command = self.server.commands[request["command"]]
+        except KeyError as e:
+            raise ValueError(f"unknown command or missing field {e}") from None
+        return command(*request.get("args", []))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve per-variant gnomAD and inheritance formatting over a Unix socket.")
+    parser.add_argument("--socket", type=str, required=True, help="Path of the Unix socket to listen on.")
+    parser.add_argument("--ped", type=str, help="The path to the PED file, needed for inheritance requests.")
+    args = parser.parse_args()
+
+    # Remove a socket left behind by a server that did not shut down cleanly
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+
+    server = AnnotationServer(args.socket, args.ped)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"Listening on {args.socket}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import struct
+import zlib
+
+'''
+Minimal BGZF writer, so scripts can write bgzip-compatible (tabix-indexable) files without pysam or piping to bgzip.
+
+BGZF is a series of gzip members of at most 64 KiB, each with a "BC" extra field holding its compressed size,
+followed by an empty end-of-file block. Virtual offsets (compressed block start << 16 | offset in the block)
+from tell() can be used to seek straight to a record, as htslib does, and BgzfReader reads lines from one.
+'''
+
+# Uncompressed bytes per block, the same limit htslib uses so a block always fits in 64 KiB compressed
+BLOCK_SIZE = 0xff00
+EOF_BLOCK = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+
+class BgzfWriter:
+
+    def __init__(self, filepath, compresslevel=6):
+        self.file = open(filepath, 'wb')
+        self.compresslevel = compresslevel
+        self.buffer = bytearray()
+        self.block_start = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.buffer += data
+        while len(self.buffer) >= BLOCK_SIZE:
+            self._write_block(bytes(self.buffer[:BLOCK_SIZE]))
+            del self.buffer[:BLOCK_SIZE]
+        return len(data)
+
+    def tell(self):
+        '''Return the BGZF virtual offset of the next byte to be written.'''
+        return (self.block_start << 16) | len(self.buffer)
+
+    def _write_block(self, data):
+        compressor = zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+        compressed = compressor.compress(data) + compressor.flush()
+        block_size = len(compressed) + 26
+        header = struct.pack("<4BI2BH2BHH", 0x1f, 0x8b, 8, 4, 0, 0, 0xff, 6, ord("B"), ord("C"), 2, block_size - 1)
+        footer = struct.pack("<II", zlib.crc32(data) & 0xffffffff, len(data))
+        self.file.write(header + compressed + footer)
+        self.block_start += block_size
+
+    def flush(self):
+        if self.buffer:
+            self._write_block(bytes(self.buffer))
+            self.buffer.clear()
+        self.file.flush()
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.flush()
+        self.file.write(EOF_BLOCK)
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class BgzfReader:
+    '''Read lines from a BGZF file starting at a virtual offset, decompressing only the blocks that are read.'''
+
+    def __init__(self, filepath):
+        self.file = open(filepath, 'rb')
+        self.block_start = None
+        self.next_block = 0
+        self.block = b""
+        self.within_block = 0
+
+    def _load_block(self, block_start):
+        self.file.seek(block_start)
+        header = self.file.read(18)
+        if len(header) < 18:
+            self.block_start, self.block = block_start, b""
+            return False
+        if header[:4] != b"\x1f\x8b\x08\x04" or header[12:14] != b"BC":
+            raise ValueError(f"Not a BGZF block at offset {block_start} of {self.file.name}")
+        block_size = struct.unpack("<H", header[16:18])[0] + 1
+        data = self.file.read(block_size - 18)
+        self.block = zlib.decompress(data[:-8], -15)
+        self.block_start, self.next_block = block_start, block_start + block_size
+        return True
+
+    def seek(self, virtual_offset):
+        block_start, self.within_block = virtual_offset >> 16, virtual_offset & 0xffff
+        if block_start != self.block_start:
+            self._load_block(block_start)
+
+    def readline(self):
+        '''Return the next line including its newline, or an empty string at the end of the file.'''
+        parts = []
+        while True:
+            end = self.block.find(b"\n", self.within_block)
+            if end >= 0:
+                parts.append(self.block[self.within_block:end + 1])
+                self.within_block = end + 1
+                break
+            parts.append(self.block[self.within_block:])
+            self.within_block = 0
+            if not self._load_block(self.next_block):
+                break
+        return b"".join(parts).decode()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
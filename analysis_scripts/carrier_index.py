@@ -0,0 +1,156 @@
+import argparse
+import json
+import os
+import sys
+from urllib.parse import unquote
+import numpy as np
+from bgzf import BgzfReader
+
+'''
+Compact carrier encoding for format_proband_ids.py and an inverted index from samples to the records they carry.
+
+With --carrier_format compact, format_proband_ids.py writes the carriers of each ALT allele as
+    carriers=<sample index>:<genotype code>:<depth>:<diagnosis code>|...
+instead of samples=<Python list>. The sample index is the column of the sample in the input VCF (listed in the
+##carrier_samples header line), the genotype code is 1 for heterozygous and 2 for homozygous or haploid ALT
+(the codes of genotype_store.py), the depth is '.' when missing, and the diagnosis code indexes the
+##carrier_diagnoses header line (the diagnoses from the proband file, "." for samples that are not in it).
+Both header lines are comma-separated lists with %, commas and line breaks in the values percent-encoded, so a
+diagnosis containing a comma keeps its position; decode_header_list() splits them back.
+decode_carriers() turns the field back into integer arrays without literal_eval.
+
+With --carrier_index, format_proband_ids.py also writes a directory with, for every sample, the row numbers of
+the records it carries (CSR arrays, one slice per sample) and the file offset of every record (a byte offset,
+or a BGZF virtual offset for .gz/.bgz output), so all records of one proband are read with one seek each:
+    python carrier_index.py <index_dir> --sample S1 [--vcf formatted.vcf.gz]
+'''
+
+CARRIER_FIELDS = ("sample", "genotype", "depth", "diagnosis")
+MISSING_DEPTH = -1
+# Characters percent-encoded in the values of the ##carrier_samples / ##carrier_diagnoses lists
+HEADER_ESCAPES = {"%": "%25", ",": "%2C", "\n": "%0A", "\r": "%0D"}
+
+
+def encode_header_list(values):
+    '''Join values into a ##carrier_samples / ##carrier_diagnoses header value, percent-encoding HEADER_ESCAPES.'''
+    return ",".join("".join(HEADER_ESCAPES.get(char, char) for char in value) for value in values)
+
+
+def decode_header_list(value):
+    '''Split a header value written by encode_header_list back into its values, in order.'''
+    return [unquote(item) for item in value.rstrip("\n").split(",")]
+
+
+def encode_carriers(sample_columns, genotype_codes, depths, diagnosis_codes):
+    '''Encode the carriers of one ALT allele as the value of the carriers= INFO field.'''
+    return "|".join(f"{sample}:{genotype}:{depth if depth != MISSING_DEPTH else '.'}:{diagnosis}"
+                    for sample, genotype, depth, diagnosis in zip(sample_columns, genotype_codes, depths, diagnosis_codes))
+
+
+def decode_carriers(value):
+    '''
+    Decode a carriers= INFO value (with or without the "carriers=" prefix).
+
+    :return: dictionary of int64 arrays keyed by CARRIER_FIELDS, MISSING_DEPTH where the depth is '.'
+    '''
+    value = value[len("carriers="):] if value.startswith("carriers=") else value
+    carriers = [carrier.split(":") for carrier in value.split("|")] if value else []
+    columns = list(zip(*carriers)) if carriers else [()] * len(CARRIER_FIELDS)
+    return {field: np.array([MISSING_DEPTH if item == "." else int(item) for item in column], dtype=np.int64)
+            for field, column in zip(CARRIER_FIELDS, columns)}
+
+
+class CarrierIndexWriter:
+    '''
+    Collect the carriers of each record as format_proband_ids.py writes them, then save the inverted index.
+
+    tell is called before each record is written and must return the offset the record will start at
+    (BgzfWriter.tell, or the tell of a binary file).
+    '''
+
+    def __init__(self, tell, compression="none"):
+        self.tell = tell
+        self.compression = compression
+        self.samples = []
+        self.record_offsets = []
+        self.carrier_rows = []
+        self.carrier_columns = []
+
+    def add(self, sample_columns):
+        '''Register the next record and the sample columns that carry it.'''
+        row = len(self.record_offsets)
+        self.record_offsets.append(self.tell())
+        self.carrier_columns.append(np.asarray(sample_columns, dtype=np.int64))
+        self.carrier_rows.append(np.full(len(sample_columns), row, dtype=np.int64))
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        columns = np.concatenate(self.carrier_columns) if self.carrier_columns else np.empty(0, dtype=np.int64)
+        rows = np.concatenate(self.carrier_rows) if self.carrier_rows else np.empty(0, dtype=np.int64)
+        # Stable sort by sample keeps each sample's rows in file order
+        order = np.argsort(columns, kind="stable")
+        sample_offsets = np.concatenate(([0], np.cumsum(np.bincount(columns, minlength=len(self.samples))))).astype(np.int64)
+        np.save(os.path.join(directory, "carrier_rows.npy"), rows[order].astype(np.uint32))
+        np.save(os.path.join(directory, "sample_offsets.npy"), sample_offsets)
+        np.save(os.path.join(directory, "record_offsets.npy"), np.array(self.record_offsets, dtype=np.uint64))
+        with open(os.path.join(directory, "samples.txt"), 'w') as file:
+            file.write("\n".join(self.samples) + "\n")
+        with open(os.path.join(directory, "carrier_index.json"), 'w') as file:
+            json.dump({"compression": self.compression, "records": len(self.record_offsets)}, file)
+
+
+class CarrierIndex:
+    '''Memory-mapped sample -> carried records index written by CarrierIndexWriter.'''
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, "samples.txt"), 'r') as file:
+            self.samples = [line.rstrip("\n") for line in file if line.rstrip("\n")]
+        self.sample_index = {sample: index for index, sample in enumerate(self.samples)}
+        with open(os.path.join(directory, "carrier_index.json"), 'r') as file:
+            self.compression = json.load(file)["compression"]
+        self.carrier_rows = np.load(os.path.join(directory, "carrier_rows.npy"), mmap_mode='r')
+        self.sample_offsets = np.load(os.path.join(directory, "sample_offsets.npy"), mmap_mode='r')
+        self.record_offsets = np.load(os.path.join(directory, "record_offsets.npy"), mmap_mode='r')
+
+    def rows(self, sample):
+        '''Return the row numbers (0-based, in file order) of the records a sample carries, KeyError if unknown.'''
+        column = self.sample_index[sample]
+        return np.asarray(self.carrier_rows[self.sample_offsets[column]:self.sample_offsets[column + 1]], dtype=np.int64)
+
+    def offsets(self, sample):
+        '''Return the file offsets of the records a sample carries.'''
+        return np.asarray(self.record_offsets[self.rows(sample)], dtype=np.uint64)
+
+    def records(self, sample, vcf_filepath):
+        '''Yield the formatted VCF lines of the records a sample carries, seeking to each one.'''
+        if self.compression == "bgzf":
+            with BgzfReader(vcf_filepath) as file:
+                for offset in self.offsets(sample).tolist():
+                    file.seek(offset)
+                    yield file.readline()
+        else:
+            with open(vcf_filepath, 'rb') as file:
+                for offset in self.offsets(sample).tolist():
+                    file.seek(offset)
+                    yield file.readline().decode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List the records a sample carries using a carrier index from format_proband_ids.py.")
+    parser.add_argument("index", type=str, help="Directory of the carrier index (format_proband_ids.py --carrier_index).")
+    parser.add_argument("--sample", type=str, required=True, help="Sample ID as in the VCF header.")
+    parser.add_argument("--vcf", type=str, help="The formatted VCF the index was written with, to print the records instead of row numbers.")
+    args = parser.parse_args()
+
+    index = CarrierIndex(args.index)
+    if args.sample not in index.sample_index:
+        sys.exit(f"Sample {args.sample} is not in the carrier index.")
+    if args.vcf:
+        for record in index.records(args.sample, args.vcf):
+            sys.stdout.write(record)
+    else:
+        print("\n".join(map(str, index.rows(args.sample).tolist())))
+
+
+if __name__ == "__main__":
+    main()
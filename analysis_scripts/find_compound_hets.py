@@ -0,0 +1,110 @@
+import argparse
+import ast
+import sys
+import numpy as np
+import pandas as pd
+from format_inheritance_info import load_ped, trio_index_arrays
+from genotype_store import GenotypeStore
+
+'''
+This script finds candidate compound heterozygotes: probands with two different monoallelic variants in the same gene,
+one inherited from the father and one from the mother.
+
+Input is the cohort TSV annotated by format_inheritance_info.py (monoallelic_probands column), the genotype store of
+the cohort VCF (genotype_store.py) to tell which parent carries each variant, and the PED file.
+Every (variant, proband) carrier record is given integer codes for its gene and proband, the records are sorted by
+(gene, proband) and each run of records is checked for a paternal and a maternal hit, so the cost is one sort
+rather than a pairwise comparison of variants.
+
+Output is a TSV with one row per candidate pair of variants.
+'''
+
+UNKNOWN_ORIGIN, PATERNAL, MATERNAL = 0, 1, 2
+
+
+def explode_monoallelic_carriers(cohort_df, group_column):
+    '''Turn the monoallelic_probands lists into one (variant row, gene, proband) record per carrier.'''
+    probands = cohort_df['monoallelic_probands'].map(lambda value: ast.literal_eval(value) if isinstance(value, str) and value.startswith('[') else [])
+    records = pd.DataFrame({'row': np.arange(len(cohort_df)), 'group': cohort_df[group_column].values, 'proband': probands}).explode('proband')
+    records = records.dropna(subset=['proband'])
+    records = records[records['group'].notna() & (records['group'] != '.')]
+    return records.reset_index(drop=True)
+
+
+def parent_of_origin(store, records, gnomad_ids, father_columns, mother_columns):
+    '''Code each carrier record as PATERNAL or MATERNAL from which parent carries the variant, UNKNOWN_ORIGIN otherwise.'''
+    store_rows = store.variants.find_many(list(gnomad_ids))[records['row'].values]
+    proband_columns = np.array([store.sample_index.get(proband, -1) for proband in records['proband']], dtype=np.int64)
+    father = np.where(proband_columns >= 0, father_columns[proband_columns.clip(0)], -1)
+    mother = np.where(proband_columns >= 0, mother_columns[proband_columns.clip(0)], -1)
+    usable = (store_rows >= 0) & (father >= 0) & (mother >= 0)
+
+    origin = np.full(len(records), UNKNOWN_ORIGIN, dtype=np.int8)
+    father_codes = store.genotype_codes_at(store_rows[usable], father[usable])
+    mother_codes = store.genotype_codes_at(store_rows[usable], mother[usable])
+    father_carrier = (father_codes == 1) | (father_codes == 2)
+    mother_carrier = (mother_codes == 1) | (mother_codes == 2)
+    origin[np.flatnonzero(usable)[father_carrier & ~mother_carrier]] = PATERNAL
+    origin[np.flatnonzero(usable)[mother_carrier & ~father_carrier]] = MATERNAL
+    return origin
+
+
+def find_compound_hets(cohort_df, store, pedigree, group_column='uniprot_id'):
+    '''Return a DataFrame of candidate compound heterozygous variant pairs per (gene, proband).'''
+    gnomad_ids = cohort_df.iloc[:, 0].astype(str).values
+    records = explode_monoallelic_carriers(cohort_df, group_column)
+    father_columns, mother_columns, _ = trio_index_arrays(pedigree, store.samples)
+    origin = parent_of_origin(store, records, gnomad_ids, father_columns, mother_columns)
+
+    # Sort the records by (gene, proband) so each pair of hits shares a contiguous run
+    group_codes, groups = pd.factorize(records['group'])
+    proband_codes, probands = pd.factorize(records['proband'])
+    keep = origin != UNKNOWN_ORIGIN
+    rows, group_codes, proband_codes, origin = records['row'].values[keep], group_codes[keep], proband_codes[keep], origin[keep]
+    order = np.lexsort((origin, proband_codes, group_codes))
+    rows, group_codes, proband_codes, origin = rows[order], group_codes[order], proband_codes[order], origin[order]
+
+    # The gene name is only a column of its own when variants are grouped by something else
+    columns = [group_column] + (['gene'] if group_column != 'gene' else []) + ['proband', 'paternal_variant', 'maternal_variant']
+    if len(rows) == 0:
+        return pd.DataFrame([], columns=columns)
+    run_starts = np.flatnonzero(np.concatenate(([True], (np.diff(group_codes) != 0) | (np.diff(proband_codes) != 0))))
+    run_ends = np.append(run_starts[1:], len(rows))
+    n_paternal = np.add.reduceat((origin == PATERNAL).astype(np.int64), run_starts)
+    n_maternal = (run_ends - run_starts) - n_paternal
+    candidate_runs = (n_paternal > 0) & (n_maternal > 0)
+
+    gene_column = 'gene' if 'gene' in cohort_df.columns else group_column
+    pairs = []
+    # Only runs with at least one hit from each parent produce candidates, paternal hits sort before maternal ones
+    for start, end, paternal in zip(run_starts[candidate_runs], run_ends[candidate_runs], n_paternal[candidate_runs]):
+        for paternal_row in rows[start:start + paternal]:
+            for maternal_row in rows[start + paternal:end]:
+                if gnomad_ids[paternal_row] == gnomad_ids[maternal_row]:
+                    continue
+                gene = [cohort_df[gene_column].iat[paternal_row]] if group_column != 'gene' else []
+                pairs.append([groups[group_codes[start]]] + gene + [probands[proband_codes[start]], gnomad_ids[paternal_row], gnomad_ids[maternal_row]])
+
+    return pd.DataFrame(pairs, columns=columns)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find candidate compound heterozygous variant pairs per gene and proband.")
+    parser.add_argument('--input', required=True, help='Cohort TSV annotated with monoallelic_probands by format_inheritance_info.py')
+    parser.add_argument('--store', required=True, help='Genotype store of the cohort VCF built with genotype_store.py')
+    parser.add_argument('--ped', required=True, help='The path to the PED file')
+    parser.add_argument('--output', required=True, help='Output TSV file path')
+    parser.add_argument('--group_by', default='uniprot_id', help='Column to group variants by (default: uniprot_id, or gene)')
+    args = parser.parse_args()
+
+    cohort_df = pd.read_csv(args.input, sep='\t', dtype=str)
+    if args.group_by not in cohort_df.columns or 'monoallelic_probands' not in cohort_df.columns:
+        sys.exit(f"Input needs the {args.group_by} and monoallelic_probands columns.")
+
+    pairs = find_compound_hets(cohort_df, GenotypeStore(args.store), load_ped(args.ped), args.group_by)
+    pairs.to_csv(args.output, sep='\t', index=False)
+    print(f"{len(pairs)} candidate compound heterozygous pairs in {pairs['proband'].nunique()} probands saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,18 @@
 import argparse
+import gzip
 import sys
 
+# Order of the gnomAD columns appended to the cohort TSV
+GNOMAD_KEY_ORDER = [
+    "AF", "AF_XX", "AF_XY", "AF_afr_XX", "AF_afr_XY", "AF_afr", 
+    "AF_ami_XX", "AF_ami_XY", "AF_ami", "AF_amr_XX", "AF_amr_XY", "AF_amr", 
+    "AF_asj_XX", "AF_asj_XY", "AF_asj", "AF_eas_XX", "AF_eas_XY", "AF_eas", 
+    "AF_fin_XX", "AF_fin_XY", "AF_fin", "AF_mid_XX", "AF_mid_XY", "AF_mid", 
+    "AF_nfe_XX", "AF_nfe_XY", "AF_nfe", "AF_raw", "AF_remaining_XX", 
+    "AF_remaining_XY", "AF_remaining", "AF_sas_XX", "AF_sas_XY", "AF_sas", 
+    "AF_grpmax", "FS", "MQ", "QD", "inbreeding_coeff", "spliceai_ds_max", "phylop"
+]
+
 def parse_string_to_dict(input_string):
     """Convert a semicolon-delimited string into a dictionary."""
     result = {}
@@ -35,15 +47,7 @@ def make_tab_delimited_string(gnomad_id, rest, input_dict):
     """Convert a dictionary into a tab-delimited string with keys in a specified order."""
     
     # Define the desired order of keys
-    key_order = [
-        "AF", "AF_XX", "AF_XY", "AF_afr_XX", "AF_afr_XY", "AF_afr", 
-        "AF_ami_XX", "AF_ami_XY", "AF_ami", "AF_amr_XX", "AF_amr_XY", "AF_amr", 
-        "AF_asj_XX", "AF_asj_XY", "AF_asj", "AF_eas_XX", "AF_eas_XY", "AF_eas", 
-        "AF_fin_XX", "AF_fin_XY", "AF_fin", "AF_mid_XX", "AF_mid_XY", "AF_mid", 
-        "AF_nfe_XX", "AF_nfe_XY", "AF_nfe", "AF_raw", "AF_remaining_XX", 
-        "AF_remaining_XY", "AF_remaining", "AF_sas_XX", "AF_sas_XY", "AF_sas", 
-        "AF_grpmax", "FS", "MQ", "QD", "inbreeding_coeff", "spliceai_ds_max", "phylop"
-    ]
+    key_order = GNOMAD_KEY_ORDER
     
 
     # Get the values in the desired order
@@ -53,24 +57,134 @@ def make_tab_delimited_string(gnomad_id, rest, input_dict):
     return f"{gnomad_id}\t{rest}\t" + "\t".join(map(str, ordered_values))
 
 
+def format_gnomad_line(gnomad_id, rest, gnomad_query):
+    """Format one cohort row, filling every gnomAD column with '.' when the variant was not found."""
+    if gnomad_query == "":
+        gnomad_dict = {key: '.' for key in GNOMAD_KEY_ORDER}
+    else:
+        # Parse the semicolon-delimited string into a dictionary
+        gnomad_dict = parse_string_to_dict(gnomad_query)
+    return make_tab_delimited_string(gnomad_id, rest, gnomad_dict)
+
+
+def open_text(filepath):
+    """Open a plain, gzip or BGZF compressed text file for reading."""
+    if filepath.endswith((".gz", ".bgz")):
+        return gzip.open(filepath, 'rt')
+    return open(filepath, 'r')
+
+
+def read_cohort_tsv(cohort_tsv):
+    """Read the cohort TSV into its header and a list of (gnomad_id, rest) rows, split like the bash loop does."""
+    with open_text(cohort_tsv) as file:
+        header = file.readline().rstrip("\n")
+        rows = []
+        for line in file:
+            gnomad_id, _, rest = line.rstrip("\n").strip("\t").partition("\t")
+            rows.append((gnomad_id, rest.lstrip("\t")))
+    return header, rows
+
+
+def batch_gnomad_queries(gnomad_ids, gnomad_vcfs):
+    """
+    Fetch the gnomAD INFO string of every cohort variant in a single pass over the gnomAD VCFs.
+
+    The cohort variants are sorted by (chrom, pos) and merge-joined against the position sorted VCF records,
+    so each VCF is only read once and only the records at cohort positions are split further.
+    Returns one query string per gnomad_id in input order, "" where the variant is absent, the same as bcftools query.
+    """
+    queries = [[] for _ in gnomad_ids]
+
+    # Group the cohort variants by chromosome and sort them by position
+    targets = {}
+    for row_index, gnomad_id in enumerate(gnomad_ids):
+        fields = gnomad_id.split("-")
+        if len(fields) != 4 or not fields[1].isdigit():
+            continue
+        chrom, pos, ref, alt = fields
+        targets.setdefault(chrom, []).append((int(pos), ref, alt, row_index))
+    for chrom_targets in targets.values():
+        chrom_targets.sort()
+    cursors = dict.fromkeys(targets, 0)
+    remaining = len(targets)
+
+    for gnomad_vcf in gnomad_vcfs:
+        if remaining == 0:
+            break
+        with open_text(gnomad_vcf) as file:
+            for line in file:
+                if line.startswith("#"):
+                    continue
+                chrom, pos, record = line.split("\t", 2)
+                chrom = chrom[3:] if chrom.startswith("chr") else chrom
+                chrom_targets = targets.get(chrom)
+                if chrom_targets is None:
+                    continue
+                cursor = cursors[chrom]
+                if cursor == len(chrom_targets):
+                    continue
+                pos = int(pos)
+                # Advance past cohort variants that are before this record
+                while cursor < len(chrom_targets) and chrom_targets[cursor][0] < pos:
+                    cursor += 1
+                cursors[chrom] = cursor
+                if cursor == len(chrom_targets):
+                    remaining -= 1
+                    if remaining == 0:
+                        break
+                    continue
+                if chrom_targets[cursor][0] != pos:
+                    continue
+                # Several records and cohort variants can share a position, so match on REF and ALT too
+                _, ref, alt, _, _, info = record.split("\t", 6)[:6]
+                match_index = cursor
+                while match_index < len(chrom_targets) and chrom_targets[match_index][0] == pos:
+                    _, target_ref, target_alt, row_index = chrom_targets[match_index]
+                    if target_ref == ref and target_alt == alt:
+                        queries[row_index].append(info.rstrip("\n"))
+                    match_index += 1
+
+    # bcftools query prints one INFO line per matching record
+    return ["\n".join(query) for query in queries]
+
+
+def annotate_cohort_tsv(cohort_tsv, gnomad_vcfs, output):
+    """Add the gnomAD columns to every row of the cohort TSV, producing the same output as add_gnomad_mafs.sh."""
+    header, rows = read_cohort_tsv(cohort_tsv)
+    queries = batch_gnomad_queries([gnomad_id for gnomad_id, _ in rows], gnomad_vcfs)
+
+    out = open(output, 'w') if output else sys.stdout
+    try:
+        out.write(header + "\t" + "\t".join(GNOMAD_KEY_ORDER) + "\n")
+        for (gnomad_id, rest), gnomad_query in zip(rows, queries):
+            out.write(format_gnomad_line(gnomad_id, rest, gnomad_query) + "\n")
+    finally:
+        if output:
+            out.close()
+
+
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Process gnomAD data and convert a semicolon-delimited string into a dictionary.")
-    parser.add_argument("gnomad_id", type=str, help="The gnomAD identifier.")
-    parser.add_argument("rest", type=str, help="Additional string information.")
-    parser.add_argument("gnomad_query", type=str, help="The semicolon-delimited key=value string to parse.")
+    parser.add_argument("gnomad_id", type=str, nargs="?", help="The gnomAD identifier.")
+    parser.add_argument("rest", type=str, nargs="?", help="Additional string information.")
+    parser.add_argument("gnomad_query", type=str, nargs="?", help="The semicolon-delimited key=value string to parse.")
+    parser.add_argument("--cohort_tsv", type=str, help="Batch mode: annotate every row of this cohort TSV in one pass.")
+    parser.add_argument("--gnomad_vcf", type=str, nargs="+", help="Batch mode: the gnomAD sites VCF(s), sorted by position.")
+    parser.add_argument("--output", type=str, help="Batch mode: path to the output TSV (default: stdout).")
 
     # Parse command line arguments
     args = parser.parse_args()
 
-    if args.gnomad_query == "":
-        gnomad_dict = {'AF': '.', 'AF_XX': '.', 'AF_XY': '.', 'AF_afr_XX': '.', 'AF_afr_XY': '.', 'AF_afr': '.', 'AF_ami_XX': '.', 'AF_ami_XY': '.', 'AF_ami': '.', 'AF_amr_XX': '.', 'AF_amr_XY': '.', 'AF_amr': '.', 'AF_asj_XX': '.', 'AF_asj_XY': '.', 'AF_asj': '.', 'AF_eas_XX': '.', 'AF_eas_XY': '.', 'AF_eas': '.', 'AF_fin_XX': '.', 'AF_fin_XY': '.', 'AF_fin': '.', 'AF_mid_XX': '.', 'AF_mid_XY': '.', 'AF_mid': '.', 'AF_nfe_XX': '.', 'AF_nfe_XY': '.', 'AF_nfe': '.', 'AF_raw': '.', 'AF_remaining_XX': '.', 'AF_remaining_XY': '.', 'AF_remaining': '.', 'AF_sas_XX': '.', 'AF_sas_XY': '.', 'AF_sas': '.', 'AF_grpmax': '.', 'FS': '.', 'MQ': '.', 'QD': '.', 'inbreeding_coeff': '.', 'spliceai_ds_max': '.', 'phylop': '.'}
-        print(make_tab_delimited_string(args.gnomad_id, args.rest, gnomad_dict))
+    if args.cohort_tsv:
+        if not args.gnomad_vcf:
+            parser.error("--cohort_tsv requires --gnomad_vcf")
+        annotate_cohort_tsv(args.cohort_tsv, args.gnomad_vcf, args.output)
         sys.exit(0)
+    elif args.gnomad_query is None:
+        parser.error("gnomad_id, rest and gnomad_query are required unless --cohort_tsv is given")
     else:
-        # Parse the semicolon-delimited string into a dictionary
-        gnomad_dict = parse_string_to_dict(args.gnomad_query)
-        print(make_tab_delimited_string(args.gnomad_id, args.rest, gnomad_dict))
+        print(format_gnomad_line(args.gnomad_id, args.rest, args.gnomad_query))
         sys.exit(0)
 
 if __name__ == "__main__":
@@ -1,6 +1,16 @@
 import argparse
 import sys
-import pandas as pd
+import numpy as np
+from format_gnomad_info import read_cohort_tsv
+from genotype_store import GenotypeStore, HOM_REF, MISSING, PLAIN, HAPLOID, PARTIAL, non_reference
+from pedigree import Pedigree, MISSING_PARENT
+
+# Inheritance classes of a (variant, sample) pair in classify_inheritance_matrix. UNCLASSIFIED carriers are listed
+# as probands but counted in no class, like trios whose parents are REF but not both called 0/0 (e.g. 0|0)
+NOT_CARRIER, MONOALLELIC, BIALLELIC, DENOVO, UNKNOWN, UNCLASSIFIED = 0, 1, 2, 3, 4, 5
+
+# Columns added to the cohort TSV, the same as add_inheritance_info.sh
+INHERITANCE_HEADER = ["probands", "n_monoallelic", "monoallelic_probands", "n_biallelic", "biallelic_probands", "n_denovo", "denovo_probands", "n_unknown_inheritance", "unknown_inheritance_probands"]
 
 def probands_to_dict(probands):
     '''Iterate through the lines of the proband string, separate each line by the : and make the part before : the key and the part after : the value'''
@@ -11,6 +21,10 @@ def probands_to_dict(probands):
             probands_dict[key] = value
     return probands_dict
 
+def load_ped(ped_file):
+    '''Read the PED file into a Pedigree index, so it can be read once and reused for many variants.'''
+    return Pedigree.from_ped(ped_file)
+
 def proband_gt_dict_and_ped_to_inheritance_counts(proband_gt_dict, cohort_gt_dict, ped_file):
 
 
@@ -19,32 +33,31 @@ def proband_gt_dict_and_ped_to_inheritance_counts(proband_gt_dict, cohort_gt_dic
     First it needs to see if the proband is a trio, and if not it gets added to the unknown inheritance list. 
     If it is a trio, it needs to check if the variant is present in the parents.
     Absence of a variant in the parents is not sufficient, the site must be called with the REF allele in parents for de novo.
+    ped_file can be the path to the PED file or a Pedigree already read with load_ped.
     '''
 
-    # Read the PED file which is tab-delimited into a pandas DataFrame
+    # Read the PED file into a Pedigree index unless it was already loaded
 
     counts_dict = {"probands": [], "n_monoallelic": 0, "monoallelic_probands": [], "n_biallelic": 0, "biallelic_probands": [], "n_denovo": 0, "denovo_probands" : [], "n_unknown": 0, "unknown_probands": []}
 
     for key, value in proband_gt_dict.items():
         counts_dict["probands"].append(key)
 
-    ped_df = pd.read_csv(ped_file, sep='\t', header=None, names=['family_id', 'proband_id', 'father_id', 'mother_id', 'sex', 'phenotype'])
+    pedigree = ped_file if isinstance(ped_file, Pedigree) else load_ped(ped_file)
     for proband_id, gt in proband_gt_dict.items():
-        proband_row = ped_df[ped_df['proband_id'] == proband_id]
-        if proband_row.empty:
+        proband_row = pedigree.get(proband_id)
+        if proband_row is None:
             #exit with error if proband not found in PED file, since all probands should be in the PED file
             sys.stderr.write(f"Proband {proband_id} not found in PED file.\n")
             counts_dict["n_unknown"] += 1
             counts_dict["unknown_probands"].append(proband_id)
             continue
-        else:
-            proband_row = proband_row.iloc[0]
-        family_id = proband_row['family_id']
-        father_id = proband_row['father_id']
+        family_id = proband_row.family_id
+        father_id = proband_row.father_id
         if father_id != "0":
             father_gt = cohort_gt_dict[father_id]
         father_has_variant = father_id in proband_gt_dict.keys()
-        mother_id = proband_row['mother_id']
+        mother_id = proband_row.mother_id
         if mother_id != "0":
             mother_gt = cohort_gt_dict[mother_id]
         mother_has_variant = mother_id in proband_gt_dict.keys()
@@ -87,22 +100,136 @@ def make_tab_delimited_string(gnomad_id, rest, input_dict):
     return f"{gnomad_id}\t{rest}\t" + "\t".join(map(str, ordered_values))
 
 
+def format_inheritance_line(gnomad_id, rest, probands, ped_file):
+    """Format one cohort row from the SAMPLE:GT lines returned by bcftools query for the variant."""
+    cohort_gt_dict = probands_to_dict(probands)
+    proband_gt_dict = {key: value for key, value in cohort_gt_dict.items() if value not in ["0/0", "./.", "0|0", "0", ".", ".|."]}
+    counts_dict = proband_gt_dict_and_ped_to_inheritance_counts(proband_gt_dict, cohort_gt_dict, ped_file)
+    return make_tab_delimited_string(gnomad_id, rest, counts_dict)
+
+def trio_index_arrays(pedigree, samples):
+    '''
+    Map every sample column of a genotype matrix to the columns of its parents.
+
+    :return: (father_columns, mother_columns, in_ped) arrays over the samples, with -1 where the parent is
+             missing from the PED file or not genotyped, and in_ped False for samples that are not in the PED file
+    '''
+    sample_columns = {sample: column for column, sample in enumerate(samples)}
+    father_columns = np.full(len(samples), -1, dtype=np.int64)
+    mother_columns = np.full(len(samples), -1, dtype=np.int64)
+    in_ped = np.zeros(len(samples), dtype=bool)
+    for column, sample in enumerate(samples):
+        entry = pedigree.get(sample)
+        if entry is None:
+            continue
+        in_ped[column] = True
+        if entry.father_id != MISSING_PARENT:
+            father_columns[column] = sample_columns.get(entry.father_id, -1)
+        if entry.mother_id != MISSING_PARENT:
+            mother_columns[column] = sample_columns.get(entry.mother_id, -1)
+    return father_columns, mother_columns, in_ped
+
+
+def classify_inheritance_matrix(codes, details, father_columns, mother_columns, in_ped):
+    '''
+    Classify every (variant, sample) pair of a genotype code matrix (see genotype_store.py) at once.
+
+    This applies the rules of proband_gt_dict_and_ped_to_inheritance_counts with array operations. Carriers of the
+    row's ALT that are not in the PED file, lack a parent, or have a parent called ./., .|., . or 0 are unknown.
+    Otherwise the variant is monoallelic if one parent carries a non-reference allele of the record or has a half call
+    (e.g. ./1 or 0/.), biallelic if both do, and de novo only if both parents are called 0/0. The remaining carriers (e.g. a 0|0 parent) are UNCLASSIFIED,
+    as the per-variant path lists them as probands without counting them.
+    A parent listed in the PED file but absent from the VCF is treated as missing.
+
+    :param codes: uint8 matrix of variants x samples genotype codes (0 hom REF, 1 het, 2 hom ALT, 3 missing)
+    :param details: uint8 matrix of the detail codes of the same genotypes (PLAIN, PHASED, HAPLOID or OTHER_ALT, plus PARTIAL)
+    :return: int8 matrix of the same shape with NOT_CARRIER, MONOALLELIC, BIALLELIC, DENOVO, UNKNOWN or UNCLASSIFIED
+    '''
+    carrier = (codes == 1) | (codes == 2)
+    # Parents carry the variant for any GT but 0/0, 0|0, 0 and the fully missing ones, as in format_inheritance_line
+    non_ref = non_reference(codes, details) | ((details & PARTIAL) > 0)
+    uncalled = (codes == MISSING) | ((codes == HOM_REF) & (details == HAPLOID))
+    called_ref = (codes == HOM_REF) & (details == PLAIN)
+
+    has_father = father_columns >= 0
+    has_mother = mother_columns >= 0
+    father, mother = father_columns.clip(0), mother_columns.clip(0)
+    father_carrier = non_ref[:, father] & has_father
+    mother_carrier = non_ref[:, mother] & has_mother
+
+    unknown = ~in_ped | ~has_father | ~has_mother | uncalled[:, father] | uncalled[:, mother]
+    return np.select(
+        [~carrier, unknown, father_carrier & mother_carrier, father_carrier | mother_carrier, called_ref[:, father] & called_ref[:, mother]],
+        [NOT_CARRIER, UNKNOWN, BIALLELIC, MONOALLELIC, DENOVO],
+        default=UNCLASSIFIED,
+    ).astype(np.int8)
+
+
+def class_row_to_counts_dict(classes, samples):
+    '''Convert one variant's row of classify_inheritance_matrix into the counts_dict of the per-variant path.'''
+    counts_dict = {"probands": [], "n_monoallelic": 0, "monoallelic_probands": [], "n_biallelic": 0, "biallelic_probands": [], "n_denovo": 0, "denovo_probands" : [], "n_unknown": 0, "unknown_probands": []}
+    for column in np.flatnonzero(classes):
+        counts_dict["probands"].append(samples[column])
+    for inheritance_class, name in [(MONOALLELIC, "monoallelic"), (BIALLELIC, "biallelic"), (DENOVO, "denovo"), (UNKNOWN, "unknown")]:
+        probands = [samples[column] for column in np.flatnonzero(classes == inheritance_class)]
+        counts_dict[f"n_{name}"] = len(probands)
+        counts_dict[f"{name}_probands"] = probands
+    return counts_dict
+
+
+def annotate_cohort_tsv(cohort_tsv, store_dir, ped_file, output, chunk_size=10000):
+    '''Add the inheritance columns to every row of the cohort TSV from a genotype store, the same as add_inheritance_info.sh.'''
+    header, rows = read_cohort_tsv(cohort_tsv)
+    store = GenotypeStore(store_dir)
+    pedigree = load_ped(ped_file)
+    father_columns, mother_columns, in_ped = trio_index_arrays(pedigree, store.samples)
+    store_rows = store.variants.find_many([gnomad_id for gnomad_id, _ in rows])
+    found = store_rows >= 0
+
+    out = open(output, 'w') if output else sys.stdout
+    try:
+        out.write(header + "\t" + "\t".join(INHERITANCE_HEADER) + "\n")
+        not_in_ped = set()
+        for start in range(0, len(rows), chunk_size):
+            chunk_rows = store_rows[start:start + chunk_size]
+            chunk_found = found[start:start + chunk_size]
+            classes = np.zeros((len(chunk_rows), len(store.samples)), dtype=np.int8)
+            if chunk_found.any():
+                codes = store.genotype_codes(chunk_rows[chunk_found])
+                details = store.detail_codes(chunk_rows[chunk_found])
+                classes[chunk_found] = classify_inheritance_matrix(codes, details, father_columns, mother_columns, in_ped)
+                not_in_ped.update(np.flatnonzero(classes.any(axis=0) & ~in_ped).tolist())
+            for (gnomad_id, rest), class_row in zip(rows[start:start + chunk_size], classes):
+                out.write(make_tab_delimited_string(gnomad_id, rest, class_row_to_counts_dict(class_row, store.samples)) + "\n")
+        for column in sorted(not_in_ped):
+            sys.stderr.write(f"Proband {store.samples[column]} not found in PED file.\n")
+    finally:
+        if output:
+            out.close()
+
 
 def main():
     # Set up argument parser
     parser = argparse.ArgumentParser(description="Process gnomAD data and convert a semicolon-delimited string into a dictionary.")
-    parser.add_argument("gnomad_id", type=str, help="The gnomAD identifier.")
-    parser.add_argument("rest", type=str, help="Additional string information.")
-    parser.add_argument("probands", type=str, help="A enter delimited string of probands and their GT fields.")
+    parser.add_argument("gnomad_id", type=str, nargs="?", help="The gnomAD identifier.")
+    parser.add_argument("rest", type=str, nargs="?", help="Additional string information.")
+    parser.add_argument("probands", type=str, nargs="?", help="A enter delimited string of probands and their GT fields.")
     parser.add_argument("--ped", type=str, help="The path to the PED file.")
+    parser.add_argument("--cohort_tsv", type=str, help="Batch mode: classify every row of this cohort TSV at once.")
+    parser.add_argument("--store", type=str, help="Batch mode: genotype store of the cohort VCF built with genotype_store.py.")
+    parser.add_argument("--output", type=str, help="Batch mode: path to the output TSV (default: stdout).")
 
     
     # Parse the arguments
     args = parser.parse_args()
-    cohort_gt_dict = probands_to_dict(args.probands)
-    proband_gt_dict = {key: value for key, value in cohort_gt_dict.items() if value not in ["0/0", "./.", "0|0", "0", ".", ".|."]}
-    counts_dict = proband_gt_dict_and_ped_to_inheritance_counts(proband_gt_dict, cohort_gt_dict, args.ped)
-    print(make_tab_delimited_string(args.gnomad_id, args.rest, counts_dict))
+    if args.cohort_tsv:
+        if not args.store or not args.ped:
+            parser.error("--cohort_tsv requires --store and --ped")
+        annotate_cohort_tsv(args.cohort_tsv, args.store, args.ped, args.output)
+    elif args.probands is None:
+        parser.error("gnomad_id, rest and probands are required unless --cohort_tsv is given")
+    else:
+        print(format_inheritance_line(args.gnomad_id, args.rest, args.probands, args.ped))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,116 +1,209 @@
 import argparse
 import csv
+import sys
+import numpy as np
+from bgzf import BgzfWriter
+from carrier_index import CarrierIndexWriter, encode_carriers, encode_header_list
+from format_gnomad_info import open_text
+from vcf_genotypes import decode_genotypes, MISSING_DEPTH, NO_ALLELE
 
-def format_proband_ids(input_vcf):
-    with open(input_vcf, "r") as f:
+# Number of sample genotypes (records x samples) decoded together
+CHUNK_GENOTYPES = 200_000
+
+def format_proband_ids(input_vcf, proband_file, exact=False):
+    # Builds the whole formatted VCF in memory, use iter_formatted_records to stream it instead
+    return "".join(iter_formatted_records(input_vcf, proband_file, exact))
+
+def iter_formatted_records(input_vcf, proband_file, exact=False, carrier_format="legacy", carrier_index=None):
+    '''
+    Yield the formatted VCF one line at a time as the input VCF is read, so memory use does not grow with the VCF.
+
+    carrier_format "legacy" writes samples=[[id, GT, DP, diagnosis], ...], "compact" writes the typed
+    carriers= encoding of carrier_index.py. A CarrierIndexWriter passed as carrier_index is given the carriers of
+    every record just before the record is yielded.
+    '''
+    # Load the proband file once, every carrier's diagnosis is then a dictionary lookup
+    diagnosis_index = DiagnosisIndex(proband_file, exact=exact)
+    chunk = []
+
+    def format_chunk(chunk):
+        for line_string, carriers in format_record_chunk(chunk, header, sample_diagnoses, diagnosis_codes):
+            if carrier_index is not None:
+                carrier_index.add(carriers)
+            yield line_string
+
+    with open_text(input_vcf) as f:
         for line in f:
             # Skip lines that are comments
             if line.startswith("##"):
                 continue
-            # Get the header line and initialize the formatted VCF string
+            # Get the header line and output the formatted VCF header
             elif line.startswith("#") and not line.startswith("##"):
                 header = line.strip().split("\t")
-                formatted_vcf = "\t".join(header[:8]) + "\n"
+                diagnosis_index.preload(header[9:])
+                sample_diagnoses = [diagnosis_index.fetch(proband_id) for proband_id in header[9:]]
+                diagnosis_codes = None
+                if carrier_format == "compact":
+                    diagnoses = ["."] + sorted(set(sample_diagnoses) - {"."})
+                    diagnosis_codes = [diagnoses.index(diagnosis) for diagnosis in sample_diagnoses]
+                    yield '##INFO=<ID=carriers,Number=.,Type=String,Description="Carriers of the ALT allele as sample index:genotype code (1 het, 2 hom):depth:diagnosis code, separated by |">\n'
+                    yield "##carrier_samples=" + encode_header_list(header[9:]) + "\n"
+                    yield "##carrier_diagnoses=" + encode_header_list(diagnoses) + "\n"
+                if carrier_index is not None:
+                    carrier_index.samples = header[9:]
+                # Decode the genotypes of blocks of about CHUNK_GENOTYPES samples x records at a time
+                records_per_chunk = max(1, CHUNK_GENOTYPES // max(len(header) - 9, 1))
+                yield "\t".join(header[:8]) + "\n"
             else:
-                # Process all the lines that are not comments or headers
-                line = line.strip().split("\t")
-                if line[6] != "PASS":
+                # Collect the records that are not comments or headers, the sample columns are only split when decoded
+                line = line.strip()
+                if line.split("\t", 7)[6] != "PASS":
                     continue
-                chrom = line[0]
-                chrom_numerical = chrom[3:] if chrom.startswith("chr") else chrom
-                pos = line[1]
-                ref = line[3]
-                alt = line[4]
-                genotype_format = line[8].split(":")
-                genotype_field = genotype_format.index("GT")
-                depth_field = genotype_format.index("DP")
-                proband_info = line[9:]
-                alleles_proband_dict = {}
-                # Make a dictionary containing which proband IDs have which disease allele
-                for proband_index, proband in enumerate(proband_info):
-                    proband = proband.split(":")
-                    # Ignore probands that are homozygous for the reference allele or have missing genotypes
-                    if proband[genotype_field] == "./." or proband[0] == "0/0":
-                        continue
-                    else:
-                        genotype = proband[genotype_field]
-                        alleles = genotype.split("/")
-                        # Ensure alleles has at least two elements
-                        if len(alleles) >= 2:
-                            allele1 = alleles[0] if alleles[0] != '0' else None
-                            allele2 = alleles[1] if alleles[1] != '0' else None
-                        else:
-                            # Handle unexpected cases where alleles doesn't have at least two elements
-                            allele1 = None
-                            allele2 = None
-                            # Optionally, print a message or log this unexpected case for debugging
-                            print(f"Unexpected genotype format: {genotype}")
-                        read_depth = proband[depth_field]
+                chunk.append(line)
+                if len(chunk) == records_per_chunk:
+                    yield from format_chunk(chunk)
+                    chunk = []
+    if chunk:
+        yield from format_chunk(chunk)
+
+def format_record_chunk(records, header, sample_diagnoses, diagnosis_codes=None):
+    '''
+    Format a block of PASS records, decoding the GT and DP of all their samples at once.
+    Yields (line, carrier sample columns) per ALT allele, in the compact encoding if diagnosis_codes is given.
+    '''
+    sites = [line.split("\t", 9)[:9] for line in records]
+    genotype_formats = [line[8].split(":") for line in sites]
+    genotype_fields = [genotype_format.index("GT") for genotype_format in genotype_formats]
+    depth_fields = [genotype_format.index("DP") if "DP" in genotype_format else -1 for genotype_format in genotype_formats]
+    genotypes = decode_genotypes(records, genotype_fields, depth_fields)
+    allele1, allele2, read_depths = genotypes.allele1, genotypes.allele2, genotypes.depth
+
+    for record_index, line in enumerate(sites):
+        chrom = line[0]
+        chrom_numerical = chrom[3:] if chrom.startswith("chr") else chrom
+        pos = line[1]
+        ref = line[3]
+        alt = line[4]
+        info_fields = {}
+        # Check if the alt allele has multiple values, if it does split them
+        alts = alt.split(",")
+        for allele_idx, alt_allele in enumerate(alts):
+            # Each carrier is listed once per copy of the allele, phased and unphased genotypes alike
+            copies = (allele1[record_index] == allele_idx + 1).astype(np.int64) + (allele2[record_index] == allele_idx + 1)
+            carriers = np.flatnonzero(copies)
+            if diagnosis_codes is not None:
+                # Haploid ALT calls are coded as homozygous, like genotype_store.py does
+                genotype_codes = np.where(allele2[record_index, carriers] == NO_ALLELE, 2, copies[carriers])
+                carrier_info = "carriers=" + encode_carriers(carriers.tolist(), genotype_codes.tolist(), read_depths[record_index, carriers].tolist(), [diagnosis_codes[carrier] for carrier in carriers.tolist()])
+            else:
+                alleles_proband_list = []
+                for proband_index in np.repeat(carriers, copies[carriers]).tolist():
+                    if proband_index not in info_fields:
                         proband_id = header[proband_index + 9]  # Correct index for proband ID
-                        info_field = [proband_id, genotype, read_depth, fetch_diagnosis(proband_id, args.probands)]
-                        # Append proband ID to dictionary mapping alleles to proband IDs
-                        if allele1 and allele1 != '0':
-                            if allele1 not in alleles_proband_dict:
-                                alleles_proband_dict[allele1] = []
-                            alleles_proband_dict[allele1].append(info_field)
-                        if allele2 and allele2 != '0':
-                            if allele2 not in alleles_proband_dict:
-                                alleles_proband_dict[allele2] = []
-                            alleles_proband_dict[allele2].append(info_field)
-                # Check if the alt allele has multiple values, if it does split them
-                if "," in alt:
-                    alts = alt.split(",")
-                else:
-                    alts = [alt]
-                for allele_idx, alt_allele in enumerate(alts):
-                    # Generate the info field for the current alt allele
-                    minimal_info = line[:9]
-                    if alt_allele != "*":
-                        minimal_info[2] = f"{chrom_numerical}-{pos}-{ref}-{alt_allele}"  # Set the ID to gnomAD style ID
-                    elif alt_allele == "*":
-                        minimal_info[2] = f"{chrom_numerical}-{pos}-{ref}-del"
-                    minimal_info[4] = alt_allele
-                    minimal_info[7] = "samples=" + str(alleles_proband_dict[str(allele_idx+1)])
-                    ##remove the format field
-                    minimal_info.pop()
-                    line_string = "\t".join(minimal_info)
-                    formatted_vcf += line_string + "\n"
-    return formatted_vcf
-                    
+                        genotype = genotypes.gt_string(record_index, proband_index)
+                        read_depth = read_depths[record_index, proband_index]
+                        read_depth = str(read_depth) if read_depth != MISSING_DEPTH else "."
+                        info_fields[proband_index] = [proband_id, genotype, read_depth, sample_diagnoses[proband_index]]
+                    alleles_proband_list.append(info_fields[proband_index])
+                carrier_info = "samples=" + str(alleles_proband_list)
+            # Generate the info field for the current alt allele
+            minimal_info = line[:9]
+            if alt_allele != "*":
+                minimal_info[2] = f"{chrom_numerical}-{pos}-{ref}-{alt_allele}"  # Set the ID to gnomAD style ID
+            elif alt_allele == "*":
+                minimal_info[2] = f"{chrom_numerical}-{pos}-{ref}-del"
+            minimal_info[4] = alt_allele
+            minimal_info[7] = carrier_info
+            ##remove the format field
+            minimal_info.pop()
+            line_string = "\t".join(minimal_info)
+            yield line_string + "\n", carriers
+
+class DiagnosisIndex:
+    '''
+    Case-insensitive index of the proband CSV, mapping a sample ID to its diagnosis (4th column) and its role,
+    which is proband, father or mother depending on whether the ID is in the 1st, 2nd or 3rd column.
+
+    By default a sample matches the first cell (row by row, column by column) that contains its ID as a substring,
+    the same as fetch_diagnosis has always done. With exact=True the ID has to equal the cell.
+    Results are memoized, so after preload() every lookup is a dictionary access.
+    '''
+
+    ROLES = ["proband", "father", "mother"]
+
+    def __init__(self, proband_file, exact=False):
+        self.exact = exact
+        self.cells = []
+        self.exact_matches = {}
+        self.matches = {}
+        with open(proband_file, 'r', newline='') as file:
+            for row in csv.reader(file):
+                diagnosis = row[3] if len(row) > 3 else "."
+                for col_index, cell in enumerate(row[:3]):
+                    cell = cell.lower()
+                    self.cells.append((cell, self.ROLES[col_index], diagnosis))
+                    # Keep the first occurrence of each ID for exact matching
+                    self.exact_matches.setdefault(cell, (diagnosis, self.ROLES[col_index]))
+
+    def preload(self, sample_ids):
+        '''Resolve a batch of sample IDs up front, e.g. all samples in the VCF header.'''
+        for sample_id in sample_ids:
+            self.lookup(sample_id)
+
+    def lookup(self, sample_id):
+        '''Return (diagnosis, role) for a sample ID, or None if it is not in the proband file.'''
+        search_string = sample_id.lower()
+        if self.exact:
+            return self.exact_matches.get(search_string)
+        if search_string not in self.matches:
+            self.matches[search_string] = next(((diagnosis, role) for cell, role, diagnosis in self.cells if search_string in cell), None)
+        return self.matches[search_string]
+
+    def fetch(self, sample_id):
+        '''Return the diagnosis formatted like fetch_diagnosis: the diagnosis, father_<diagnosis>, mother_<diagnosis> or ".".'''
+        match = self.lookup(sample_id)
+        if match is None:
+            return "."
+        diagnosis, role = match
+        return diagnosis if role == "proband" else f"{role}_{diagnosis}"
+
+
 ##Function to fetch whether a proband is diagnosed or undiagnosed
 def fetch_diagnosis(proband_id, proband_file):
-    # Convert search_string to lowercase for case-insensitive search
-    search_string = proband_id.lower()
-    
-    # Open the CSV file
-    with open(proband_file, 'r', newline='') as file:
-        reader = csv.reader(file)
-
-        # Iterate through each row in the CSV
-        for row in reader:
-            # Convert each cell to lowercase for case-insensitive comparison
-            row_lower = [cell.lower() for cell in row]
-
-            # Iterate through each cell in the row
-            for col_index, cell in enumerate(row_lower):
-                # Check if the search_string exists in the cell
-                if search_string in cell:
-                    # Determine the value based on the column index
-                    if col_index == 0:
-                        # If the search string is in the first column
-                        return row[3]
-                    elif col_index == 1:
-                        # If the search string is in the second column
-                        return f"father_{row[3]}"
-                    elif col_index == 2:
-                        # If the search string is in the third column
-                        return f"mother_{row[3]}"
-    # If the search string is not found
-    return "."
+    # Reads the proband file on every call, use a DiagnosisIndex when looking up more than one sample
+    return DiagnosisIndex(proband_file).fetch(proband_id)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Retrieve which proband IDs have the disease allele and format them")
     parser.add_argument("--input", required=True, help="Path to input VCF file")
     parser.add_argument("--probands", required=True, help="Path to proband IDs file")
+    parser.add_argument("--exact", action="store_true", help="Match sample IDs to the proband file exactly instead of by substring")
+    parser.add_argument("--output", help="Path to output VCF, BGZF compressed if it ends in .gz or .bgz (default: stdout)")
+    parser.add_argument("--carrier_format", choices=["legacy", "compact"], default="legacy", help="legacy: samples=[[id, GT, DP, diagnosis], ...]; compact: carriers=index:genotype code:depth:diagnosis code|... (see carrier_index.py)")
+    parser.add_argument("--carrier_index", help="Directory to write a sample -> carried records index to (needs --output)")
     args = parser.parse_args()
-    print(format_proband_ids(args.input))
\ No newline at end of file
+    if args.carrier_index and args.output is None:
+        parser.error("--carrier_index needs --output, record offsets cannot be taken from stdout")
+
+    # Write each record as soon as it is formatted
+    if args.output is None:
+        out = sys.stdout
+        write = out.write
+    elif args.output.endswith((".gz", ".bgz")):
+        out = BgzfWriter(args.output)
+        write = out.write
+    else:
+        # Binary, so that tell() gives the byte offsets for the carrier index
+        out = open(args.output, "wb")
+        write = lambda record: out.write(record.encode())
+    carrier_index = None
+    if args.carrier_index:
+        carrier_index = CarrierIndexWriter(out.tell, "bgzf" if isinstance(out, BgzfWriter) else "none")
+    try:
+        for record in iter_formatted_records(args.input, args.probands, args.exact, args.carrier_format, carrier_index):
+            write(record)
+    finally:
+        if args.output is not None:
+            out.close()
+    if carrier_index is not None:
+        carrier_index.save(args.carrier_index)
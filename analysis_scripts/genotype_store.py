@@ -0,0 +1,242 @@
+import argparse
+import os
+import sys
+import numpy as np
+from format_gnomad_info import open_text
+from variant_index import VariantIndex
+
+'''
+This script converts a cohort VCF (diagnosed or undiagnosed) into a bit-packed genotype store, so that per-sample genotypes
+can be read without running bcftools query against the VCF for every variant.
+
+Genotypes are stored with 2 bits each in a memory-mapped uint8 matrix of variants x ceil(samples / 4) bytes,
+next to a sorted variant-key index (see variant_index.py) and the sample names. Multi-allelic records are split
+into one row per ALT allele, like format_proband_ids.py does, and each genotype is coded as the number of copies
+of that ALT allele among its called alleles:
+    0 = no copies, 1 = heterozygous, 2 = homozygous (or haploid ALT), 3 = missing (no allele called)
+A second matrix of 4 bits per genotype (variants x ceil(samples / 2) bytes) keeps what the copy number leaves out:
+    0 = plain diploid call, 1 = phased, 2 = haploid, 3 = carries another ALT allele of the record
+plus 4 (PARTIAL) for half calls such as ./1, where one allele is missing and the other is called.
+So a sample that is 0/2 or 2/2 at a multi-allelic site is still a carrier of a non-reference allele in the row of
+ALT 1, ./1 is a heterozygous partial call, and 0/0, 0|0, 0 and ./0 can be told apart. genotype_dict rebuilds the GT
+strings from both matrices, writing the row's ALT as allele 1, any other ALT of the record as allele 2 (1/2 stays
+1/2, 0/2 and 2/2 both read as 0/2) and the missing allele of a half call first (1/. reads as ./1).
+
+Usage:
+    python genotype_store.py build --vcf undiagnosed_cohort.vcf.gz --output undiagnosed_store/
+    python genotype_store.py query undiagnosed_store/ 1-55051215-G-GA [--samples S1,S2,S3]
+'''
+
+HOM_REF, HET, HOM_ALT, MISSING = 0, 1, 2, 3
+PLAIN, PHASED, HAPLOID, OTHER_ALT = 0, 1, 2, 3
+# Flag added to the detail code of half calls, the detail codes above stay in the low 2 bits
+PARTIAL = 4
+DETAIL_BITS = 4
+# GT string of each (genotype code, detail code), combinations that cannot occur in haploid or diploid calls read as the closest call
+GT_STRINGS = np.array([
+    ["0/0", "0|0", "0", "0/2", "./0", ".|0", "./0", "./2"],
+    ["0/1", "0|1", "0/1", "1/2", "./1", ".|1", "./1", "./1"],
+    ["1/1", "1|1", "1", "1/1", "./1", ".|1", "./1", "./1"],
+    ["./.", ".|.", ".", "./.", "./.", ".|.", ".", "./."],
+])
+CHUNK_SIZE = 100_000
+
+
+def parse_gt(gt):
+    '''Split a GT string into a tuple of allele numbers, -1 for a missing allele.'''
+    return tuple(-1 if allele == "." else int(allele) for allele in gt.replace("|", "/").split("/"))
+
+
+def allele_codes(alleles, allele_number):
+    '''Code one sample's genotype by the number of copies of allele_number among its called alleles.'''
+    called = [allele for allele in alleles if allele != -1]
+    if not called:
+        return MISSING
+    copies = called.count(allele_number)
+    if len(alleles) == 1:
+        return HOM_ALT if copies else HOM_REF
+    return min(copies, 2)
+
+
+def detail_code(gt, alleles, allele_number):
+    '''
+    Code what allele_codes leaves out of one sample's genotype: another ALT allele, a haploid call or phasing,
+    with the PARTIAL flag added if some but not all alleles are missing.
+    '''
+    partial = PARTIAL if -1 in alleles and any(allele != -1 for allele in alleles) else 0
+    if any(allele > 0 and allele != allele_number for allele in alleles):
+        return OTHER_ALT | partial
+    if len(alleles) == 1:
+        return HAPLOID
+    return (PHASED if "|" in gt else PLAIN) | partial
+
+
+def non_reference(codes, details):
+    '''True where a genotype carries a non-reference allele of the record, the row's ALT or another one.'''
+    return (codes == HET) | (codes == HOM_ALT) | ((details & (PARTIAL - 1)) == OTHER_ALT)
+
+
+def pack_codes(codes, bits=2):
+    '''Pack a vector of genotype codes of the given bits each into bytes, the first sample in the low bits.'''
+    per_byte = 8 // bits
+    padded = np.zeros(-(-len(codes) // per_byte) * per_byte, dtype=np.uint8)
+    padded[:len(codes)] = codes
+    padded = padded.reshape(-1, per_byte)
+    return np.bitwise_or.reduce(padded << (np.arange(per_byte, dtype=np.uint8) * bits), axis=1).astype(np.uint8)
+
+
+def build_store(vcf_filepath, output_dir):
+    '''Stream the cohort VCF once and write the packed genotype and detail codes, variant index and sample names to output_dir.'''
+    samples = None
+    chroms, positions, alleles, packed_chunks, chunk = [], [], [], [], []
+    detail_chunks, detail_chunk = [], []
+    gt_cache = {}
+
+    with open_text(vcf_filepath) as file:
+        for line in file:
+            if line.startswith("##"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if line.startswith("#"):
+                samples = fields[9:]
+                continue
+            chrom, pos, _, ref, alt = fields[:5]
+            gt_field = fields[8].split(":").index("GT")
+            sample_gts = [sample.split(":")[gt_field] if gt_field else sample.split(":", 1)[0] for sample in fields[9:]]
+            for allele_number, alt_allele in enumerate(alt.split(","), 1):
+                # Only a handful of distinct GT strings occur, so code each one once per ALT allele number
+                for gt in set(sample_gts):
+                    if (gt, allele_number) not in gt_cache:
+                        parsed = parse_gt(gt)
+                        gt_cache[gt, allele_number] = (allele_codes(parsed, allele_number), detail_code(gt, parsed, allele_number))
+                coded = np.array([gt_cache[gt, allele_number] for gt in sample_gts], dtype=np.uint8).reshape(-1, 2)
+                chroms.append(chrom)
+                positions.append(int(pos))
+                alleles.append(f"{ref}-{'del' if alt_allele == '*' else alt_allele}".encode())
+                chunk.append(pack_codes(coded[:, 0]))
+                detail_chunk.append(pack_codes(coded[:, 1], DETAIL_BITS))
+                if len(chunk) == CHUNK_SIZE:
+                    packed_chunks.append(np.vstack(chunk))
+                    detail_chunks.append(np.vstack(detail_chunk))
+                    chunk, detail_chunk = [], []
+
+    if samples is None:
+        sys.exit("No VCF header found.")
+    if chunk:
+        packed_chunks.append(np.vstack(chunk))
+        detail_chunks.append(np.vstack(detail_chunk))
+    packed = np.vstack(packed_chunks) if packed_chunks else np.empty((0, -(-len(samples) // 4)), dtype=np.uint8)
+    details = np.vstack(detail_chunks) if detail_chunks else np.empty((0, -(-len(samples) * DETAIL_BITS // 8)), dtype=np.uint8)
+
+    index, order = VariantIndex.build(chroms, positions, alleles)
+    index.save(output_dir)
+    np.save(os.path.join(output_dir, "genotypes.npy"), packed[order])
+    np.save(os.path.join(output_dir, "genotype_details.npy"), details[order])
+    with open(os.path.join(output_dir, "samples.txt"), 'w') as file:
+        file.write("\n".join(samples) + "\n")
+
+    vcf_size = os.path.getsize(vcf_filepath)
+    store_size = sum(os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir))
+    print(f"Stored {len(index)} variants x {len(samples)} samples in {store_size} bytes ({store_size / max(vcf_size, 1):.1%} of the VCF)", file=sys.stderr)
+
+
+class GenotypeStore:
+    '''Memory-mapped bit-packed genotype store built by build_store.'''
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "samples.txt"), 'r') as file:
+            self.samples = [line.rstrip("\n") for line in file if line.rstrip("\n")]
+        self.sample_index = {sample: index for index, sample in enumerate(self.samples)}
+        self.variants = VariantIndex.load(store_dir)
+        self.packed = np.load(os.path.join(store_dir, "genotypes.npy"), mmap_mode='r')
+        self.packed_details = np.load(os.path.join(store_dir, "genotype_details.npy"), mmap_mode='r')
+
+    def row(self, gnomad_id):
+        '''Return the row of a gnomad_id, or -1 if the variant is not in the cohort VCF.'''
+        return self.variants.find(gnomad_id)
+
+    def sample_columns(self, samples):
+        '''Map sample names to column numbers, raising KeyError for samples that are not in the cohort VCF.'''
+        return np.array([self.sample_index[sample] for sample in samples], dtype=np.int64)
+
+    def genotype_codes(self, rows, columns=None, packed=None, bits=2):
+        '''
+        Return the genotype codes of the given rows and sample columns as a uint8 matrix (len(rows) x len(columns)).
+        Every element is a constant-time slice of the packed matrix, all samples are returned if columns is None.
+        packed and bits select the matrix to read, the 2-bit genotype codes by default.
+        '''
+        packed = self.packed if packed is None else packed
+        per_byte = 8 // bits
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        if columns is None:
+            columns = np.arange(len(self.samples))
+        columns = np.asarray(columns, dtype=np.int64)
+        packed = packed[rows][:, columns // per_byte]
+        return (packed >> ((columns % per_byte) * bits).astype(np.uint8)) & ((1 << bits) - 1)
+
+    def detail_codes(self, rows, columns=None):
+        '''Return the detail codes (PLAIN, PHASED, HAPLOID or OTHER_ALT, plus PARTIAL) of the given rows and sample columns, as genotype_codes.'''
+        return self.genotype_codes(rows, columns, self.packed_details, DETAIL_BITS)
+
+    def genotype_codes_at(self, rows, columns, packed=None, bits=2):
+        '''Return the genotype code of each (rows[i], columns[i]) pair, for looking up one sample per variant.'''
+        packed = self.packed if packed is None else packed
+        per_byte = 8 // bits
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        return (packed[rows, columns // per_byte] >> ((columns % per_byte) * bits).astype(np.uint8)) & ((1 << bits) - 1)
+
+    def detail_codes_at(self, rows, columns):
+        '''Return the detail code of each (rows[i], columns[i]) pair.'''
+        return self.genotype_codes_at(rows, columns, self.packed_details, DETAIL_BITS)
+
+    def genotype_dict(self, gnomad_id, samples=None):
+        '''
+        Return {sample: GT} for a variant in the same form as the SAMPLE:GT lines from bcftools query,
+        or an empty dictionary if the variant is not in the cohort VCF.
+        '''
+        row = self.row(gnomad_id)
+        if row < 0:
+            return {}
+        samples = self.samples if samples is None else [sample for sample in samples if sample in self.sample_index]
+        columns = self.sample_columns(samples)
+        codes = self.genotype_codes([row], columns)[0]
+        details = self.detail_codes([row], columns)[0]
+        return dict(zip(samples, GT_STRINGS[codes, details].tolist()))
+
+    def allele_counts(self, rows):
+        '''Return the ALT allele count, total called alleles and homozygous ALT count of each row.'''
+        codes = self.genotype_codes(rows)
+        called = codes != MISSING
+        alt_copies = np.where(called, codes, 0)
+        # Half calls have one called allele
+        partial = (self.detail_codes(rows) & PARTIAL) > 0
+        return alt_copies.sum(axis=1), 2 * called.sum(axis=1) - partial.sum(axis=1), (codes == HOM_ALT).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a bit-packed cohort genotype store.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the store from a cohort VCF.")
+    build_parser.add_argument("--vcf", type=str, required=True, help="Cohort VCF, plain or bgzipped.")
+    build_parser.add_argument("--output", type=str, required=True, help="Directory to write the store to.")
+
+    query_parser = subparsers.add_parser("query", help="Print SAMPLE:GT lines of a variant, like bcftools query -f '[%%SAMPLE:%%GT\\n]'.")
+    query_parser.add_argument("store", type=str, help="Directory of the store.")
+    query_parser.add_argument("gnomad_id", type=str, help="Variant in chr-pos-ref-alt format.")
+    query_parser.add_argument("--samples", type=str, help="Comma-separated samples to print (default: all).")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_store(args.vcf, args.output)
+    elif args.command == "query":
+        store = GenotypeStore(args.store)
+        samples = args.samples.split(",") if args.samples else None
+        for sample, gt in store.genotype_dict(args.gnomad_id, samples).items():
+            print(f"{sample}:{gt}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import sys
+from array import array
+import numpy as np
+from format_gnomad_info import GNOMAD_KEY_ORDER, make_tab_delimited_string, open_text, read_cohort_tsv
+from variant_index import CHROMOSOMES, VariantIndex, normalise_chrom
+
+'''
+This script builds a compact local index of the gnomAD INFO fields used by format_gnomad_info.py, so that the gnomAD VCF
+only has to be decompressed and parsed once per gnomAD release instead of once per cohort release.
+
+The index is a directory holding every AF* field plus FS, MQ, QD, inbreeding_coeff, spliceai_ds_max and phylop as float32
+columns of a memory-mapped .npy matrix (NaN where missing), next to a sorted variant-key index (see variant_index.py).
+Lookups by gnomad_id are a binary search with no decompression. AF_grpmax is filled numerically at build time
+as the maximum AF* value where the VCF does not provide it.
+
+Usage:
+    python gnomad_index.py build --vcf gnomad.genomes.sites.chr*.vcf.bgz --output gnomad_index/
+    python gnomad_index.py query gnomad_index/ 1-55051215-G-GA
+    python gnomad_index.py annotate gnomad_index/ --cohort_tsv cohort.tsv --output cohort_gnomad.tsv
+'''
+
+NON_AF_FIELDS = ["FS", "MQ", "QD", "inbreeding_coeff", "spliceai_ds_max", "phylop"]
+CHUNK_SIZE = 1_000_000
+
+
+def info_fields_from_header(header_lines):
+    '''Get every AF* INFO field declared in the VCF header, plus the AF fields written by format_gnomad_info.py.'''
+    af_fields = [key for key in GNOMAD_KEY_ORDER if key.startswith("AF")]
+    for line in header_lines:
+        if line.startswith("##INFO=<ID=AF"):
+            key = line[len("##INFO=<ID="):].split(",", 1)[0]
+            if key not in af_fields:
+                af_fields.append(key)
+    return af_fields + NON_AF_FIELDS
+
+
+def parse_info_values(info, field_columns, row):
+    '''Parse the INFO column of one record into a float32 row, NaN for missing or non-numeric values.'''
+    row[:] = np.nan
+    for pair in info.split(';'):
+        key, sep, value = pair.partition('=')
+        if not sep:
+            continue
+        column = field_columns.get(key.strip())
+        if column is not None:
+            try:
+                row[column] = float(value)
+            except ValueError:
+                pass
+
+
+def fill_grpmax(values, fields, field_columns):
+    '''Fill AF_grpmax numerically from the AF* columns of a block of rows where the VCF does not provide it.'''
+    af_columns = [column for column, key in enumerate(fields) if key.startswith("AF") and key != "AF_grpmax"]
+    grpmax_column = field_columns["AF_grpmax"]
+    missing = np.isnan(values[:, grpmax_column])
+    if missing.any():
+        af_values = values[np.ix_(missing, af_columns)]
+        has_af = ~np.isnan(af_values).all(axis=1)
+        grpmax = np.full(len(af_values), np.nan, dtype=np.float32)
+        grpmax[has_af] = np.nanmax(af_values[has_af], axis=1)
+        values[missing, grpmax_column] = grpmax
+
+
+def build_index(vcf_filepaths, output_dir):
+    '''
+    Stream the gnomAD VCF(s) once and write the typed columns and sorted variant index to output_dir.
+
+    Only the uint64 variant keys and the allele strings are held in memory (as compact arrays). The float32 rows are
+    written to a temporary file in VCF order, CHUNK_SIZE rows at a time, and copied into the memory-mapped
+    gnomad_values.npy in index order block by block once the keys are sorted.
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    unsorted_filepath = os.path.join(output_dir, "gnomad_values.unsorted.tmp")
+    chromosomes = list(CHROMOSOMES)
+    chrom_codes = {chrom: code for code, chrom in enumerate(chromosomes)}
+    keys, allele_lengths, allele_blob = array('Q'), array('i'), bytearray()
+    fields, chunk, n_chunk = None, None, 0
+
+    with open(unsorted_filepath, 'wb') as unsorted:
+        for vcf_filepath in vcf_filepaths:
+            header_lines = []
+            with open_text(vcf_filepath) as file:
+                for line in file:
+                    if line.startswith("##"):
+                        header_lines.append(line)
+                        continue
+                    if line.startswith("#"):
+                        file_fields = info_fields_from_header(header_lines)
+                        if fields is None:
+                            fields = file_fields
+                            field_columns = {key: column for column, key in enumerate(fields)}
+                            chunk = np.empty((CHUNK_SIZE, len(fields)), dtype=np.float32)
+                        elif file_fields != fields:
+                            sys.exit(f"{vcf_filepath} declares different AF fields from the first VCF, build separate indexes.")
+                        continue
+                    chrom, pos, _, ref, alt, _, _, info = line.rstrip("\n").split("\t", 8)[:8]
+                    chrom = normalise_chrom(chrom)
+                    code = chrom_codes.get(chrom)
+                    if code is None:
+                        code = chrom_codes[chrom] = len(chromosomes)
+                        chromosomes.append(chrom)
+                    keys.append((code << 32) | int(pos))
+                    allele = f"{ref}-{alt}".encode()
+                    allele_lengths.append(len(allele))
+                    allele_blob += allele
+                    parse_info_values(info, field_columns, chunk[n_chunk])
+                    n_chunk += 1
+                    if n_chunk == CHUNK_SIZE:
+                        fill_grpmax(chunk, fields, field_columns)
+                        chunk.tofile(unsorted)
+                        n_chunk = 0
+            print(f"Read {len(keys)} variants after {vcf_filepath}", file=sys.stderr)
+        if fields is None:
+            os.remove(unsorted_filepath)
+            sys.exit("No VCF header found.")
+        fill_grpmax(chunk[:n_chunk], fields, field_columns)
+        chunk[:n_chunk].tofile(unsorted)
+    del chunk
+
+    index, order = VariantIndex.from_keys(np.frombuffer(keys, dtype=np.uint64), np.frombuffer(allele_lengths, dtype=np.int32),
+                                          np.frombuffer(allele_blob, dtype=np.uint8), chromosomes)
+    del keys, allele_lengths, allele_blob
+    index.save(output_dir)
+
+    values = np.lib.format.open_memmap(os.path.join(output_dir, "gnomad_values.npy"), mode='w+', dtype=np.float32,
+                                       shape=(len(order), len(fields)))
+    if len(order):
+        unsorted_values = np.memmap(unsorted_filepath, dtype=np.float32, mode='r', shape=(len(order), len(fields)))
+        for start in range(0, len(order), CHUNK_SIZE):
+            values[start:start + CHUNK_SIZE] = unsorted_values[order[start:start + CHUNK_SIZE]]
+        del unsorted_values
+    values.flush()
+    del values
+    os.remove(unsorted_filepath)
+    with open(os.path.join(output_dir, "gnomad_fields.json"), 'w') as file:
+        json.dump({"fields": fields, "sources": [os.path.abspath(path) for path in vcf_filepaths]}, file, indent=1)
+    print(f"Indexed {len(index)} variants with {len(fields)} fields in {output_dir}", file=sys.stderr)
+
+
+class GnomadIndex:
+    '''Memory-mapped gnomAD INFO index built by build_index.'''
+
+    def __init__(self, index_dir):
+        with open(os.path.join(index_dir, "gnomad_fields.json"), 'r') as file:
+            self.fields = json.load(file)["fields"]
+        self.field_columns = {key: column for column, key in enumerate(self.fields)}
+        self.variants = VariantIndex.load(index_dir)
+        self.values = np.load(os.path.join(index_dir, "gnomad_values.npy"), mmap_mode='r')
+
+    def lookup(self, gnomad_id):
+        '''Return {field: float32 value} for a gnomad_id, or None if the variant is not in gnomAD.'''
+        row = self.variants.find(gnomad_id)
+        if row < 0:
+            return None
+        return dict(zip(self.fields, self.values[row]))
+
+    def info_dict(self, gnomad_id):
+        '''Return the fields as the strings make_tab_delimited_string expects, "." for missing values.'''
+        values = self.lookup(gnomad_id)
+        if values is None:
+            return {key: '.' for key in GNOMAD_KEY_ORDER}
+        return {key: '.' if np.isnan(value) else str(value) for key, value in values.items()}
+
+
+def annotate_cohort_tsv(index, cohort_tsv, output):
+    '''Add the gnomAD columns to every row of the cohort TSV from the index.'''
+    header, rows = read_cohort_tsv(cohort_tsv)
+    out = open(output, 'w') if output else sys.stdout
+    try:
+        out.write(header + "\t" + "\t".join(GNOMAD_KEY_ORDER) + "\n")
+        for gnomad_id, rest in rows:
+            out.write(make_tab_delimited_string(gnomad_id, rest, index.info_dict(gnomad_id)) + "\n")
+    finally:
+        if output:
+            out.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a compact memory-mapped index of gnomAD INFO fields.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the index from the gnomAD sites VCF(s).")
+    build_parser.add_argument("--vcf", type=str, nargs="+", required=True, help="gnomAD sites VCF(s), plain or bgzipped.")
+    build_parser.add_argument("--output", type=str, required=True, help="Directory to write the index to.")
+
+    query_parser = subparsers.add_parser("query", help="Print the indexed fields of gnomad_ids.")
+    query_parser.add_argument("index", type=str, help="Directory of the index.")
+    query_parser.add_argument("gnomad_ids", type=str, nargs="+", help="Variants in chr-pos-ref-alt format.")
+
+    annotate_parser = subparsers.add_parser("annotate", help="Add the gnomAD columns to a cohort TSV.")
+    annotate_parser.add_argument("index", type=str, help="Directory of the index.")
+    annotate_parser.add_argument("--cohort_tsv", type=str, required=True, help="Cohort TSV with gnomad_id in the first column.")
+    annotate_parser.add_argument("--output", type=str, help="Path to the output TSV (default: stdout).")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_index(args.vcf, args.output)
+    elif args.command == "query":
+        index = GnomadIndex(args.index)
+        for gnomad_id in args.gnomad_ids:
+            info = index.info_dict(gnomad_id)
+            print(gnomad_id + "\t" + "\t".join(f"{key}={info.get(key, '.')}" for key in GNOMAD_KEY_ORDER))
+    elif args.command == "annotate":
+        annotate_cohort_tsv(GnomadIndex(args.index), args.cohort_tsv, args.output)
+
+
+if __name__ == "__main__":
+    main()
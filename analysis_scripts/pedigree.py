@@ -0,0 +1,111 @@
+import argparse
+import sys
+from collections import namedtuple
+
+'''
+Pedigree index shared by the inheritance tools (format_inheritance_info.py, annotation_server.py, get_parents_genotypes.sh).
+
+The PED file is parsed once into a dictionary from sample ID to its PED entry, so finding a sample's father, mother,
+sex and phenotype is O(1) instead of a scan of the whole PED file per carrier. Complete trios, duos and singletons
+are precomputed when the PED file is read.
+
+All fields are kept as strings, with "0" for a missing parent as in the PED format.
+
+Usage:
+    python pedigree.py cohort.ped --sample PROBAND_ID    (prints family, sample, father and mother)
+    python pedigree.py cohort.ped --summary
+'''
+
+PedEntry = namedtuple("PedEntry", ["family_id", "sample_id", "father_id", "mother_id", "sex", "phenotype"])
+
+MISSING_PARENT = "0"
+
+
+class Pedigree:
+    '''Family/trio index of a PED file.'''
+
+    def __init__(self, entries):
+        self.samples = {}
+        self.families = {}
+        for entry in entries:
+            # Keep the first line for a sample, the same as taking the first matching row of the PED file
+            if entry.sample_id in self.samples:
+                continue
+            self.samples[entry.sample_id] = entry
+            self.families.setdefault(entry.family_id, []).append(entry.sample_id)
+
+        parent_ids = set()
+        for entry in self.samples.values():
+            parent_ids.update(parent for parent in (entry.father_id, entry.mother_id) if parent != MISSING_PARENT)
+
+        # Trios and duos are keyed on the child, singletons have no parents and no children in the PED file
+        self.trios = [entry for entry in self.samples.values() if entry.father_id != MISSING_PARENT and entry.mother_id != MISSING_PARENT]
+        self.duos = [entry for entry in self.samples.values() if (entry.father_id == MISSING_PARENT) != (entry.mother_id == MISSING_PARENT)]
+        self.singletons = [entry for entry in self.samples.values()
+                           if entry.father_id == MISSING_PARENT and entry.mother_id == MISSING_PARENT and entry.sample_id not in parent_ids]
+
+    @classmethod
+    def from_ped(cls, ped_file):
+        '''Read a tab-delimited PED file, skipping blank lines and # comments.'''
+        entries = []
+        with open(ped_file, 'r') as file:
+            for line_number, line in enumerate(file, 1):
+                if not line.strip() or line.startswith("#"):
+                    continue
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) < 6:
+                    # Fall back to whitespace for PED files that are not tab-delimited
+                    fields = line.split()
+                if len(fields) < 6:
+                    sys.stderr.write(f"Skipping PED line {line_number} with fewer than 6 columns.\n")
+                    continue
+                entries.append(PedEntry(*(field.strip() for field in fields[:6])))
+        return cls(entries)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.samples
+
+    def __len__(self):
+        return len(self.samples)
+
+    def get(self, sample_id):
+        '''Return the PedEntry of a sample, or None if it is not in the PED file.'''
+        return self.samples.get(sample_id)
+
+    def father(self, sample_id):
+        entry = self.samples.get(sample_id)
+        return None if entry is None or entry.father_id == MISSING_PARENT else entry.father_id
+
+    def mother(self, sample_id):
+        entry = self.samples.get(sample_id)
+        return None if entry is None or entry.mother_id == MISSING_PARENT else entry.mother_id
+
+    def family(self, family_id):
+        '''Return the sample IDs of a family in PED file order.'''
+        return self.families.get(family_id, [])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Look up samples in a PED file.")
+    parser.add_argument("ped", type=str, help="The path to the PED file.")
+    parser.add_argument("--sample", type=str, help="Print the family, sample, father and mother IDs of this sample.")
+    parser.add_argument("--summary", action="store_true", help="Print the number of families, trios, duos and singletons.")
+    args = parser.parse_args()
+
+    pedigree = Pedigree.from_ped(args.ped)
+    if args.sample:
+        entry = pedigree.get(args.sample)
+        if entry is None:
+            sys.stderr.write(f"Sample {args.sample} not found in PED file.\n")
+            sys.exit(1)
+        print(f"{entry.family_id}\t{entry.sample_id}\t{entry.father_id}\t{entry.mother_id}")
+    if args.summary:
+        print(f"families\t{len(pedigree.families)}")
+        print(f"samples\t{len(pedigree)}")
+        print(f"trios\t{len(pedigree.trios)}")
+        print(f"duos\t{len(pedigree.duos)}")
+        print(f"singletons\t{len(pedigree.singletons)}")
+
+
+if __name__ == "__main__":
+    main()
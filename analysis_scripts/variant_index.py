@@ -0,0 +1,150 @@
+import json
+import os
+import numpy as np
+
+'''
+Sorted variant-key index shared by the memory-mapped stores in this directory (gnomAD INFO index, genotype store).
+
+Each variant is keyed by (chromosome code << 32 | position) in a sorted uint64 array, with the "REF-ALT" alleles
+kept in a single byte blob so that a gnomad_id (chr-pos-ref-alt) is found with a binary search and a short scan
+over the records at that position. All arrays are saved as .npy files and loaded memory-mapped.
+'''
+
+# Chromosome codes, the index in this list is the code. Unlisted contigs are appended when an index is built.
+CHROMOSOMES = [""] + [str(i) for i in range(1, 23)] + ["X", "Y", "M"]
+# Variants whose allele strings are moved per block when an index is built from unsorted keys
+REORDER_BLOCK = 1_000_000
+
+
+def normalise_chrom(chrom):
+    '''Strip the chr prefix so that VCF contigs and gnomad_ids use the same chromosome names.'''
+    chrom = chrom[3:] if chrom.startswith("chr") else chrom
+    return "M" if chrom == "MT" else chrom
+
+
+def split_gnomad_id(gnomad_id):
+    '''Split a gnomad_id into (chrom, pos, ref, alt), or return None if it is not in chr-pos-ref-alt format.'''
+    fields = gnomad_id.split("-")
+    if len(fields) != 4 or not fields[1].isdigit():
+        return None
+    chrom, pos, ref, alt = fields
+    return normalise_chrom(chrom), int(pos), ref, alt
+
+
+class VariantIndex:
+    '''Sorted chr-pos-ref-alt index mapping gnomad_ids to row numbers of a store.'''
+
+    def __init__(self, keys, allele_offsets, alleles, chromosomes):
+        self.keys = keys
+        self.allele_offsets = allele_offsets
+        self.alleles = alleles
+        self.chromosomes = chromosomes
+        self.chrom_codes = {chrom: code for code, chrom in enumerate(chromosomes)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    @classmethod
+    def build(cls, chroms, positions, alleles):
+        '''
+        Build an index from per-variant chromosome names, positions and "REF-ALT" byte strings.
+
+        :return: (index, order) where order[i] is the input position of the variant in sorted row i,
+                 so that per-variant value arrays can be put in index order with values[order]
+        '''
+        chromosomes = list(CHROMOSOMES)
+        chrom_codes = {chrom: code for code, chrom in enumerate(chromosomes)}
+        codes = np.empty(len(chroms), dtype=np.uint64)
+        for i, chrom in enumerate(chroms):
+            chrom = normalise_chrom(chrom)
+            if chrom not in chrom_codes:
+                chrom_codes[chrom] = len(chromosomes)
+                chromosomes.append(chrom)
+            codes[i] = chrom_codes[chrom]
+        keys = (codes << np.uint64(32)) | np.asarray(positions, dtype=np.uint64)
+
+        lengths = np.fromiter((len(allele) for allele in alleles), dtype=np.int64, count=len(alleles))
+        blob = np.frombuffer(b"".join(alleles), dtype=np.uint8)
+        return cls.from_keys(keys, lengths, blob, chromosomes)
+
+    @classmethod
+    def from_keys(cls, keys, lengths, blob, chromosomes):
+        '''
+        Build an index from unsorted variant keys (see key), the length of each variant's "REF-ALT" string and the
+        concatenated strings, for stores that encode variants while streaming instead of keeping them as Python lists.
+
+        :return: (index, order) as build
+        '''
+        keys = np.asarray(keys, dtype=np.uint64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        order = np.argsort(keys, kind="stable")
+        if np.all(order == np.arange(len(order))):
+            sorted_blob = blob
+        else:
+            # Gather the allele strings into their sorted positions REORDER_BLOCK variants at a time, so the byte
+            # indices of the gather stay the size of one block rather than of the whole blob
+            starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[order]
+            lengths = lengths[order]
+            new_starts = np.concatenate(([0], np.cumsum(lengths)))
+            sorted_blob = np.empty(int(new_starts[-1]), dtype=np.uint8)
+            for block in range(0, len(order), REORDER_BLOCK):
+                end = min(block + REORDER_BLOCK, len(order))
+                byte_start, byte_end = new_starts[block], new_starts[end]
+                shifts = np.repeat(starts[block:end] - new_starts[block:end], lengths[block:end])
+                sorted_blob[byte_start:byte_end] = blob[shifts + np.arange(byte_start, byte_end)]
+        allele_offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+
+        return cls(keys[order], allele_offsets, sorted_blob, chromosomes), order
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "variant_keys.npy"), self.keys)
+        np.save(os.path.join(directory, "variant_allele_offsets.npy"), self.allele_offsets)
+        np.save(os.path.join(directory, "variant_alleles.npy"), self.alleles)
+        with open(os.path.join(directory, "variant_chromosomes.json"), 'w') as file:
+            json.dump(self.chromosomes, file)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, "variant_chromosomes.json"), 'r') as file:
+            chromosomes = json.load(file)
+        return cls(
+            np.load(os.path.join(directory, "variant_keys.npy"), mmap_mode='r'),
+            np.load(os.path.join(directory, "variant_allele_offsets.npy"), mmap_mode='r'),
+            np.load(os.path.join(directory, "variant_alleles.npy"), mmap_mode='r'),
+            chromosomes,
+        )
+
+    def key(self, chrom, pos):
+        code = self.chrom_codes.get(normalise_chrom(chrom))
+        if code is None:
+            return None
+        return np.uint64((code << 32) | pos)
+
+    def find(self, gnomad_id):
+        '''Return the row of a gnomad_id in O(log n), or -1 if it is not in the index.'''
+        variant = split_gnomad_id(gnomad_id)
+        if variant is None:
+            return -1
+        chrom, pos, ref, alt = variant
+        key = self.key(chrom, pos)
+        if key is None:
+            return -1
+        allele = f"{ref}-{alt}".encode()
+        row = int(np.searchsorted(self.keys, key, side='left'))
+        # Only the few records at the same position need their alleles compared
+        while row < len(self.keys) and self.keys[row] == key:
+            if self.alleles[self.allele_offsets[row]:self.allele_offsets[row + 1]].tobytes() == allele:
+                return row
+            row += 1
+        return -1
+
+    def find_many(self, gnomad_ids):
+        '''Return an array with the row of each gnomad_id, -1 where it is not in the index.'''
+        return np.fromiter((self.find(gnomad_id) for gnomad_id in gnomad_ids), dtype=np.int64, count=len(gnomad_ids))
+
+    def gnomad_id(self, row):
+        '''Rebuild the gnomad_id of a row.'''
+        key = int(self.keys[row])
+        alleles = self.alleles[self.allele_offsets[row]:self.allele_offsets[row + 1]].tobytes().decode()
+        return f"{self.chromosomes[key >> 32]}-{key & 0xFFFFFFFF}-{alleles}"
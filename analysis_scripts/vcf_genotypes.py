@@ -0,0 +1,128 @@
+import numpy as np
+
+'''
+Vectorized decoding of the per-sample GT and DP fields of multi-sample VCF records.
+
+A block of record lines is decoded as one byte array: the tab, colon and newline offsets locate every sample's
+GT and DP field, and the alleles and depths of all samples are read with array operations instead of splitting
+every sample column in Python. GT strings that are not a single-digit diploid or haploid call (e.g. allele
+numbers >= 10) fall back to Python parsing, which is rare.
+
+Allele codes: the allele number, MISSING_ALLELE for '.', NO_ALLELE for the absent second allele of haploid calls.
+'''
+
+MISSING_ALLELE = -1
+NO_ALLELE = -2
+MISSING_DEPTH = -1
+
+TAB, NEWLINE, COLON, SLASH, PIPE, DOT, ZERO, NINE = (ord(char) for char in "\t\n:/|.09")
+
+
+def parse_gt_string(gt):
+    '''Python fallback: return (allele1, allele2, phased) for any GT string.'''
+    phased = "|" in gt
+    alleles = [MISSING_ALLELE if allele in (".", "") else int(allele) for allele in gt.replace("|", "/").split("/")]
+    return alleles[0], alleles[1] if len(alleles) > 1 else NO_ALLELE, phased
+
+
+class GenotypeBlock:
+    '''
+    GT and DP of every sample of a block of records, decoded from the record lines.
+
+    allele1, allele2, phased and depth are arrays of shape records x samples. gt_string(record, sample)
+    returns the original GT text of one sample, for the few samples whose exact strings are needed.
+    '''
+
+    def __init__(self, record_lines, gt_indices, dp_indices):
+        # A few bytes of padding so reading just past the last field never runs off the array
+        self.blob = np.frombuffer(("\n".join(record_lines) + "\n\0\0\0\0").encode(), dtype=np.uint8)
+        n_records = len(record_lines)
+        tabs = np.flatnonzero(self.blob == TAB)
+        newlines = np.flatnonzero(self.blob == NEWLINE)
+        if n_records == 0 or len(tabs) % n_records:
+            raise ValueError("Records in a genotype block must all have the same number of columns.")
+        tabs = tabs.reshape(n_records, -1)
+        # Samples start after the 9th tab and end at the next tab, or at the newline for the last sample
+        self.starts = tabs[:, 8:] + 1
+        self.ends = np.concatenate((tabs[:, 9:], newlines[:, None]), axis=1)
+        self._first_colon = None
+
+        gt_indices = np.asarray(gt_indices, dtype=np.int64)
+        if np.all(gt_indices == 0):
+            # GT is almost always the first field, then it starts at the sample column and no colon search is needed
+            self.gt_start, self.gt_end = self.starts, None
+        else:
+            self.gt_start, self.gt_end = self.field_bounds(gt_indices)
+        self.allele1, self.allele2, self.phased = self.decode_gt()
+        self.depth = self.decode_integer(*self.field_bounds(np.asarray(dp_indices, dtype=np.int64)))
+
+    def field_bounds(self, field_indices):
+        '''Return the (start, end) byte offsets of FORMAT field field_indices[record] of every sample, empty if absent.'''
+        if self._first_colon is None:
+            self.colons = np.append(np.flatnonzero(self.blob == COLON), len(self.blob))
+            # Index of the first colon at or after the start of each sample column
+            self._first_colon = np.searchsorted(self.colons, self.starts)
+        field_indices = field_indices[:, None]
+        last_colon = len(self.colons) - 1
+        start_colon = self.colons[np.clip(self._first_colon + field_indices - 1, 0, last_colon)]
+        end_colon = self.colons[np.clip(self._first_colon + field_indices, 0, last_colon)]
+        start = np.where(field_indices == 0, self.starts, start_colon + 1)
+        end = np.minimum(end_colon, self.ends)
+        # Fields past the last colon of a sample, and a field index of -1, are empty
+        absent = (field_indices < 0) | (start > self.ends)
+        return np.where(absent, self.ends, start), np.where(absent, self.ends, end)
+
+    def decode_gt(self):
+        start = self.gt_start
+        c0, c1, c2, c3 = (self.blob[start + offset] for offset in range(4))
+        is_allele = lambda c: ((c >= ZERO) & (c <= NINE)) | (c == DOT)
+        allele_value = lambda c: np.where(c == DOT, MISSING_ALLELE, c.astype(np.int16) - ZERO)
+        if self.gt_end is None:
+            # The GT field ends at the first ':' or the end of the sample column
+            is_end = lambda c: (c == COLON) | (c == TAB) | (c == NEWLINE)
+            diploid = is_allele(c0) & ((c1 == SLASH) | (c1 == PIPE)) & is_allele(c2) & is_end(c3)
+            haploid = is_allele(c0) & is_end(c1)
+        else:
+            length = self.gt_end - start
+            diploid = (length == 3) & is_allele(c0) & ((c1 == SLASH) | (c1 == PIPE)) & is_allele(c2)
+            haploid = (length == 1) & is_allele(c0)
+
+        allele1 = np.where(diploid | haploid, allele_value(c0), MISSING_ALLELE).astype(np.int16)
+        allele2 = np.where(diploid, allele_value(c2), np.where(haploid, NO_ALLELE, MISSING_ALLELE)).astype(np.int16)
+        phased = diploid & (c1 == PIPE)
+        for record, sample in zip(*np.nonzero(~(diploid | haploid))):
+            allele1[record, sample], allele2[record, sample], phased[record, sample] = parse_gt_string(self.gt_string(record, sample) or ".")
+        return allele1, allele2, phased
+
+    def decode_integer(self, start, end):
+        '''Decode a non-negative integer field of every sample, MISSING_DEPTH where it is absent or not a number.'''
+        length = end - start
+        value = np.zeros(start.shape, dtype=np.int64)
+        valid = length > 0
+        # Fields are a few digits long, so loop over digit positions rather than samples
+        for offset in range(min(int(length.max()), 18) if length.size else 0):
+            inside = offset < length
+            c = np.where(inside, self.blob[np.minimum(start + offset, len(self.blob) - 1)], 0)
+            is_digit = (c >= ZERO) & (c <= NINE)
+            valid &= ~inside | is_digit
+            value = np.where(inside & is_digit, value * 10 + (c.astype(np.int64) - ZERO), value)
+        valid &= length <= 18
+        return np.where(valid, value, MISSING_DEPTH).astype(np.int32)
+
+    def gt_string(self, record, sample):
+        '''Return the original GT text of one sample, e.g. "0|1".'''
+        start = self.gt_start[record, sample]
+        end = self.ends[record, sample] if self.gt_end is None else self.gt_end[record, sample]
+        return self.blob[start:end].tobytes().decode().split(":", 1)[0]
+
+
+def decode_genotypes(record_lines, gt_indices, dp_indices):
+    '''
+    Decode GT and DP for every sample of a block of records.
+
+    :param record_lines: VCF record lines without their trailing newline, all with the same samples
+    :param gt_indices: position of GT in each record's FORMAT field
+    :param dp_indices: position of DP in each record's FORMAT field, -1 if the record has no DP
+    :return: a GenotypeBlock with allele1, allele2, phased and depth arrays of shape records x samples
+    '''
+    return GenotypeBlock(record_lines, gt_indices, dp_indices)
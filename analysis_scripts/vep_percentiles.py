@@ -0,0 +1,171 @@
+import argparse
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from vep_store import VEP_COLUMNS, VepStore, is_vep_store
+
+'''
+Proteome-wide percentiles of the VEP scores, so that "top 5%" means the same thing in every cohort and batch.
+
+The build step scans every score of each predictor once, from the VEP directory or a vep_store.py store, and
+counts the scores per float16 value (65,536 bins, about 3 significant digits). The counts are turned into a
+table of the percentile of every float16 value, oriented so that 100 is the most pathogenic end of the predictor:
+    ESM-1v, GEMME, popEVE    lower scores are more pathogenic
+    AlphaMissense, CPT       higher scores are more pathogenic
+A variant's percentile is then one table lookup, its score rounded to float16 is the index. Ties within a bin get
+the mid-rank. The counts are kept in the table file as well, so tables can be inspected or merged.
+
+Usage:
+    python vep_percentiles.py build --vep_dir vep_store/ --output vep_percentiles.npz [--orientation CPT=higher]
+    python vep_percentiles.py annotate --table vep_percentiles.npz --input annotated.tsv --output annotated_percentiles.tsv
+'''
+
+ORIENTATIONS = {'ESM-1v': 'lower', 'AlphaMissense': 'higher', 'CPT': 'higher', 'GEMME': 'lower', 'popEVE': 'lower'}
+N_BINS = 1 << 16
+# Scores of a store are read in blocks of this many slots
+BLOCK_SIZE = 1 << 24
+
+
+def count_scores(values):
+    '''Count finite scores per float16 bin, indexed by the float16 bit pattern.'''
+    values = np.asarray(values, dtype=np.float32)
+    values = np.clip(values[np.isfinite(values)], -65504, 65504)
+    return np.bincount(values.astype(np.float16).view(np.uint16), minlength=N_BINS).astype(np.int64)
+
+
+def count_csv(csv_filepath):
+    '''Return the score counts of every predictor of one VEP CSV, None for unreadable CSVs.'''
+    try:
+        vep_scores = pd.read_csv(csv_filepath)
+    except Exception:
+        return None
+    counts = np.zeros((len(VEP_COLUMNS), N_BINS), dtype=np.int64)
+    if 'variant' in vep_scores.columns:
+        # Duplicated substitutions count once, like in the annotation
+        vep_scores = vep_scores.drop_duplicates(subset='variant', keep='first')
+    for column_index, column in enumerate(VEP_COLUMNS):
+        if column in vep_scores.columns:
+            counts[column_index] = count_scores(pd.to_numeric(vep_scores[column], errors='coerce').values)
+    return counts
+
+
+def count_proteome(vep_dir, workers=None):
+    '''Return the (predictors x N_BINS) score counts of a VEP directory of CSVs or of a vep_store.py store.'''
+    counts = np.zeros((len(VEP_COLUMNS), N_BINS), dtype=np.int64)
+    if is_vep_store(vep_dir):
+        store = VepStore(vep_dir)
+        # Each predictor is one contiguous column, slots without a score are NaN
+        for column_index, column in enumerate(store.scores):
+            for start in range(0, len(column), BLOCK_SIZE):
+                counts[column_index] += count_scores(column[start:start + BLOCK_SIZE])
+        return counts
+
+    csv_files = sorted(os.path.join(vep_dir, name) for name in os.listdir(vep_dir) if name.endswith(".csv"))
+    n_failed = 0
+    with Pool(workers) as pool:
+        for csv_counts in pool.imap_unordered(count_csv, csv_files, chunksize=16):
+            if csv_counts is None:
+                n_failed += 1
+            else:
+                counts += csv_counts
+    if n_failed:
+        print(f"{n_failed} of {len(csv_files)} CSVs could not be read (vep_store.py build lists them)", file=sys.stderr)
+    return counts
+
+
+def percentile_table(counts, orientation):
+    '''Turn the counts of one predictor into the oriented percentile (0-100) of every float16 bit pattern.'''
+    values = np.arange(N_BINS, dtype=np.uint16).view(np.float16).astype(np.float64)
+    table = np.full(N_BINS, np.nan, dtype=np.float32)
+    total = counts.sum()
+    finite = np.flatnonzero(np.isfinite(values))
+    if total == 0:
+        return table
+    # Bit patterns in score order, -0.0 and 0.0 share the same position
+    order = finite[np.argsort(values[finite], kind="stable")]
+    sorted_counts = counts[order]
+    below = np.cumsum(sorted_counts) - sorted_counts
+    _, first, inverse = np.unique(values[order], return_index=True, return_inverse=True)
+    value_counts = np.add.reduceat(sorted_counts, first)
+    # Mid-rank: every score below the bin, plus half of the scores in it
+    fraction = (below[first][inverse] + 0.5 * value_counts[inverse]) / total
+    if orientation == 'lower':
+        fraction = 1 - fraction
+    table[order] = 100 * fraction
+    return table
+
+
+class PercentileTable:
+    '''Percentile lookup tables written by build_table.'''
+
+    def __init__(self, table_filepath):
+        with np.load(table_filepath) as data:
+            self.predictors = data['predictors'].tolist()
+            self.orientations = dict(zip(self.predictors, data['orientations'].tolist()))
+            self.totals = dict(zip(self.predictors, data['counts'].sum(axis=1).tolist()))
+            self.tables = dict(zip(self.predictors, data['percentiles']))
+
+    def percentiles(self, predictor, scores):
+        '''Return the proteome-wide percentile of each score (100 = most pathogenic), NaN for missing scores.'''
+        scores = pd.to_numeric(pd.Series(scores), errors='coerce').values.astype(np.float32)
+        # Scores beyond the float16 range fall in its largest finite bins
+        bins = np.clip(scores, -65504, 65504).astype(np.float16).view(np.uint16)
+        result = self.tables[predictor][bins]
+        return np.where(np.isfinite(scores), result, np.nan)
+
+
+def add_percentile_columns(df, table):
+    '''Add a {predictor}_percentile column for every predictor column of df, "." where the score is missing.'''
+    for predictor in table.predictors:
+        if predictor not in df.columns:
+            continue
+        percentiles = table.percentiles(predictor, df[predictor].values)
+        column = np.where(np.isnan(percentiles), ".", np.round(percentiles, 2).astype(str))
+        df[f"{predictor}_percentile"] = column
+    return df
+
+
+def build_table(vep_dir, output, orientations=None, workers=None):
+    orientations = {**ORIENTATIONS, **(orientations or {})}
+    counts = count_proteome(vep_dir, workers)
+    percentiles = np.vstack([percentile_table(counts[column_index], orientations[column]) for column_index, column in enumerate(VEP_COLUMNS)])
+    np.savez(output, predictors=np.array(VEP_COLUMNS), orientations=np.array([orientations[column] for column in VEP_COLUMNS]),
+             counts=counts, percentiles=percentiles)
+    for column_index, column in enumerate(VEP_COLUMNS):
+        print(f"{column}: {counts[column_index].sum()} scores, {orientations[column]} is more pathogenic", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and apply proteome-wide percentile tables of the VEP scores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Count every score of each predictor once and write the percentile table.")
+    build_parser.add_argument("--vep_dir", type=str, required=True, help="Directory of VEP CSVs, or a store built with vep_store.py.")
+    build_parser.add_argument("--output", type=str, required=True, help="Output .npz table.")
+    build_parser.add_argument("--orientation", type=str, action="append", default=[], help="Override a predictor's orientation, e.g. CPT=higher or popEVE=lower.")
+    build_parser.add_argument("--workers", type=int, default=None, help="Worker processes for a directory of CSVs (default: number of CPUs).")
+
+    annotate_parser = subparsers.add_parser("annotate", help="Add {predictor}_percentile columns to an annotated TSV.")
+    annotate_parser.add_argument("--table", type=str, required=True, help="Table from the build command.")
+    annotate_parser.add_argument("--input", type=str, required=True, help="TSV with VEP score columns (add_inheritance_and_vep_scores.py output).")
+    annotate_parser.add_argument("--output", type=str, required=True, help="Output TSV file path.")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        orientations = {}
+        for override in args.orientation:
+            predictor, _, orientation = override.partition("=")
+            if predictor not in ORIENTATIONS or orientation not in ("higher", "lower"):
+                parser.error(f"--orientation must be <predictor>=higher|lower with a predictor of {', '.join(VEP_COLUMNS)}")
+            orientations[predictor] = orientation
+        build_table(args.vep_dir, args.output, orientations, args.workers)
+    elif args.command == "annotate":
+        df = pd.read_csv(args.input, sep='\t', dtype=str, keep_default_na=False)
+        add_percentile_columns(df, PercentileTable(args.table)).to_csv(args.output, sep='\t', index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+
+'''
+This script packs the VEP directory (one CSV of ESM-1v, AlphaMissense, CPT, GEMME and popEVE scores per UniProt ID)
+into a single memory-mapped store, so that a run no longer opens thousands of small files.
+
+Every protein gets a range of positions, and every (position, mutant amino acid) a fixed slot
+(position - 1) * 20 + amino acid index. Each predictor is one float32 column over all slots, with NaN where the CSV
+has no score. Alongside are the wild-type residue of every position, a flag per slot saying whether the substitution
+is in the CSV at all, and per protein which predictor columns its CSV has, so lookups return the same None / NaN
+values as reading the CSV (add_inheritance_and_vep_scores.load_vep_frame).
+
+Usage:
+    python vep_store.py build --vep_dir vep_scores/ --output vep_store/ [--workers 8]
+    python vep_store.py query vep_store/ P12345 A123T
+
+Empty, unreadable or malformed CSVs are listed in failed_csvs.tsv in the store and summarised when building.
+'''
+
+VEP_COLUMNS = ['ESM-1v', 'AlphaMissense', 'CPT', 'GEMME', 'popEVE']
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+AMINO_ACID_INDEX = {amino_acid: index for index, amino_acid in enumerate(AMINO_ACIDS)}
+SLOTS_PER_POSITION = len(AMINO_ACIDS)
+
+
+def column_filename(predictor):
+    return f"scores_{predictor}.f32"
+
+
+def parse_vep_csv(csv_filepath):
+    '''
+    Read one protein's VEP CSV into fixed-slot arrays.
+
+    :return: (uniprot_id, result, error) where result is (wild_type, present, scores, column_mask, n_skipped)
+             and error is a message if the CSV could not be used
+    '''
+    uniprot_id = os.path.basename(csv_filepath)[:-len(".csv")]
+    try:
+        vep_scores = pd.read_csv(csv_filepath)
+    except pd.errors.EmptyDataError:
+        return uniprot_id, None, "empty file"
+    except Exception as e:
+        return uniprot_id, None, f"{type(e).__name__}: {e}"
+    if 'variant' not in vep_scores.columns:
+        return uniprot_id, None, "no variant column"
+    if len(vep_scores) == 0:
+        return uniprot_id, None, "no rows"
+
+    # Keep the first row of duplicated substitutions, as the CSV lookup does
+    vep_scores = vep_scores.drop_duplicates(subset='variant', keep='first')
+    parts = vep_scores['variant'].astype(str).str.extract(r'^([A-Z])([1-9]\d*)([A-Z])$')
+    mutant_index = parts[2].map(AMINO_ACID_INDEX)
+    usable = parts[1].notna() & mutant_index.notna()
+    if not usable.any():
+        return uniprot_id, None, "no substitutions in <wild type><position><mutant> format"
+    positions = parts[1][usable].astype(np.int64).values
+    wild_types = parts[0][usable].map(ord).values.astype(np.uint8)
+    mutant_index = mutant_index[usable].astype(np.int64).values
+
+    length = int(positions.max())
+    wild_type = np.zeros(length, dtype=np.uint8)
+    # The first wild-type residue listed for a position wins, rows that disagree with it cannot be looked up
+    first_at_position = np.unique(positions, return_index=True)[1]
+    wild_type[positions[first_at_position] - 1] = wild_types[first_at_position]
+    consistent = wild_type[positions - 1] == wild_types
+    slots = (positions - 1) * SLOTS_PER_POSITION + mutant_index
+
+    present = np.zeros(length * SLOTS_PER_POSITION, dtype=np.uint8)
+    present[slots[consistent]] = 1
+    scores = np.full((len(VEP_COLUMNS), length * SLOTS_PER_POSITION), np.nan, dtype=np.float32)
+    column_mask = 0
+    for column_index, column in enumerate(VEP_COLUMNS):
+        if column in vep_scores.columns:
+            column_mask |= 1 << column_index
+            values = pd.to_numeric(vep_scores[column][usable], errors='coerce').values.astype(np.float32)
+            scores[column_index, slots[consistent]] = values[consistent]
+    n_skipped = len(vep_scores) - int(consistent.sum())
+    return uniprot_id, (wild_type, present, scores, column_mask, n_skipped), None
+
+
+def build_store(vep_dir, output_dir, workers=None):
+    '''Parse every CSV of vep_dir with a worker pool and append the proteins to the store in sorted order.'''
+    csv_files = sorted(name for name in os.listdir(vep_dir) if name.endswith(".csv"))
+    os.makedirs(output_dir, exist_ok=True)
+    proteins, offsets, column_masks, failed = [], [0], [], []
+    n_skipped = 0
+
+    column_files = [open(os.path.join(output_dir, column_filename(column)), 'wb') for column in VEP_COLUMNS]
+    try:
+        with open(os.path.join(output_dir, "wild_type.u8"), 'wb') as wild_type_file, \
+                open(os.path.join(output_dir, "present.u8"), 'wb') as present_file, \
+                Pool(workers) as pool:
+            # imap keeps the sorted file order, so the store is the same for any number of workers
+            for uniprot_id, result, error in pool.imap(parse_vep_csv, [os.path.join(vep_dir, name) for name in csv_files], chunksize=16):
+                if error is not None:
+                    failed.append((uniprot_id, error))
+                    continue
+                wild_type, present, scores, column_mask, skipped = result
+                wild_type_file.write(wild_type.tobytes())
+                present_file.write(present.tobytes())
+                for column_file, column_scores in zip(column_files, scores):
+                    column_file.write(column_scores.tobytes())
+                proteins.append(uniprot_id)
+                offsets.append(offsets[-1] + len(wild_type))
+                column_masks.append(column_mask)
+                n_skipped += skipped
+    finally:
+        for column_file in column_files:
+            column_file.close()
+
+    np.save(os.path.join(output_dir, "protein_offsets.npy"), np.array(offsets, dtype=np.int64))
+    np.save(os.path.join(output_dir, "column_masks.npy"), np.array(column_masks, dtype=np.uint8))
+    with open(os.path.join(output_dir, "proteins.txt"), 'w') as file:
+        file.write("\n".join(proteins) + "\n")
+    with open(os.path.join(output_dir, "vep_store.json"), 'w') as file:
+        json.dump({"predictors": VEP_COLUMNS, "amino_acids": AMINO_ACIDS, "positions": offsets[-1]}, file)
+    with open(os.path.join(output_dir, "failed_csvs.tsv"), 'w') as file:
+        file.write("uniprot_id\terror\n")
+        file.writelines(f"{uniprot_id}\t{error}\n" for uniprot_id, error in failed)
+
+    print(f"Stored {len(proteins)} proteins ({offsets[-1]} positions) from {len(csv_files)} CSVs in {output_dir}", file=sys.stderr)
+    if n_skipped:
+        print(f"Skipped {n_skipped} rows that are not <wild type><position><mutant> substitutions of the 20 amino acids or disagree with the wild type", file=sys.stderr)
+    if failed:
+        print(f"{len(failed)} CSVs could not be used, see {os.path.join(output_dir, 'failed_csvs.tsv')}:", file=sys.stderr)
+        for uniprot_id, error in failed[:10]:
+            print(f"    {uniprot_id}: {error}", file=sys.stderr)
+
+
+def is_vep_store(directory):
+    return os.path.isfile(os.path.join(directory, "vep_store.json"))
+
+
+def open_memmap_column(filepath, dtype, length):
+    # np.memmap cannot map an empty file
+    return np.memmap(filepath, dtype=dtype, mode='r', shape=(length,)) if length else np.empty(0, dtype=dtype)
+
+
+class ProteinVepScores:
+    '''The VEP scores of one protein in a VepStore, looked up like a {substitution: scores} dictionary.'''
+
+    def __init__(self, store, protein_row):
+        self.store = store
+        self.start = int(store.protein_offsets[protein_row])
+        self.length = int(store.protein_offsets[protein_row + 1]) - self.start
+        self.column_mask = int(store.column_masks[protein_row])
+
+    def get(self, substitution, default=None):
+        '''Return the (ESM-1v, AlphaMissense, CPT, GEMME, popEVE) scores of a substitution such as "A123T", or default.'''
+        try:
+            position = int(substitution[1:-1])
+        except ValueError:
+            return default
+        mutant_index = AMINO_ACID_INDEX.get(substitution[-1:])
+        if mutant_index is None or not 1 <= position <= self.length:
+            return default
+        if self.store.wild_type[self.start + position - 1] != ord(substitution[0]):
+            return default
+        slot = (self.start + position - 1) * SLOTS_PER_POSITION + mutant_index
+        if not self.store.present[slot]:
+            return default
+        # float32 scalars print with their shortest representation, like the CSV values
+        return tuple(column[slot] if self.column_mask >> column_index & 1 else None
+                     for column_index, column in enumerate(self.store.scores))
+
+
+class VepStore:
+    '''Memory-mapped VEP score store built by build_store.'''
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, "vep_store.json"), 'r') as file:
+            metadata = json.load(file)
+        if metadata["predictors"] != VEP_COLUMNS or metadata["amino_acids"] != AMINO_ACIDS:
+            raise ValueError(f"{store_dir} was built with different predictors or amino acid order")
+        with open(os.path.join(store_dir, "proteins.txt"), 'r') as file:
+            self.proteins = [line.rstrip("\n") for line in file if line.rstrip("\n")]
+        self.protein_index = {uniprot_id: row for row, uniprot_id in enumerate(self.proteins)}
+        self.protein_offsets = np.load(os.path.join(store_dir, "protein_offsets.npy"))
+        self.column_masks = np.load(os.path.join(store_dir, "column_masks.npy"))
+        positions = metadata["positions"]
+        self.wild_type = open_memmap_column(os.path.join(store_dir, "wild_type.u8"), np.uint8, positions)
+        self.present = open_memmap_column(os.path.join(store_dir, "present.u8"), np.uint8, positions * SLOTS_PER_POSITION)
+        self.scores = [open_memmap_column(os.path.join(store_dir, column_filename(column)), np.float32, positions * SLOTS_PER_POSITION)
+                       for column in VEP_COLUMNS]
+
+    def table(self, uniprot_id):
+        '''Return the scores of one protein, or None if its CSV was missing or unusable when the store was built.'''
+        row = self.protein_index.get(uniprot_id)
+        return ProteinVepScores(self, row) if row is not None else None
+
+    def vep_score_matrix(self, uniprot_ids, substitutions):
+        '''
+        Look up many (uniprot_id, substitution) pairs at once.
+
+        :return: object array of len(substitutions) x 5 scores, "." where the protein, substitution or predictor
+                 is missing and NaN where the CSV has an empty score
+        '''
+        values = np.full((len(substitutions), len(VEP_COLUMNS)), ".", dtype=object)
+        protein_rows = pd.Series(uniprot_ids, dtype=object).map(self.protein_index)
+        parts = pd.Series(substitutions, dtype=object).astype(str).str.extract(r'^([A-Z])([1-9]\d*)([A-Z])$')
+        mutant_index = parts[2].map(AMINO_ACID_INDEX)
+        candidates = np.flatnonzero((protein_rows.notna() & parts[1].notna() & mutant_index.notna()).values)
+
+        rows = protein_rows.values[candidates].astype(np.int64)
+        positions = parts[1].values[candidates].astype(np.int64)
+        start, end = self.protein_offsets[rows], self.protein_offsets[rows + 1]
+        in_range = positions <= end - start
+        position_index = start + np.where(in_range, positions, 1) - 1
+        slots = position_index * SLOTS_PER_POSITION + mutant_index.values[candidates].astype(np.int64)
+        wild_types = np.array([ord(wild_type) for wild_type in parts[0].values[candidates]], dtype=np.uint8)
+        found = in_range & (self.wild_type[position_index] == wild_types) & (self.present[slots] == 1)
+
+        column_masks = self.column_masks[rows[found]]
+        for column_index, column in enumerate(self.scores):
+            has_column = (column_masks >> column_index & 1).astype(bool)
+            # Round trip through the shortest float32 text so values print like the CSV
+            scores = column[slots[found][has_column]].astype(str).astype(np.float64)
+            values[candidates[found][has_column], column_index] = scores
+        return values
+
+    def get_vep_scores(self, uniprot_id, substitution):
+        '''Return the five scores of a substitution, None for each if the protein or substitution is not in the store.'''
+        table = self.table(uniprot_id)
+        scores = table.get(substitution) if table is not None else None
+        return scores if scores is not None else (None,) * len(VEP_COLUMNS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and query a memory-mapped store of the per-protein VEP score CSVs.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the store from a directory of <uniprot_id>.csv files.")
+    build_parser.add_argument("--vep_dir", type=str, required=True, help="Directory of VEP score CSVs.")
+    build_parser.add_argument("--output", type=str, required=True, help="Directory to write the store to.")
+    build_parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: number of CPUs).")
+
+    query_parser = subparsers.add_parser("query", help="Print the scores of one substitution.")
+    query_parser.add_argument("store", type=str, help="Directory of the store.")
+    query_parser.add_argument("uniprot_id", type=str, help="UniProt ID.")
+    query_parser.add_argument("substitution", type=str, help="Substitution such as A123T.")
+
+    args = parser.parse_args()
+
+    if args.command == "build":
+        build_store(args.vep_dir, args.output, args.workers)
+    elif args.command == "query":
+        scores = VepStore(args.store).get_vep_scores(args.uniprot_id, args.substitution)
+        for column, score in zip(VEP_COLUMNS, scores):
+            print(f"{column}\t{'.' if score is None else str(score)}")
+
+
+if __name__ == "__main__":
+    main()
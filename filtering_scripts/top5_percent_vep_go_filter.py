@@ -2,6 +2,12 @@ import argparse
 import pandas as pd
 import ast
 
+# Rows read at a time when filtering on the proteome-wide percentile
+CHUNK_SIZE = 100_000
+VEP = "CPT"
+# Whether higher or lower scores are more pathogenic, keep in sync with ORIENTATIONS in analysis_scripts/vep_percentiles.py
+PREDICTOR_ORIENTATIONS = {'ESM-1v': 'lower', 'AlphaMissense': 'higher', 'CPT': 'higher', 'GEMME': 'lower', 'popEVE': 'lower'}
+
 def filter_condition(row):
     #This function just filters all monoallelic records if they are not in X-linked genes
     inheritance_list = ast.literal_eval(row['inheritance'])
@@ -15,15 +21,13 @@ def filter_condition(row):
         return False  # If the condition is not met, return False
 
 # Function to filter the DataFrame based on given conditions
-def filter_dataframe(df):
+def filter_dataframe(df, min_percentile=None):
     # Convert columns to integers, replace errors with NaN, then drop rows where any of these columns are NaN
     for col in ['MQ', 'QD', 'FS', 'phylop']:
         df[col] = pd.to_numeric(df[col], errors='coerce')  # Convert to numeric, coercing invalid values to NaN
     
     # Drop rows where any of the columns 'MQ', 'QD', or 'FS' contain NaN
     df.dropna(subset=['MQ', 'QD', 'FS', 'phylop'], inplace=True)
-    
-    VEP = "CPT"
 
     # Apply the filtering conditions
     filtered_df = df[(df[VEP] != ".")]
@@ -32,9 +36,15 @@ def filter_dataframe(df):
     for col in [VEP, 'F_enrichment', 'C_enrichment', 'P_enrichment']:
         filtered_df[col] = pd.to_numeric(filtered_df[col], errors='coerce')
 
-    top_5_percent_threshold = filtered_df[VEP].quantile(0.95)  ## Swap this depending on VEP more positive or more negative predictions correspond to pathogenic
+    if min_percentile is not None:
+        # Proteome-wide {VEP}_percentile column from vep_percentiles.py, the cutoff does not depend on this frame.
+        # Percentiles are oriented so that higher is more pathogenic for every predictor
+        passes_vep = pd.to_numeric(filtered_df[f"{VEP}_percentile"], errors='coerce') >= min_percentile
+    else:
+        top_5_percent_threshold = filtered_df[VEP].quantile(0.95)  ## Swap this depending on VEP more positive or more negative predictions correspond to pathogenic
+        passes_vep = filtered_df[VEP] > top_5_percent_threshold
 
-    filtered_df = filtered_df[(filtered_df[VEP] > top_5_percent_threshold) & (filtered_df['F_enrichment'] > 0.75) & (filtered_df['C_enrichment'] > 0.75) & (filtered_df['P_enrichment'] > 0.75)]
+    filtered_df = filtered_df[passes_vep & (filtered_df['F_enrichment'] > 0.75) & (filtered_df['C_enrichment'] > 0.75) & (filtered_df['P_enrichment'] > 0.75)]
     filtered_df = filtered_df.loc[filtered_df.apply(filter_condition, axis=1)]
 
     # Sort by VEP in descending order
@@ -42,23 +52,85 @@ def filter_dataframe(df):
 
     return filtered_df
 
+def passes_inheritance(df):
+    # Vectorized filter_condition, each distinct inheritance list is parsed once
+    inheritance_lists = {value: ast.literal_eval(value) for value in df['inheritance'].unique()}
+    x_linked = df['inheritance'].map(lambda value: 'X-linked' in inheritance_lists[value] or 'X-linked recessive' in inheritance_lists[value])
+    return x_linked.astype(bool) | (df['n_monoallelic'] < 1)
+
+# Rank every variant by all predictors at once instead of rerunning the filter per predictor
+def rank_all_predictors(df, min_percentile=95.0, min_passing=1):
+    for col in ['MQ', 'QD', 'FS', 'phylop', 'F_enrichment', 'C_enrichment', 'P_enrichment']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.dropna(subset=['MQ', 'QD', 'FS', 'phylop']).copy()
+
+    predictors = [predictor for predictor in PREDICTOR_ORIENTATIONS if predictor in df.columns]
+    proteome_wide = [predictor for predictor in predictors if f"{predictor}_percentile" in df.columns]
+    if proteome_wide and len(proteome_wide) < len(predictors):
+        # The consensus score and pass count would mix proteome-wide percentiles with ranks within the cohort
+        missing = [predictor for predictor in predictors if predictor not in proteome_wide]
+        raise ValueError(f"proteome-wide percentile columns for {', '.join(proteome_wide)} but not for {', '.join(missing)}, "
+                         "add them for every predictor with vep_percentiles.py annotate or drop them all")
+
+    percentile_columns, pass_columns = [], []
+    for predictor in predictors:
+        if proteome_wide:
+            # Proteome-wide percentile from vep_percentiles.py
+            percentile = pd.to_numeric(df[f"{predictor}_percentile"], errors='coerce')
+        else:
+            # Percentile within this cohort, missing scores ("." or empty) stay NaN
+            scores = pd.to_numeric(df[predictor], errors='coerce')
+            percentile = (scores if PREDICTOR_ORIENTATIONS[predictor] == 'higher' else -scores).rank(pct=True) * 100
+        # Percentiles are oriented so that 100 is the most pathogenic end of every predictor
+        df[f"{predictor}_percentile"] = percentile
+        df[f"{predictor}_pass"] = percentile >= min_percentile
+        percentile_columns.append(f"{predictor}_percentile")
+        pass_columns.append(f"{predictor}_pass")
+
+    df['n_predictors_pass'] = df[pass_columns].sum(axis=1)
+    # Rank aggregation: mean oriented percentile over the predictors that scored the variant
+    df['consensus_score'] = df[percentile_columns].mean(axis=1)
+
+    keep = (df['F_enrichment'] > 0.75) & (df['C_enrichment'] > 0.75) & (df['P_enrichment'] > 0.75) & (df['n_predictors_pass'] >= min_passing)
+    filtered_df = df[keep]
+    filtered_df = filtered_df[passes_inheritance(filtered_df)]
+    return filtered_df.sort_values(by='consensus_score', ascending=False)
+
 def main():
     # Parse command-line arguments
     parser = argparse.ArgumentParser(description='Filter rows in a TSV based on specific conditions.')
     parser.add_argument('--input', required=True, help='Input TSV file path')
     parser.add_argument('--output', required=True, help='Output TSV file path')
+    parser.add_argument('--min_percentile', type=float, help='Keep variants at or above this proteome-wide VEP percentile (e.g. 95), needs the {VEP}_percentile column from vep_percentiles.py. The input is then filtered in chunks instead of loaded whole')
+    parser.add_argument('--all_predictors', action='store_true', help='Rank by ESM-1v, AlphaMissense, CPT, GEMME and popEVE in one pass: per-predictor percentiles and pass flags plus a consensus score (mean percentile)')
+    parser.add_argument('--min_passing', type=int, default=1, help='With --all_predictors, keep variants passing at least this many predictors (default: 1)')
 
     args = parser.parse_args()
 
     # Load the TSV file into a pandas DataFrame
     try:
-        df = pd.read_csv(args.input, sep='\t')
+        if args.min_percentile is not None and not args.all_predictors:
+            chunks = pd.read_csv(args.input, sep='\t', chunksize=CHUNK_SIZE)
+        else:
+            df = pd.read_csv(args.input, sep='\t')
     except Exception as e:
         print(f"Error loading input file: {e}")
         return
 
     # Filter the DataFrame based on the conditions
-    filtered_df = filter_dataframe(df)
+    if args.all_predictors:
+        min_percentile = args.min_percentile if args.min_percentile is not None else 95.0
+        try:
+            filtered_df = rank_all_predictors(df, min_percentile, args.min_passing)
+        except ValueError as e:
+            print(f"Error ranking predictors: {e}")
+            return
+    elif args.min_percentile is not None:
+        # The threshold does not depend on the other rows, so only the rows that pass are kept in memory
+        filtered_df = pd.concat([filter_dataframe(chunk, args.min_percentile) for chunk in chunks])
+        filtered_df.sort_values(by=VEP, ascending=False, inplace=True)
+    else:
+        filtered_df = filter_dataframe(df)
 
     # Write the filtered DataFrame to the output TSV file
     try:
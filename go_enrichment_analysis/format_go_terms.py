@@ -1,27 +1,23 @@
 import argparse
-import sys
 import pandas as pd
 import numpy as np
-import json
+from gaf import add_filter_arguments, filter_options, read_gaf
+from go_ontology import load_ontology, propagate_go_terms
 
 '''
 This script makes TSVs with the number of times a go term is found in known MPD disease genes 
 scaled by the number of probands where the gene is causative.
 Input for this is genes_found_protein_only.tsv, goa_human.gaf (https://current.geneontology.org/annotations/goa_human.gaf.gz), and go.json (https://purl.obolibrary.org/obo/go.json)
+Unweighted counts (number of known genes per GO term) are written to F/P/C_counts_n_genes.tsv with the same columns.
 '''
 
 
 '''
 These preloading functions speed up the processing ~1000x by preloading data into memory
 '''
-def preload_goa(goa_filepath):
-    with open(goa_filepath, 'r') as file:
-    # Filter out lines starting with '!'
-        filtered_lines = [line for line in file if not line.startswith('!')]
-            # Split filtered lines into columns
-        data = [line.strip().split('\t') for line in filtered_lines]
-        data = pd.DataFrame(data[1:])
-        return (data)
+def preload_goa(goa_filepath, evidence_codes=None, exclude_evidence_codes=None, exclude_not=False):
+    # Streams the GAF (plain or .gz) into integer-coded arrays, see gaf.py
+    return read_gaf(goa_filepath, evidence_codes, exclude_evidence_codes, exclude_not)
     
 
 def preprocess_json(json_file):
@@ -31,115 +27,63 @@ def preprocess_json(json_file):
     :param json_file: Path to the JSON file
     :return: A dictionary {id: lbl}
     """
-    with open(json_file, 'r') as file:
-        data = json.load(file)
-    
-    id_to_lbl = {}
-    for graph in data.get("graphs", []):
-        for node in graph.get("nodes", []):
-            node_id = node.get("id")
-            go_id = node_id.split("/")[-1]
-            go_id = go_id.replace("_", ":")
-            lbl = node.get("lbl")
-            if go_id and lbl:
-                id_to_lbl[go_id] = lbl
-
-    return id_to_lbl
-
-
-def get_go_terms(goa_data, uniprot_id):
-
-    filtered_data = goa_data[goa_data.iloc[:, 1] == uniprot_id]
-
-    go_f = filtered_data[filtered_data.iloc[:, 8] == "F"]
-    go_p = filtered_data[filtered_data.iloc[:, 8] == "P"]
-    go_c = filtered_data[filtered_data.iloc[:, 8] == "C"]
-
-    go_f_id = list(set(go_f[4].tolist()))
-    go_p_id = list(set(go_p[4].tolist()))
-    go_c_id = list(set(go_c[4].tolist()))
-
-    go_dict = {"F": go_f_id, "P": go_p_id, "C": go_c_id}    
-
-    return (go_dict)
-
-
-
-def add_go_to_tsv(goa_filepath, tsv_file, go_json_filepath, output_file):
-    # Iterate over the tsv file and add the GO terms to the last columns
-    goa_data = preload_goa(goa_filepath)
+    # go.json is parsed once into a binary cache next to it (go_ontology.py), alt_ids map to their primary term's label
+    return load_ontology(json_file).id_to_label()
+
+
+def count_go_terms(data, gene_go_dict, go_json_data):
+    '''
+    This function counts the GO terms of the known genes in one vectorized aggregation: the per-gene GO lists are
+    exploded, joined to the rows of the known-gene table, and summed per GO ID with and without the number of probands.
+    Returns {"F": counts_df, "P": counts_df, "C": counts_df} with columns GO_ID, GO_Term, Count (weighted), n_genes.
+    GO IDs are in order of first appearance, as in the per-row loop this replaces.
+    '''
+    gene_terms = pd.DataFrame(
+        [(uniprot_id, go_set, go_dict[go_set]) for uniprot_id, go_dict in gene_go_dict.items() for go_set in ("F", "P", "C")],
+        columns=["uniprot_id", "go_set", "GO_ID"]).explode("GO_ID")
+    rows = pd.DataFrame({"uniprot_id": data.iloc[:, 2], "n_probands": data.iloc[:, 1]})
+    # Genes without annotations in a set have no GO ID there instead of an empty-string term
+    annotations = rows.merge(gene_terms, on="uniprot_id", how="left").dropna(subset=["GO_ID"])
+
+    counts = annotations.groupby(["go_set", "GO_ID"], sort=False).agg(Count=("n_probands", "sum"), n_genes=("n_probands", "size")).reset_index()
+    counts_dfs = {}
+    for go_set in ("F", "P", "C"):
+        counts_df = counts[counts["go_set"] == go_set].drop(columns="go_set").reset_index(drop=True)
+        counts_df.insert(1, 'GO_Term', counts_df["GO_ID"].map(go_json_data))
+        counts_dfs[go_set] = counts_df
+    return counts_dfs
+
+
+def add_go_to_tsv(goa_filepath, tsv_file, go_json_filepath, output_file, gaf_filters=None, propagate=False):
+    # Add the GO terms of each known gene to the tsv file, then count the GO terms over all known genes
+    goa_data = preload_goa(goa_filepath, **(gaf_filters or {}))
     go_json_data = preprocess_json(go_json_filepath)
+    ontology = load_ontology(go_json_filepath) if propagate else None
     data = pd.read_csv(tsv_file, sep='\t')
-    
-    # Iterate through each row in the DataFrame
-    for index, row in data.iterrows():
-        uniprot_id = row[2] 
-
-        # Get the GO terms dictionary for the current uniprot_id
-        goa_dict = get_go_terms(goa_data, uniprot_id)
-        
-        # Translate the GO terms into labels using the provided function
-        translated_go_terms_dict = translate_go_terms(goa_dict, go_json_data)
-        
-        # Extract values for the keys "F", "P", "C", "F_lbl", "P_lbl", "C_lbl"
-        data.at[index, 'F'] = str(translated_go_terms_dict["F"])
-        data.at[index, 'P'] = str(translated_go_terms_dict["P"])
-        data.at[index, 'C'] = str(translated_go_terms_dict["C"])
-        data.at[index, 'F_lbl'] = str(translated_go_terms_dict["F_lbl"])
-        data.at[index, 'P_lbl'] = str(translated_go_terms_dict["P_lbl"])
-        data.at[index, 'C_lbl'] = str(translated_go_terms_dict["C_lbl"])
+    uniprot_ids = data.iloc[:, 2]
+
+    # GO terms of every annotated gene in one pass over the GAF, then looked up for each distinct known gene
+    uniprot_go_dict = goa_data.go_terms_by_gene()
+    gene_go_dict = {uniprot_id: uniprot_go_dict.get(uniprot_id, {"F": [], "P": [], "C": []}) for uniprot_id in uniprot_ids.unique()}
+    if ontology is not None:
+        # Add the is_a/part_of ancestors of each GO term (true-path rule)
+        gene_go_dict = propagate_go_terms(gene_go_dict, ontology)
+    for goa_dict in gene_go_dict.values():
+        translate_go_terms(goa_dict, go_json_data)
+
+    # Columns "F", "P", "C", "F_lbl", "P_lbl", "C_lbl" for the GO terms file
+    for column in ("F", "P", "C", "F_lbl", "P_lbl", "C_lbl"):
+        data[column] = uniprot_ids.map({uniprot_id: str(goa_dict[column]) for uniprot_id, goa_dict in gene_go_dict.items()})
 
     # Save the updated DataFrame to a new file (or overwrite the original file)
     #data.to_csv(output_file, sep='\t', index=False) ## Uncomment this and next to save the GO terms file
     #print("GO terms written to output file.")
 
-    F_counts = {}
-    P_counts = {}
-    C_counts = {}
-    for index, row in data.iterrows():
-        F = row['F']
-        P = row['P']
-        C = row['C']
-        n_probands = row[1]
-        F = F.replace("[", "").replace("]", "").replace("'", "").split(", ")
-        P = P.replace("[", "").replace("]", "").replace("'", "").split(", ")
-        C = C.replace("[", "").replace("]", "").replace("'", "").split(", ")
-        ## This is when its weighted by the number of probands with the variant in that gene, make it +=1 for just per gene
-        for go_id in F:
-            if go_id in F_counts:
-                F_counts[go_id] += n_probands
-            else:
-                F_counts[go_id] = n_probands
-        for go_id in P:
-            if go_id in P_counts:
-                P_counts[go_id] += n_probands
-            else:
-                P_counts[go_id] = n_probands
-        for go_id in C:
-            if go_id in C_counts:
-                C_counts[go_id] += n_probands
-            else:
-                C_counts[go_id] = n_probands
-    
-
-    ## Make the summed counts into a DataFrame
-    F_counts_df = pd.DataFrame(list(F_counts.items()), columns = ['GO_ID', 'Count'])
-    F_new_column_values = F_counts_df.iloc[:, 0].map(go_json_data)
-    F_counts_df.insert(1, 'GO_Term', F_new_column_values)
-    F_counts_df.to_csv("F_counts_weighted_n_probands.tsv", sep='\t', index=False)
-
-    P_counts_df = pd.DataFrame(list(P_counts.items()), columns = ['GO_ID', 'Count'])
-    P_new_column_values = P_counts_df.iloc[:, 0].map(go_json_data)
-    P_counts_df.insert(1, 'GO_Term', P_new_column_values)
-    P_counts_df.to_csv("P_counts_weighted_n_probands.tsv", sep='\t', index=False)
-
-    C_counts_df = pd.DataFrame(list(C_counts.items()), columns = ['GO_ID', 'Count'])
-    C_new_column_values = C_counts_df.iloc[:, 0].map(go_json_data)
-    C_counts_df.insert(1, 'GO_Term', C_new_column_values)
-    C_counts_df.to_csv("C_counts_weighted_n_probands.tsv", sep='\t', index=False)
-
-
-    ## Next step - weight the counts by the number of probands with the variant in that gene
+    ## Counts weighted by the number of probands with the variant in that gene, and per gene (n_genes)
+    counts_dfs = count_go_terms(data, gene_go_dict, go_json_data)
+    for go_set, counts_df in counts_dfs.items():
+        counts_df[['GO_ID', 'GO_Term', 'Count']].to_csv(f"{go_set}_counts_weighted_n_probands.tsv", sep='\t', index=False)
+        counts_df[['GO_ID', 'GO_Term', 'n_genes']].rename(columns={'n_genes': 'Count'}).to_csv(f"{go_set}_counts_n_genes.tsv", sep='\t', index=False)
 
     return (print("Cumulative GO terms written to output files."))
 
@@ -152,15 +96,15 @@ def translate_go_terms(goa_dict, go_dict):
     for key, value in goa_dict.items():
         if key == "F":
             for go_id in value:
-                go_lbl = go_dict[go_id]
+                go_lbl = go_dict.get(go_id, "Unknown")
                 goa_dict["F_lbl"].append(go_lbl)
         elif key == "P":
             for go_id in value:
-                go_lbl = go_dict[go_id]
+                go_lbl = go_dict.get(go_id, "Unknown")
                 goa_dict["P_lbl"].append(go_lbl)
         elif key == "C":
             for go_id in value:
-                go_lbl = go_dict[go_id]
+                go_lbl = go_dict.get(go_id, "Unknown")
                 goa_dict["C_lbl"].append(go_lbl)
     return goa_dict
 
@@ -172,11 +116,12 @@ def main():
     parser.add_argument("--output", type=str, help="Path to output.")
     parser.add_argument("--goa", type=str, help="The path to the GO annotations file.")
     parser.add_argument("--go", type=str, help="Path to the GO terms JSON file.")
-
+    add_filter_arguments(parser)
+    parser.add_argument("--propagate", action="store_true", help="Also count the is_a/part_of ancestors of each annotated GO term (true-path rule).")
     
     # Parse the arguments
     args = parser.parse_args()
-    add_go_to_tsv(args.goa, args.input, args.go, args.output)
+    add_go_to_tsv(args.goa, args.input, args.go, args.output, filter_options(args), args.propagate)
     
 
 if __name__ == "__main__":
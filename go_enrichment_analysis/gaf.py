@@ -0,0 +1,139 @@
+import gzip
+from array import array
+import numpy as np
+
+'''
+Streaming reader for GO annotation files (GAF 2.x, e.g. goa_human.gaf or goa_human.gaf.gz).
+
+Lines are read one at a time and only the DB object ID, qualifier, GO ID, evidence code and aspect are kept.
+UniProt IDs, GO IDs and evidence codes are interned as integer codes, so the annotations are a few NumPy arrays
+instead of a table of strings:
+    uniprot_ids[gene[i]], go_ids[term[i]], ASPECTS[aspect[i]], evidence_codes[evidence[i]], negated[i]
+Annotations can be filtered by evidence code (e.g. drop IEA) and by the NOT qualifier while reading.
+'''
+
+# GAF columns (0-based)
+DB_OBJECT_ID = 1
+QUALIFIER = 3
+GO_ID = 4
+EVIDENCE_CODE = 6
+ASPECT = 8
+
+ASPECTS = ("F", "P", "C")
+ASPECT_CODES = {aspect: code for code, aspect in enumerate(ASPECTS)}
+
+
+def open_gaf(gaf_filepath):
+    '''Open a GAF file as text, gzip compressed or not.'''
+    with open(gaf_filepath, 'rb') as file:
+        magic = file.read(2)
+    if magic == b'\x1f\x8b':
+        return gzip.open(gaf_filepath, 'rt')
+    return open(gaf_filepath, 'r')
+
+
+class GafAnnotations:
+    '''Integer-coded GO annotations, one entry per GAF line kept by read_gaf.'''
+
+    def __init__(self, uniprot_ids, go_ids, evidence_codes, gene, term, aspect, evidence, negated):
+        self.uniprot_ids = uniprot_ids
+        self.go_ids = go_ids
+        self.evidence_codes = evidence_codes
+        self.gene = gene
+        self.term = term
+        self.aspect = aspect
+        self.evidence = evidence
+        self.negated = negated
+
+    def __len__(self):
+        return len(self.gene)
+
+    def go_terms(self, uniprot_id):
+        '''Return {"F": [GO IDs], "P": [GO IDs], "C": [GO IDs]} of one UniProt ID, GO IDs in order of first appearance.'''
+        codes = np.flatnonzero(self.uniprot_ids == uniprot_id)
+        rows = self.gene == codes[0] if len(codes) else np.zeros(len(self), dtype=bool)
+        go_dict = {}
+        for code, go_set in enumerate(ASPECTS):
+            terms = self.term[rows & (self.aspect == code)]
+            _, first = np.unique(terms, return_index=True)
+            go_dict[go_set] = self.go_ids[terms[np.sort(first)]].tolist()
+        return go_dict
+
+    def go_terms_by_gene(self):
+        '''
+        Return {uniprot_id: {"F": [GO IDs], "P": [GO IDs], "C": [GO IDs]}} with UniProt IDs in sorted order and
+        the distinct GO IDs of each gene and aspect in order of first appearance in the GAF.
+        '''
+        key = (self.gene.astype(np.int64) * len(ASPECTS) + self.aspect) * len(self.go_ids) + self.term
+        _, first = np.unique(key, return_index=True)
+        kept = np.sort(first)
+
+        uniprot_ids = self.uniprot_ids.tolist()
+        go_ids = self.go_ids.tolist()
+        uniprot_go_dict = {uniprot_ids[code]: {"F": [], "P": [], "C": []} for code in np.argsort(self.uniprot_ids, kind="stable")}
+        for gene, aspect, term in zip(self.gene[kept].tolist(), self.aspect[kept].tolist(), self.term[kept].tolist()):
+            uniprot_go_dict[uniprot_ids[gene]][ASPECTS[aspect]].append(go_ids[term])
+        return uniprot_go_dict
+
+
+def read_gaf(gaf_filepath, evidence_codes=None, exclude_evidence_codes=None, exclude_not=False):
+    '''
+    Stream a GAF file into GafAnnotations.
+
+    :param evidence_codes: Keep only annotations with these evidence codes (None keeps all)
+    :param exclude_evidence_codes: Drop annotations with these evidence codes, e.g. {"IEA"}
+    :param exclude_not: Drop annotations with a NOT qualifier
+    '''
+    gene_codes, term_codes, evidence_code_index = {}, {}, {}
+    gene, term, evidence = array('i'), array('i'), array('h')
+    aspect, negated = array('b'), array('b')
+
+    with open_gaf(gaf_filepath) as file:
+        for line in file:
+            if line.startswith('!'):
+                continue
+            fields = line.rstrip('\n').split('\t', ASPECT + 1)
+            if len(fields) <= ASPECT or fields[ASPECT] not in ASPECT_CODES:
+                continue
+            evidence_code = fields[EVIDENCE_CODE]
+            if evidence_codes is not None and evidence_code not in evidence_codes:
+                continue
+            if exclude_evidence_codes is not None and evidence_code in exclude_evidence_codes:
+                continue
+            # GAF 2.2 qualifiers are pipe-separated, e.g. NOT|enables
+            is_not = 'NOT' in fields[QUALIFIER].split('|')
+            if is_not and exclude_not:
+                continue
+
+            gene.append(gene_codes.setdefault(fields[DB_OBJECT_ID], len(gene_codes)))
+            term.append(term_codes.setdefault(fields[GO_ID], len(term_codes)))
+            evidence.append(evidence_code_index.setdefault(evidence_code, len(evidence_code_index)))
+            aspect.append(ASPECT_CODES[fields[ASPECT]])
+            negated.append(is_not)
+
+    return GafAnnotations(
+        uniprot_ids=np.array(list(gene_codes), dtype=str),
+        go_ids=np.array(list(term_codes), dtype=str),
+        evidence_codes=np.array(list(evidence_code_index), dtype=str),
+        gene=np.frombuffer(gene, dtype=np.int32),
+        term=np.frombuffer(term, dtype=np.int32),
+        aspect=np.frombuffer(aspect, dtype=np.int8),
+        evidence=np.frombuffer(evidence, dtype=np.int16),
+        negated=np.frombuffer(negated, dtype=np.int8).astype(bool),
+    )
+
+
+def add_filter_arguments(parser):
+    '''Add the --evidence/--exclude_evidence/--exclude_not options of read_gaf to an argparse parser.'''
+    parser.add_argument("--evidence", type=str, help="Comma-separated evidence codes to keep, e.g. EXP,IDA,IPI,IMP,IGI,IEP (default: all).")
+    parser.add_argument("--exclude_evidence", type=str, help="Comma-separated evidence codes to drop, e.g. IEA.")
+    parser.add_argument("--exclude_not", action="store_true", help="Drop annotations with a NOT qualifier.")
+
+
+def filter_options(args):
+    '''Return the read_gaf keyword arguments of options added by add_filter_arguments.'''
+    return {
+        "evidence_codes": set(args.evidence.split(",")) if args.evidence else None,
+        "exclude_evidence_codes": set(args.exclude_evidence.split(",")) if args.exclude_evidence else None,
+        "exclude_not": args.exclude_not,
+    }
@@ -0,0 +1,243 @@
+import argparse
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.stats import rankdata
+from gaf import add_filter_arguments, filter_options, read_gaf
+from go_ontology import load_ontology, propagate_go_terms
+from make_mpd_go_enrichment_scores import go_incidence_matrix
+
+'''
+Statistics of the GO enrichment scores of make_mpd_go_enrichment_scores.py, computed in memory from the GAF and the
+known MPD disease genes (genes_found_protein_only.tsv) instead of rerunning format_go_terms.py and
+make_mpd_go_enrichment_scores.py.
+
+loo: leave-one-out cross-validation. Holding out a known gene only removes its n_probands-weighted GO terms from the
+term counts, a rank-1 sparse update of the term weight vector:
+    weights_without_gene = (counts - n_probands * terms_of_gene) / background_freqs
+The weight vectors of all held-out genes are one (terms x known genes) matrix, and the held-out scores of every gene
+are one sparse matrix product. Each known gene is reported with its held-out score and percentile rank
+(*_enrichment_norm, as in make_mpd_go_enrichment_scores.py), next to its in-sample percentile.
+
+permutation: empirical significance of every gene's scores. Each permutation draws a random set of genes, as many as
+the known genes with GO annotations, and gives them the known genes' n_probands weights. Term counts and scores of a
+batch of permutations are two sparse matrix products, (genes x terms)^T @ (genes x batch) and (genes x terms) @
+(terms x batch). The p-value of a gene is (1 + number of permutations scoring it at least as high as the known genes) /
+(1 + number of permutations), and the FDR is the Benjamini-Hochberg adjustment over all genes of the ontology.
+Batches run in a process pool, each with its own RNG stream spawned from --seed, so results do not depend on --workers.
+
+Usage:
+    python go_enrichment_stats.py loo --input genes_found_protein_only.tsv --goa goa_human.gaf.gz --go go.json --output loo.tsv [--propagate]
+    python go_enrichment_stats.py permutation --input genes_found_protein_only.tsv --goa goa_human.gaf.gz --go go.json --output permutation.tsv --permutations 10000 --workers 16
+'''
+
+GO_SETS = ("F", "P", "C")
+# Permutations per batch (one pool task), bounds the (genes x batch) score matrix
+PERMUTATION_BATCH = 100
+
+
+def known_gene_weights(known_genes_filepath):
+    '''Total n_probands (column 2) of each distinct UniProt ID (column 3) of the known-gene table, in order of first appearance.'''
+    data = pd.read_csv(known_genes_filepath, sep='\t')
+    return data.groupby(data.columns[2], sort=False)[data.columns[1]].sum()
+
+
+class EnrichmentModel:
+    '''
+    The gene x GO term incidence matrix of every ontology for all genes of uniprot_go_dict, with the known genes'
+    rows and n_probands weights, from which enrichment scores are computed for any term counts.
+    '''
+
+    def __init__(self, uniprot_go_dict, known_weights):
+        self.uniprot_ids = list(uniprot_go_dict)
+        position = {uniprot_id: row for row, uniprot_id in enumerate(self.uniprot_ids)}
+        self.known_ids = list(known_weights.index)
+        # Known genes without GO annotations have no row (-1) and add nothing to the counts
+        self.known_rows = np.array([position.get(uniprot_id, -1) for uniprot_id in self.known_ids], dtype=np.int64)
+        self.known_weights = known_weights.values.astype(np.float64)
+        self.matrices, self.background_freqs, self.n_terms = {}, {}, {}
+        for go_set in GO_SETS:
+            matrix, _ = go_incidence_matrix(uniprot_go_dict, go_set)
+            self.matrices[go_set] = matrix
+            self.background_freqs[go_set] = np.asarray(matrix.sum(axis=0)).ravel() / matrix.shape[0]
+            self.n_terms[go_set] = np.diff(matrix.indptr)
+
+    def known_terms(self, go_set):
+        '''(known genes x terms) incidence matrix, empty rows for known genes without annotations.'''
+        matrix = self.matrices[go_set]
+        annotated = self.known_rows >= 0
+        rows = np.zeros(len(self.known_rows), dtype=np.int64)
+        rows[annotated] = self.known_rows[annotated]
+        return csr_matrix(matrix[rows].multiply(annotated[:, None]))
+
+    def term_counts(self, go_set):
+        '''n_probands-weighted count of each GO term over the known genes (the Count column of format_go_terms.py).'''
+        return self.known_terms(go_set).T @ self.known_weights
+
+    def scores(self, go_set, term_counts):
+        '''
+        Enrichment scores of all genes for term counts of shape (terms,) or (terms, k): the sum of the gene's term
+        weights (count / background frequency) divided by its number of terms, 0 for genes without terms.
+        '''
+        weights = term_counts / (self.background_freqs[go_set] if term_counts.ndim == 1 else self.background_freqs[go_set][:, None])
+        scores = self.matrices[go_set] @ weights
+        n_terms = self.n_terms[go_set] if scores.ndim == 1 else self.n_terms[go_set][:, None]
+        return np.divide(scores, n_terms, out=np.zeros(scores.shape), where=n_terms > 0)
+
+
+def percentile_norm(scores):
+    '''*_enrichment_norm of make_mpd_go_enrichment_scores.py: min rank / number of genes.'''
+    return rankdata(scores, method='min') / len(scores)
+
+
+def leave_one_out(model):
+    '''
+    Return a DataFrame with each known gene's held-out enrichment score and percentile rank for F, P and C,
+    plus its in-sample percentile rank. Known genes without GO annotations have empty scores.
+    '''
+    result = pd.DataFrame({"uniprot_id": model.known_ids, "n_probands": model.known_weights})
+    annotated = model.known_rows >= 0
+    columns = np.arange(len(model.known_rows))
+    for go_set in GO_SETS:
+        counts = model.term_counts(go_set)
+        in_sample_norm = percentile_norm(model.scores(go_set, counts))
+
+        # Rank-1 update per held-out gene, all genes at once: one column of term counts per known gene
+        known_terms = model.known_terms(go_set)
+        held_out_counts = counts[:, None] - known_terms.T.multiply(model.known_weights[None, :]).toarray()
+        held_out_scores = model.scores(go_set, held_out_counts)
+
+        # Percentile of the held-out gene among all genes scored without it (min rank, as rankdata)
+        own_scores = held_out_scores[model.known_rows[annotated], columns[annotated]]
+        held_out_norm = ((held_out_scores[:, annotated] < own_scores[None, :]).sum(axis=0) + 1) / held_out_scores.shape[0]
+
+        result[f"{go_set}_enrichment"] = np.nan
+        result.loc[annotated, f"{go_set}_enrichment"] = own_scores
+        result[f"{go_set}_enrichment_norm"] = np.nan
+        result.loc[annotated, f"{go_set}_enrichment_norm"] = held_out_norm
+        result[f"{go_set}_enrichment_norm_in_sample"] = np.nan
+        result.loc[annotated, f"{go_set}_enrichment_norm_in_sample"] = in_sample_norm[model.known_rows[annotated]]
+    return result
+
+
+def benjamini_hochberg(p_values):
+    '''Benjamini-Hochberg adjusted p-values (FDR).'''
+    order = np.argsort(p_values)
+    ranked = p_values[order] * len(p_values) / np.arange(1, len(p_values) + 1)
+    fdr = np.empty(len(p_values))
+    fdr[order] = np.minimum.accumulate(ranked[::-1])[::-1].clip(max=1)
+    return fdr
+
+
+# Set in each pool process by init_permutation_worker, so the model is sent once per process and not once per batch
+_model = None
+_observed = None
+
+
+def init_permutation_worker(model, observed):
+    global _model, _observed
+    _model, _observed = model, observed
+
+
+def permutation_batch(task):
+    '''
+    Score one batch of random weighted gene sets and return, per ontology, how many permutations scored each gene
+    at least as high as the observed score.
+    '''
+    seed_sequence, n_permutations = task
+    rng = np.random.default_rng(seed_sequence)
+    n_genes = len(_model.uniprot_ids)
+    weights = _model.known_weights[_model.known_rows >= 0]
+    # (genes x permutations) sampling matrix: each column holds the known genes' weights on randomly drawn genes
+    sampled_genes = np.concatenate([rng.choice(n_genes, len(weights), replace=False) for _ in range(n_permutations)])
+    permutations = np.repeat(np.arange(n_permutations), len(weights))
+    sampling = csr_matrix((np.tile(weights, n_permutations), (sampled_genes, permutations)), shape=(n_genes, n_permutations))
+
+    exceed = {}
+    for go_set in GO_SETS:
+        counts = (_model.matrices[go_set].T @ sampling).toarray()
+        null_scores = _model.scores(go_set, counts)
+        exceed[go_set] = (null_scores >= _observed[go_set][:, None]).sum(axis=1)
+    return exceed
+
+
+def permutation_test(model, n_permutations=10000, seed=0, workers=1):
+    '''
+    Return a DataFrame with every gene's observed F/P/C enrichment score, empirical p-value and BH FDR
+    against random gene sets of the known genes' size and n_probands weights.
+    '''
+    observed = {go_set: model.scores(go_set, model.term_counts(go_set)) for go_set in GO_SETS}
+    batch_sizes = [PERMUTATION_BATCH] * (n_permutations // PERMUTATION_BATCH)
+    if n_permutations % PERMUTATION_BATCH:
+        batch_sizes.append(n_permutations % PERMUTATION_BATCH)
+    # One independent RNG stream per batch, the same for any number of workers
+    tasks = list(zip(np.random.SeedSequence(seed).spawn(len(batch_sizes)), batch_sizes))
+
+    exceed = {go_set: np.zeros(len(model.uniprot_ids), dtype=np.int64) for go_set in GO_SETS}
+    if workers > 1:
+        with Pool(workers, initializer=init_permutation_worker, initargs=(model, observed)) as pool:
+            # Counts are summed, so the order batches finish in does not matter
+            for batch_exceed in pool.imap_unordered(permutation_batch, tasks):
+                for go_set in GO_SETS:
+                    exceed[go_set] += batch_exceed[go_set]
+    else:
+        init_permutation_worker(model, observed)
+        for task in tasks:
+            batch_exceed = permutation_batch(task)
+            for go_set in GO_SETS:
+                exceed[go_set] += batch_exceed[go_set]
+
+    result = pd.DataFrame({"uniprot_id": model.uniprot_ids})
+    for go_set in GO_SETS:
+        p_values = (exceed[go_set] + 1) / (n_permutations + 1)
+        result[f"{go_set}_enrichment"] = observed[go_set]
+        result[f"{go_set}_p_value"] = p_values
+        result[f"{go_set}_fdr"] = benjamini_hochberg(p_values)
+    return result
+
+
+def load_model(known_genes_filepath, goa_filepath, go_json_filepath, gaf_filters=None, propagate=False):
+    '''EnrichmentModel of all genes of the GAF, annotations propagated up is_a/part_of with propagate.'''
+    uniprot_go_dict = read_gaf(goa_filepath, **(gaf_filters or {})).go_terms_by_gene()
+    if propagate:
+        uniprot_go_dict = propagate_go_terms(uniprot_go_dict, load_ontology(go_json_filepath))
+    return EnrichmentModel(uniprot_go_dict, known_gene_weights(known_genes_filepath))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cross-validation and permutation statistics of the GO enrichment scores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    # Inputs shared by all commands
+    inputs = argparse.ArgumentParser(add_help=False)
+    inputs.add_argument("--input", type=str, required=True, help="Path to genes_found_protein_only.tsv input file.")
+    inputs.add_argument("--goa", type=str, required=True, help="The path to the GO annotations file.")
+    inputs.add_argument("--go", type=str, help="Path to the GO terms JSON file (needed with --propagate).")
+    inputs.add_argument("--output", type=str, required=True, help="Path to output TSV.")
+    inputs.add_argument("--propagate", action="store_true", help="Count the is_a/part_of ancestors of each annotated GO term, as with make_mpd_go_enrichment_scores.py --propagate.")
+    add_filter_arguments(inputs)
+
+    subparsers.add_parser("loo", parents=[inputs], help="Leave-one-out held-out scores and percentiles of every known gene.")
+    permutation_parser = subparsers.add_parser("permutation", parents=[inputs], help="Empirical p-values and FDR of every gene's scores against random weighted gene sets.")
+    permutation_parser.add_argument("--permutations", type=int, default=10000, help="Number of random gene sets (default: 10000).")
+    permutation_parser.add_argument("--seed", type=int, default=0, help="Seed of the RNG streams (default: 0).")
+    permutation_parser.add_argument("--workers", type=int, default=1, help="Worker processes (default: 1).")
+
+    args = parser.parse_args()
+    if args.propagate and not args.go:
+        parser.error("--propagate needs --go")
+
+    model = load_model(args.input, args.goa, args.go, filter_options(args), args.propagate)
+    if args.command == "loo":
+        result = leave_one_out(model)
+        result.to_csv(args.output, sep='\t', index=False)
+        print(f"Saved held-out scores of {len(result)} known genes to {args.output}")
+    elif args.command == "permutation":
+        result = permutation_test(model, args.permutations, args.seed, args.workers)
+        result.to_csv(args.output, sep='\t', index=False)
+        print(f"Saved p-values of {len(result)} genes from {args.permutations} permutations to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
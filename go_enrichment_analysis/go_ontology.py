@@ -0,0 +1,297 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import numpy as np
+from scipy.sparse import csr_matrix, diags, identity
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+'''
+GO ontology loader for go.json (https://purl.obolibrary.org/obo/go.json).
+
+go.json is read once, streamed with ijson when it is installed (json.load otherwise), and only the node IDs, labels,
+namespaces, obsolete flags, alt_ids and is_a/part_of edges are kept, together with the ancestor closure of every term
+(CSR ancestor list, built once per go.json). They are written to a binary cache next to go.json (<go.json>.cache.npz),
+which later runs load in milliseconds. The cache records the SHA-256 of go.json: it is
+used as is while the file's size and mtime are unchanged, and otherwise only if the hash still matches.
+
+Node IDs are written as in the rest of the scripts, e.g. http://purl.obolibrary.org/obo/GO_0008150 -> GO:0008150.
+Secondary IDs (alt_ids) resolve to their primary term.
+
+propagate_go_terms applies the true-path rule to per-gene GO term lists: every is_a/part_of ancestor of a gene's
+terms is added, for all genes at once as one sparse product of the gene x term matrix with the ancestor closure.
+
+Usage:
+    python go_ontology.py <go.json> [--term GO:0008150]
+'''
+
+CACHE_VERSION = 2
+NAMESPACES = ("molecular_function", "biological_process", "cellular_component")
+# Namespace of each GAF aspect
+ASPECT_NAMESPACES = {"F": "molecular_function", "P": "biological_process", "C": "cellular_component"}
+RELATIONS = ("is_a", "part_of")
+# Predicates of go.json edges and node properties
+RELATION_PREDICATES = {"is_a": "is_a", "http://purl.obolibrary.org/obo/BFO_0000050": "part_of"}
+NAMESPACE_PREDICATE = "http://www.geneontology.org/formats/oboInOwl#hasOBONamespace"
+ALT_ID_PREDICATE = "http://www.geneontology.org/formats/oboInOwl#hasAlternativeId"
+
+
+def node_id(iri):
+    '''http://purl.obolibrary.org/obo/GO_0008150 -> GO:0008150'''
+    return iri.split("/")[-1].replace("_", ":")
+
+
+def file_sha256(filepath):
+    sha256 = hashlib.sha256()
+    with open(filepath, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def iter_graph_items(json_filepath):
+    '''Yield ("nodes", node) and ("edges", edge) for the items of every graph of go.json in file order, parsing the file once.'''
+    if ijson is not None:
+        prefixes = {f"graphs.item.{key}.item": key for key in ("nodes", "edges")}
+        with open(json_filepath, 'rb') as file:
+            # One pass over the parser events, building each node or edge object as it is read
+            builder = None
+            for prefix, event, value in ijson.parse(file):
+                if builder is None:
+                    if event != "start_map" or prefix not in prefixes:
+                        continue
+                    key, item_prefix, builder = prefixes[prefix], prefix, ijson.ObjectBuilder()
+                builder.event(event, value)
+                if event == "end_map" and prefix == item_prefix:
+                    yield key, builder.value
+                    builder = None
+        return
+    with open(json_filepath, 'r') as file:
+        data = json.load(file)
+    for graph in data.get("graphs", []):
+        for key in ("nodes", "edges"):
+            for item in graph.get(key, []):
+                yield key, item
+
+
+def ancestor_closure(n_terms, edge_child, edge_parent):
+    '''
+    Return the CSR (indptr, indices) of the ancestors of every term over the edges, each term included.
+    The child -> parent matrix is squared until no new ancestors appear, so the number of products grows with
+    the log of the depth of the DAG.
+    '''
+    closure = (identity(n_terms, dtype=np.int32, format='csr')
+               + csr_matrix((np.ones(len(edge_child), dtype=np.int32), (edge_child, edge_parent)), shape=(n_terms, n_terms))).tocsr()
+    closure.data[:] = 1
+    while True:
+        expanded = (closure @ closure).tocsr()
+        expanded.data[:] = 1
+        if expanded.nnz == closure.nnz:
+            break
+        closure = expanded
+    closure.sort_indices()
+    return closure.indptr.astype(np.int64), closure.indices.astype(np.int32)
+
+
+def parse_go_json(json_filepath):
+    '''Return the arrays of the ontology cache from go.json.'''
+    ids, labels, namespaces, obsolete = [], [], [], []
+    alt_ids, alt_targets = [], []
+    index = {}
+    # Edges are resolved once every node is indexed, only the (child, parent, relation) of is_a/part_of edges are kept
+    edges = []
+    for key, item in iter_graph_items(json_filepath):
+        if key == "edges":
+            relation = RELATION_PREDICATES.get(item.get("pred"))
+            if relation is not None:
+                edges.append((node_id(item["sub"]), node_id(item["obj"]), relation))
+            continue
+        node = item
+        if not node.get("id") or not node.get("lbl"):
+            continue
+        go_id = node_id(node["id"])
+        if go_id in index:
+            continue
+        index[go_id] = len(ids)
+        ids.append(go_id)
+        labels.append(node["lbl"])
+        meta = node.get("meta", {})
+        namespace = -1
+        for prop in meta.get("basicPropertyValues", []):
+            if prop.get("pred") == NAMESPACE_PREDICATE and prop.get("val") in NAMESPACES:
+                namespace = NAMESPACES.index(prop["val"])
+            elif prop.get("pred") == ALT_ID_PREDICATE:
+                alt_ids.append(prop["val"])
+                alt_targets.append(index[go_id])
+        namespaces.append(namespace)
+        obsolete.append(bool(meta.get("deprecated", False)))
+
+    edge_child, edge_parent, edge_relation = [], [], []
+    for child_id, parent_id, relation in edges:
+        child, parent = index.get(child_id), index.get(parent_id)
+        if child is None or parent is None:
+            continue
+        edge_child.append(child)
+        edge_parent.append(parent)
+        edge_relation.append(RELATIONS.index(relation))
+
+    ancestor_indptr, ancestor_indices = ancestor_closure(len(ids), edge_child, edge_parent)
+
+    # Labels are stored as one UTF-8 blob with offsets, so the cache needs no pickling
+    encoded = [label.encode() for label in labels]
+    label_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(label) for label in encoded], out=label_offsets[1:])
+    return {
+        "ids": np.array(ids, dtype=str),
+        "label_blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "label_offsets": label_offsets,
+        "namespace": np.array(namespaces, dtype=np.int8),
+        "obsolete": np.array(obsolete, dtype=bool),
+        "alt_ids": np.array(alt_ids, dtype=str),
+        "alt_targets": np.array(alt_targets, dtype=np.int32),
+        "edge_child": np.array(edge_child, dtype=np.int32),
+        "edge_parent": np.array(edge_parent, dtype=np.int32),
+        "edge_relation": np.array(edge_relation, dtype=np.int8),
+        "ancestor_indptr": ancestor_indptr,
+        "ancestor_indices": ancestor_indices,
+    }
+
+
+class GoOntology:
+    '''GO terms and is_a/part_of edges, with each term's row given by index[go_id].'''
+
+    def __init__(self, arrays):
+        self.ids = arrays["ids"].tolist()
+        blob = arrays["label_blob"].tobytes()
+        offsets = arrays["label_offsets"].tolist()
+        self.labels = [blob[start:end].decode() for start, end in zip(offsets[:-1], offsets[1:])]
+        self.namespace = arrays["namespace"]
+        self.obsolete = arrays["obsolete"]
+        self.edge_child = arrays["edge_child"]
+        self.edge_parent = arrays["edge_parent"]
+        self.edge_relation = arrays["edge_relation"]
+        # Row i lists the ancestors of term i (i included) over is_a/part_of
+        self.ancestors = csr_matrix((np.ones(len(arrays["ancestor_indices"]), dtype=np.float32), arrays["ancestor_indices"], arrays["ancestor_indptr"]),
+                                    shape=(len(self.ids), len(self.ids)))
+        self.index = {go_id: row for row, go_id in enumerate(self.ids)}
+        # Secondary IDs point to the row of their primary term, primary IDs take precedence
+        self.alt_ids = {alt_id: row for alt_id, row in zip(arrays["alt_ids"].tolist(), arrays["alt_targets"].tolist()) if alt_id not in self.index}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row(self, go_id):
+        '''Row of a GO ID or alt_id, None if unknown.'''
+        row = self.index.get(go_id)
+        return self.alt_ids.get(go_id) if row is None else row
+
+    def resolve(self, go_id):
+        '''Primary GO ID of a GO ID or alt_id, None if unknown.'''
+        row = self.row(go_id)
+        return None if row is None else self.ids[row]
+
+    def label(self, go_id, default=None):
+        row = self.row(go_id)
+        return default if row is None else self.labels[row]
+
+    def id_to_label(self):
+        '''{GO ID: label} of every term, alt_ids included with the label of their primary term.'''
+        id_to_lbl = dict(zip(self.ids, self.labels))
+        for alt_id, row in self.alt_ids.items():
+            id_to_lbl[alt_id] = self.labels[row]
+        return id_to_lbl
+
+
+def propagate_go_terms(uniprot_go_dict, ontology):
+    '''
+    Add the is_a/part_of ancestors of each gene's GO terms to its "F", "P" and "C" lists (true-path rule), keeping
+    only ancestors in the namespace of the aspect. Directly annotated GO IDs stay first and in order, alt_ids count
+    as their primary term, and GO IDs missing from go.json are kept without ancestors.
+    '''
+    go_dicts = list(uniprot_go_dict.values())
+    for go_set, namespace in ASPECT_NAMESPACES.items():
+        direct_rows = [[ontology.row(go_id) for go_id in go_dict[go_set]] for go_dict in go_dicts]
+        gene_index = [gene for gene, rows in enumerate(direct_rows) for row in rows if row is not None]
+        term_index = [row for rows in direct_rows for row in rows if row is not None]
+        annotated = csr_matrix((np.ones(len(term_index), dtype=np.float32), (gene_index, term_index)), shape=(len(go_dicts), len(ontology)))
+        # Gene x term matrix of all ancestors, restricted to the aspect's namespace
+        in_namespace = diags((ontology.namespace == NAMESPACES.index(namespace)).astype(np.float32))
+        propagated = (annotated @ ontology.ancestors @ in_namespace).tocsr()
+        propagated.eliminate_zeros()
+        propagated.sort_indices()
+        for gene, go_dict in enumerate(go_dicts):
+            direct = set(direct_rows[gene])
+            ancestors = propagated.indices[propagated.indptr[gene]:propagated.indptr[gene + 1]].tolist()
+            go_dict[go_set] = go_dict[go_set] + [ontology.ids[row] for row in ancestors if row not in direct]
+    return uniprot_go_dict
+
+
+def write_cache(cache_filepath, arrays):
+    try:
+        # Write to a temporary file first, so an interrupted run cannot leave a truncated cache
+        with open(f"{cache_filepath}.tmp", 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(f"{cache_filepath}.tmp", cache_filepath)
+    except OSError as e:
+        print(f"Could not write GO cache {cache_filepath}: {e}", file=sys.stderr)
+
+
+def load_ontology(json_filepath, cache_filepath=None):
+    '''
+    Load the ontology of go.json from its binary cache, parsing go.json and writing the cache when it is
+    missing or was built from a different go.json.
+    '''
+    cache_filepath = cache_filepath or f"{json_filepath}.cache.npz"
+    stat = os.stat(json_filepath)
+    file_stat = {"size": np.array(stat.st_size), "mtime_ns": np.array(stat.st_mtime_ns)}
+    sha256 = None
+    if os.path.exists(cache_filepath):
+        try:
+            with np.load(cache_filepath) as cache:
+                arrays = {key: cache[key] for key in cache.files}
+        except Exception as e:
+            print(f"Ignoring unreadable GO cache {cache_filepath}: {e}", file=sys.stderr)
+            arrays = None
+        if arrays is not None and int(arrays["version"]) == CACHE_VERSION:
+            # Size and mtime unchanged: trust the cache without hashing go.json
+            if int(arrays["size"]) == stat.st_size and int(arrays["mtime_ns"]) == stat.st_mtime_ns:
+                return GoOntology(arrays)
+            sha256 = file_sha256(json_filepath)
+            if str(arrays["sha256"]) == sha256:
+                # Same content (e.g. copied or touched), record the new size and mtime for the next run
+                arrays.update(file_stat)
+                write_cache(cache_filepath, arrays)
+                return GoOntology(arrays)
+
+    arrays = parse_go_json(json_filepath)
+    arrays.update(version=np.array(CACHE_VERSION), sha256=np.array(sha256 or file_sha256(json_filepath)), **file_stat)
+    write_cache(cache_filepath, arrays)
+    return GoOntology(arrays)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build (if needed) and query the binary cache of go.json.")
+    parser.add_argument("go", type=str, help="Path to the GO terms JSON file.")
+    parser.add_argument("--cache", type=str, help="Cache file (default: <go.json>.cache.npz).")
+    parser.add_argument("--term", type=str, action="append", default=[], help="GO ID or alt_id to look up.")
+    args = parser.parse_args()
+
+    ontology = load_ontology(args.go, args.cache)
+    print(f"{len(ontology)} terms, {len(ontology.alt_ids)} alt_ids, {len(ontology.edge_child)} is_a/part_of edges, {ontology.ancestors.nnz} term-ancestor pairs")
+    for go_id in args.term:
+        row = ontology.row(go_id)
+        if row is None:
+            print(f"{go_id}\tnot found")
+            continue
+        namespace = NAMESPACES[ontology.namespace[row]] if ontology.namespace[row] >= 0 else "."
+        obsolete = "\tobsolete" if ontology.obsolete[row] else ""
+        n_ancestors = ontology.ancestors.indptr[row + 1] - ontology.ancestors.indptr[row] - 1
+        print(f"{go_id}\t{ontology.ids[row]}\t{ontology.labels[row]}\t{namespace}\t{n_ancestors} ancestors{obsolete}")
+
+
+if __name__ == "__main__":
+    main()
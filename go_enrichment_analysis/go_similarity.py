@@ -0,0 +1,128 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from go_ontology import ASPECT_NAMESPACES, NAMESPACES
+
+'''
+GO semantic similarity of every gene to the known MPD disease genes.
+
+The information content of a term is -log of the fraction of annotated genes (in the term's namespace) annotated to
+the term or to one of its descendants, i.e. after propagating the GAF annotations up is_a/part_of.
+Term similarity is Resnik (the IC of the most informative common ancestor, MICA) or Lin (2 * IC(MICA) / (IC(t1) + IC(t2))).
+Gene similarity is the best-match average (BMA) over the two genes' directly annotated terms, and each gene's score is
+its best BMA over the known genes, leaving the gene itself out for known genes.
+
+The MICA of every (annotated term, known gene term) pair is computed once into a dense table, and all genes are then
+scored against all known genes with array operations on that table, so the cost does not grow with the number of gene pairs
+scored one by one.
+'''
+
+MEASURES = ("lin", "resnik")
+# Terms (or genes) per block when gathering rows of the ancestor/MICA tables, bounds the temporary arrays
+BLOCK_SIZE = 256
+
+
+def direct_term_rows(uniprot_go_dict, ontology, go_set):
+    '''CSR (indptr, indices) of the ontology rows of each gene's GO terms of one aspect, alt_ids resolved and unknown IDs dropped.'''
+    indptr, indices = [0], []
+    for go_dict in uniprot_go_dict.values():
+        rows = {ontology.row(go_id) for go_id in go_dict[go_set]}
+        rows.discard(None)
+        indices.extend(sorted(rows))
+        indptr.append(len(indices))
+    return np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64)
+
+
+def information_content(indptr, indices, ontology, go_set):
+    '''IC of every ontology term from the propagated annotation frequencies of one aspect, 0 for unannotated terms.'''
+    annotated = csr_matrix((np.ones(len(indices), dtype=np.float32), indices, indptr), shape=(len(indptr) - 1, len(ontology)))
+    propagated = (annotated @ ontology.ancestors).tocsr()
+    propagated.data[:] = 1
+    counts = np.asarray(propagated.sum(axis=0)).ravel()
+    counts[ontology.namespace != NAMESPACES.index(ASPECT_NAMESPACES[go_set])] = 0
+    n_annotated = np.count_nonzero(np.diff(indptr))
+    ic = np.zeros(len(ontology))
+    ic[counts > 0] = -np.log(counts[counts > 0] / n_annotated)
+    return ic
+
+
+def mica_table(ontology, ic, query_rows, known_rows):
+    '''
+    Return the (query terms x known terms) table of the IC of the most informative common ancestor (Resnik similarity).
+    Each known term's ancestors are spread into a dense IC column, and the table row of a query term is the maximum
+    of those columns over the query term's ancestors.
+    '''
+    known_ancestors = ontology.ancestors[known_rows]
+    universe = np.unique(known_ancestors.indices)
+    # Ancestors of query terms that no known term shares map to the last, all-zero row
+    position = np.full(len(ontology), len(universe))
+    position[universe] = np.arange(len(universe))
+    known_ic = np.zeros((len(universe) + 1, len(known_rows)), dtype=np.float32)
+    known_ic[position[known_ancestors.indices], np.repeat(np.arange(len(known_rows)), np.diff(known_ancestors.indptr))] = ic[known_ancestors.indices]
+
+    query_ancestors = ontology.ancestors[query_rows]
+    table = np.zeros((len(query_rows), len(known_rows)), dtype=np.float32)
+    for start in range(0, len(query_rows), BLOCK_SIZE):
+        end = min(start + BLOCK_SIZE, len(query_rows))
+        first, last = query_ancestors.indptr[start], query_ancestors.indptr[end]
+        # Every term is its own ancestor, so no query term has an empty segment
+        table[start:end] = np.maximum.reduceat(known_ic[position[query_ancestors.indices[first:last]]],
+                                               query_ancestors.indptr[start:end] - first, axis=0)
+    return table
+
+
+def lin_table(resnik, query_ic, known_ic):
+    denominator = query_ic[:, None] + known_ic[None, :]
+    return np.divide(2 * resnik, denominator, out=np.zeros_like(resnik), where=denominator > 0).astype(np.float32)
+
+
+def similarity_to_known_genes(uniprot_go_dict, ontology, known_uniprot_ids, go_set, measure="lin"):
+    '''
+    Return the best BMA similarity of each gene of uniprot_go_dict (in its order) to the known genes, for one aspect.
+    uniprot_go_dict should hold the direct annotations. Genes without terms, or without a known gene to compare to, score 0.
+    '''
+    indptr, indices = direct_term_rows(uniprot_go_dict, ontology, go_set)
+    ic = information_content(indptr, indices, ontology, go_set)
+    n_terms = np.diff(indptr)
+    scores = np.zeros(len(n_terms))
+
+    gene_position = {uniprot_id: gene for gene, uniprot_id in enumerate(uniprot_go_dict)}
+    known_genes = [gene_position[uniprot_id] for uniprot_id in dict.fromkeys(known_uniprot_ids) if uniprot_id in gene_position]
+    known_genes = [gene for gene in known_genes if n_terms[gene] > 0]
+    if not known_genes:
+        return scores
+
+    # Columns of the query/known term universes for every annotation
+    query_rows = np.unique(indices)
+    query_columns = np.searchsorted(query_rows, indices)
+    known_indices = np.concatenate([indices[indptr[gene]:indptr[gene + 1]] for gene in known_genes])
+    known_offsets = np.cumsum([0] + [n_terms[gene] for gene in known_genes])[:-1]
+    known_rows = np.unique(known_indices)
+    known_columns = np.searchsorted(known_rows, known_indices)
+
+    table = mica_table(ontology, ic, query_rows, known_rows)
+    if measure == "lin":
+        table = lin_table(table, ic[query_rows], ic[known_rows])
+
+    # Candidate terms -> known genes: best match of each term in each known gene, averaged over the gene's terms
+    term_best = np.maximum.reduceat(table[:, known_columns], known_offsets, axis=1)
+    gene_terms = csr_matrix((np.ones(len(indices), dtype=np.float32), query_columns, indptr), shape=(len(n_terms), len(query_rows)))
+    candidate_to_known = gene_terms @ term_best
+
+    # Known gene terms -> candidates: best match of each known term among the gene's terms, averaged per known gene
+    known_weights = np.zeros((len(known_rows), len(known_genes)), dtype=np.float32)
+    known_weights[known_columns, np.repeat(np.arange(len(known_genes)), [n_terms[gene] for gene in known_genes])] = 1
+    known_weights /= known_weights.sum(axis=0)
+    known_to_candidate = np.zeros_like(candidate_to_known)
+    annotated = np.flatnonzero(n_terms > 0)
+    for start in range(0, len(annotated), BLOCK_SIZE):
+        genes = annotated[start:start + BLOCK_SIZE]
+        gathered = np.concatenate([query_columns[indptr[gene]:indptr[gene + 1]] for gene in genes])
+        offsets = np.cumsum(np.concatenate([[0], n_terms[genes]]))[:-1]
+        known_to_candidate[genes] = np.maximum.reduceat(table[gathered], offsets, axis=0) @ known_weights
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        bma = (candidate_to_known / n_terms[:, None] + known_to_candidate) / 2
+    bma[n_terms == 0] = 0
+    # Known genes are not compared to themselves (a lone known gene then scores 0)
+    bma[known_genes, np.arange(len(known_genes))] = -np.inf
+    return np.maximum(bma.max(axis=1), 0)
@@ -1,8 +1,10 @@
 import argparse
-import sys
 import pandas as pd
 import numpy as np
-import json
+from gaf import add_filter_arguments, filter_options, read_gaf
+from go_ontology import load_ontology, propagate_go_terms
+from go_similarity import MEASURES, similarity_to_known_genes
+from scipy.sparse import csr_matrix
 from scipy.stats import rankdata
 
 '''
@@ -15,6 +17,12 @@ goa_human.gaf (https://current.geneontology.org/annotations/goa_human.gaf.gz), a
 
 Output is a TSV with columns uniprot_id, F_enrichment, P_enrichment, C_enrichment
 
+The scores of all genes are computed at once per ontology: the gene x GO term incidence matrix (CSR) is multiplied by
+the vector of term weights, and each row sum is divided by the gene's number of GO terms.
+
+With --known_genes (genes_found_protein_only.tsv), F_similarity, P_similarity and C_similarity columns are added at the
+end: the best Lin (or Resnik) best-match-average semantic similarity of the gene to a known MPD disease gene (go_similarity.py).
+
 '''
 
 
@@ -22,14 +30,9 @@ Output is a TSV with columns uniprot_id, F_enrichment, P_enrichment, C_enrichmen
 '''
 These preloading functions speed up the processing ~1000x by preloading data into memory
 '''
-def preload_goa(goa_filepath):
-    with open(goa_filepath, 'r') as file:
-    # Filter out lines starting with '!'
-        filtered_lines = [line for line in file if not line.startswith('!')]
-            # Split filtered lines into columns
-        data = [line.strip().split('\t') for line in filtered_lines]
-        data = pd.DataFrame(data[1:])
-        return (data)
+def preload_goa(goa_filepath, evidence_codes=None, exclude_evidence_codes=None, exclude_not=False):
+    # Streams the GAF (plain or .gz) into integer-coded arrays, see gaf.py
+    return read_gaf(goa_filepath, evidence_codes, exclude_evidence_codes, exclude_not)
     
 
 def preprocess_json(json_file):
@@ -39,20 +42,8 @@ def preprocess_json(json_file):
     :param json_file: Path to the JSON file
     :return: A dictionary {id: lbl}
     """
-    with open(json_file, 'r') as file:
-        data = json.load(file)
-    
-    id_to_lbl = {}
-    for graph in data.get("graphs", []):
-        for node in graph.get("nodes", []):
-            node_id = node.get("id")
-            go_id = node_id.split("/")[-1]
-            go_id = go_id.replace("_", ":")
-            lbl = node.get("lbl")
-            if go_id and lbl:
-                id_to_lbl[go_id] = lbl
-
-    return id_to_lbl
+    # go.json is parsed once into a binary cache next to it (go_ontology.py), alt_ids map to their primary term's label
+    return load_ontology(json_file).id_to_label()
 
 
 ### Helper functions
@@ -63,17 +54,7 @@ def get_go_terms(goa_data, uniprot_id):
     This function gets the GO terms for a given uniprot ID.
     '''
 
-    filtered_data = goa_data[goa_data.iloc[:, 1] == uniprot_id]
-
-    go_f = filtered_data[filtered_data.iloc[:, 8] == "F"]
-    go_p = filtered_data[filtered_data.iloc[:, 8] == "P"]
-    go_c = filtered_data[filtered_data.iloc[:, 8] == "C"]
-
-    go_f_id = list(set(go_f[4].tolist()))
-    go_p_id = list(set(go_p[4].tolist()))
-    go_c_id = list(set(go_c[4].tolist()))
-
-    go_dict = {"F": go_f_id, "P": go_p_id, "C": go_c_id}    
+    go_dict = goa_data.go_terms(uniprot_id)
 
     return (go_dict)
 
@@ -89,15 +70,15 @@ def translate_go_terms(goa_dict, go_dict):
     for key, value in goa_dict.items():
         if key == "F":
             for go_id in value:
-                go_lbl = go_dict[go_id]
+                go_lbl = go_dict.get(go_id, "Unknown")
                 goa_dict["F_lbl"].append(go_lbl)
         elif key == "P":
             for go_id in value:
-                go_lbl = go_dict[go_id]
+                go_lbl = go_dict.get(go_id, "Unknown")
                 goa_dict["P_lbl"].append(go_lbl)
         elif key == "C":
             for go_id in value:
-                go_lbl = go_dict[go_id]
+                go_lbl = go_dict.get(go_id, "Unknown")
                 goa_dict["C_lbl"].append(go_lbl)
     return goa_dict
 
@@ -106,7 +87,7 @@ def uniprot_to_go_list(goa_data, go_json_data):
     This function creates a dictionary of uniprot IDs to GO terms.
     '''
     uniprot_to_go = {}
-    for uniprot_id in goa_data.iloc[:, 1]:
+    for uniprot_id in goa_data.uniprot_ids:
         go_dict = get_go_terms(goa_data, uniprot_id)
         uniprot_to_go[uniprot_id] = go_dict
     return uniprot_to_go
@@ -116,14 +97,7 @@ def get_go_terms_optimized(goa_data):
     """
     Optimized function to create a dictionary of UniProt IDs to GO terms.
     """
-    grouped = goa_data.groupby(goa_data.columns[1])  # Group by UniProt ID (column 1)
-    uniprot_go_dict = {}
-    for uniprot_id, group in grouped:
-        go_f = group[group.iloc[:, 8] == "F"].iloc[:, 4].unique().tolist()
-        go_p = group[group.iloc[:, 8] == "P"].iloc[:, 4].unique().tolist()
-        go_c = group[group.iloc[:, 8] == "C"].iloc[:, 4].unique().tolist()
-        uniprot_go_dict[uniprot_id] = {"F": go_f, "P": go_p, "C": go_c}
-    return uniprot_go_dict
+    return goa_data.go_terms_by_gene()
 
 
 def translate_go_terms_optimized(uniprot_go_dict, go_json_data):
@@ -138,57 +112,57 @@ def translate_go_terms_optimized(uniprot_go_dict, go_json_data):
     return uniprot_go_dict
 
 
-def uniprot_to_go_list_optimized(goa_data, go_json_data):
+def uniprot_to_go_list_optimized(goa_data, go_json_data, ontology=None):
     """
     Create a dictionary of UniProt IDs to GO terms using optimized grouping.
+    With an ontology from go_ontology.load_ontology, the ancestors of each GO term are added (true-path rule).
     """
     uniprot_go_dict = get_go_terms_optimized(goa_data)
+    if ontology is not None:
+        uniprot_go_dict = propagate_go_terms(uniprot_go_dict, ontology)
     uniprot_go_dict = translate_go_terms_optimized(uniprot_go_dict, go_json_data)
     return uniprot_go_dict
 
 
-def get_go_scaled_count(score_df, go_id_list, global_freqs, go_set):
-
+def go_incidence_matrix(uniprot_go_dict, go_set):
     '''
-    This function takes a GO ID, gets the score from the score_df.
+    This function builds the gene x GO term incidence matrix (CSR) of one ontology, rows in uniprot_go_dict order.
+    Columns are the GO IDs in order of first appearance, and each row keeps the order of the gene's GO ID list.
     '''
-
-    cumulative_score = 0
-    for go_id in go_id_list:
-        row = score_df[score_df.iloc[:, 0] == go_id]
-        if not row.empty:
-            scaled_count_value = row['Count'].iloc[0]
-            background_freq = global_freqs[go_set][go_id]
-            weighted_score = scaled_count_value / background_freq
-        elif row.empty:
-            weighted_score = 0
-        cumulative_score += weighted_score
-
-    return cumulative_score
-
-
-def get_global_counts(uniprot_go_dict):
+    term_index = {}
+    indices = []
+    indptr = [0]
+    for go_dict in uniprot_go_dict.values():
+        for go_id in go_dict[go_set]:
+            indices.append(term_index.setdefault(go_id, len(term_index)))
+        indptr.append(len(indices))
+    matrix = csr_matrix((np.ones(len(indices)), np.array(indices, dtype=np.int64), np.array(indptr, dtype=np.int64)),
+                        shape=(len(uniprot_go_dict), len(term_index)))
+    return matrix, list(term_index)
+
+
+def go_term_weights(score_df, go_ids, background_freqs):
     '''
-    This function takes the uniprot_go_dict outputted by uniprot_to_go_list_optimized and returns the global frequency of GO terms split by F, P and C.
+    This function returns the weight of each GO ID, the scaled count in score_df divided by the background frequency.
+    GO IDs not in score_df weigh 0, and the first row is used for GO IDs listed more than once.
     '''
+    counts = score_df.drop_duplicates(subset=score_df.columns[0], keep='first').set_index(score_df.columns[0])['Count']
+    scaled_counts = pd.Series(go_ids).map(counts).fillna(0).values
+    return scaled_counts / background_freqs
 
-    global_counts = {"F": {}, "P": {}, "C": {}}
-    uniprot_count = len(uniprot_go_dict)
-    for uniprot_id, go_dict in uniprot_go_dict.items():
-        for go_lbl, go_list in go_dict.items():
-            if go_lbl in ["F", "P", "C"]:
-                for go_id in go_list:
-                    if go_id in global_counts[go_lbl]:
-                        global_counts[go_lbl][go_id] += 1
-                    else:
-                        global_counts[go_lbl][go_id] = 1
-
-    # Normalise the counts by the number of genes
-    for go_lbl in global_counts.keys():
-        for go_id in global_counts[go_lbl].keys():
-            global_counts[go_lbl][go_id] = global_counts[go_lbl][go_id] / uniprot_count
 
-    return global_counts
+def enrichment_scores(uniprot_go_dict, score_df, go_set):
+    '''
+    This function returns the enrichment score of every gene for one ontology as one sparse matrix-vector product:
+    the sum of the weights of the gene's GO terms divided by its number of GO terms (0 for genes without GO terms).
+    '''
+    matrix, go_ids = go_incidence_matrix(uniprot_go_dict, go_set)
+    # Background frequency: the fraction of all genes annotated with each GO term
+    background_freqs = np.asarray(matrix.sum(axis=0)).ravel() / matrix.shape[0]
+    weights = go_term_weights(score_df, go_ids, background_freqs)
+    num_go_terms = np.diff(matrix.indptr)
+    scores = matrix @ weights
+    return np.divide(scores, num_go_terms, out=np.zeros(len(scores)), where=num_go_terms > 0)
 
 
 def flatten_dict_to_tsv(nested_dict, output_filepath):
@@ -215,6 +189,10 @@ def flatten_dict_to_tsv(nested_dict, output_filepath):
     df['P_enrichment_norm'] = rankdata(df['P_enrichment'], method='min') / len(df)  # Normalized P enrichment
     df['C_enrichment_norm'] = rankdata(df['C_enrichment'], method='min') / len(df)  # Normalized C enrichment
 
+    # Similarity columns go last, so the normalised enrichment scores stay in columns 11-13 (read by add_go_enrichment.py)
+    similarity_columns = [column for column in df.columns if column.endswith('_similarity')]
+    df = df[[column for column in df.columns if column not in similarity_columns] + similarity_columns]
+
 
     # Write the DataFrame to a TSV file
     df.to_csv(output_filepath, sep='\t', index=False)
@@ -223,47 +201,34 @@ def flatten_dict_to_tsv(nested_dict, output_filepath):
 ## Main functions
 
 
-def make_enrichment_scores_tsv(P_filepath, F_filepath, C_filepath, output_filepath, goa_filepath, go_json_filepath):
+def make_enrichment_scores_tsv(P_filepath, F_filepath, C_filepath, output_filepath, goa_filepath, go_json_filepath, gaf_filters=None, propagate=False,
+                               known_genes_filepath=None, similarity_measure="lin"):
     # This needs to iterate through all genes in GO
-    goa_data = preload_goa(goa_filepath)
+    goa_data = preload_goa(goa_filepath, **(gaf_filters or {}))
     go_json_data = preprocess_json(go_json_filepath)
     P_data = pd.read_csv(P_filepath, sep='\t')
     F_data = pd.read_csv(F_filepath, sep='\t')
     C_data = pd.read_csv(C_filepath, sep='\t')
 
-    uniprot_go_dict = uniprot_to_go_list_optimized(goa_data, go_json_data)
-    global_freqs = get_global_counts(uniprot_go_dict)
-
-
-    # Iterate through each uniprot_id in the dictionary and calculate the enrichment score for each of P, F, C
-
-    total_uniprot_ids = len(uniprot_go_dict)
-
-    for index, key in enumerate(uniprot_go_dict.keys()):  # Iterate through all uniprot IDs in GO
-        print(f"Processing {index + 1} of {total_uniprot_ids} uniprot IDs.")
-        for go_lbl, go_id_list in uniprot_go_dict[key].items(): # Iterate through all GO terms for the uniprot ID
-            num_go_terms = len(go_id_list)
-            if go_lbl == "F":
-                score = get_go_scaled_count(F_data, go_id_list, global_freqs, "F")
-                if num_go_terms > 0:
-                    F_enrichment = score / num_go_terms
-                else:
-                    F_enrichment = 0    
-            elif go_lbl == "P":
-                score = get_go_scaled_count(P_data, go_id_list, global_freqs, "P")
-                if num_go_terms > 0:
-                    P_enrichment = score / num_go_terms
-                else:
-                    P_enrichment = 0
-            elif go_lbl == "C":
-                score = get_go_scaled_count(C_data, go_id_list, global_freqs, "C")
-                if num_go_terms > 0:
-                    C_enrichment = score / num_go_terms
-                else:
-                    C_enrichment = 0
-        uniprot_go_dict[key]["F_enrichment"] = F_enrichment
-        uniprot_go_dict[key]["P_enrichment"] = P_enrichment
-        uniprot_go_dict[key]["C_enrichment"] = C_enrichment
+    ontology = load_ontology(go_json_filepath) if propagate or known_genes_filepath else None
+    uniprot_go_dict = uniprot_to_go_list_optimized(goa_data, go_json_data, ontology if propagate else None)
+
+    # Score all uniprot IDs in GO at once for each of F, P, C
+    for go_set, score_df in (("F", F_data), ("P", P_data), ("C", C_data)):
+        scores = enrichment_scores(uniprot_go_dict, score_df, go_set)
+        for go_dict, score in zip(uniprot_go_dict.values(), scores):
+            go_dict[f"{go_set}_enrichment"] = score
+    print(f"Scored {len(uniprot_go_dict)} uniprot IDs.")
+
+    if known_genes_filepath:
+        # Semantic similarity uses the direct annotations, propagation is already part of the information content
+        known_uniprot_ids = pd.read_csv(known_genes_filepath, sep='\t').iloc[:, 2].tolist()
+        direct_go_dict = get_go_terms_optimized(goa_data)
+        for go_set in ("F", "P", "C"):
+            similarities = similarity_to_known_genes(direct_go_dict, ontology, known_uniprot_ids, go_set, similarity_measure)
+            for uniprot_id, similarity in zip(direct_go_dict, similarities):
+                uniprot_go_dict[uniprot_id][f"{go_set}_similarity"] = similarity
+        print(f"Scored {len(uniprot_go_dict)} uniprot IDs against {len(set(known_uniprot_ids))} known genes ({similarity_measure} BMA).")
     
     # Flatten the dictionary to a TSV
     flatten_dict_to_tsv(uniprot_go_dict, output_filepath)
@@ -282,11 +247,15 @@ def main():
     parser.add_argument("--output", type=str, help="Path to output TSV.")
     parser.add_argument("--goa", type=str, help="The path to the GO annotations file.")
     parser.add_argument("--go", type=str, help="Path to the GO terms JSON file.")
-
+    add_filter_arguments(parser)
+    parser.add_argument("--known_genes", type=str, help="genes_found_protein_only.tsv, adds the semantic similarity of each gene to these known MPD disease genes.")
+    parser.add_argument("--similarity", type=str, choices=MEASURES, default="lin", help="Term similarity for --known_genes (default: lin).")
+    parser.add_argument("--propagate", action="store_true", help="Also count the is_a/part_of ancestors of each annotated GO term (true-path rule). Use with counts from format_go_terms.py --propagate.")
     
     # Parse the arguments
     args = parser.parse_args()
-    make_enrichment_scores_tsv(args.P, args.F, args.C, args.output, args.goa, args.go)
+    make_enrichment_scores_tsv(args.P, args.F, args.C, args.output, args.goa, args.go, filter_options(args), args.propagate,
+                               args.known_genes, args.similarity)
     
 
 if __name__ == "__main__":